@@ -1,4 +1,17 @@
-from .extraction import link_extractor
-from .extraction import process_match
+import importlib
+
+# crawl functions are loaded on first use so that importing the package stays cheap,
+# the analytics modules (pandas) are only imported through functions.processing
+_lazy_attributes = {
+    "link_extractor": ".extraction",
+    "process_match": ".extraction",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        module = importlib.import_module(_lazy_attributes[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # import vlr_extract as extract
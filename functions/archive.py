@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+import re
+import threading
+import time
+
+ARCHIVE_DATA = "pages.dat"
+ARCHIVE_INDEX = "index.jsonl"
+
+_archive_lock = threading.Lock()
+_index_cache = {}
+
+
+def archive_page(archive_folder, url, raw_html):
+    """append a fetched page to the archive, the data file is a sequence of gzip members
+    and the index keeps the offset and length of each one
+
+    Args:
+        archive_folder (str): folder with the archive files
+        url (str): url of the fetched page
+        raw_html (bytes): page content as returned by the server
+    """
+    os.makedirs(archive_folder, exist_ok=True)
+    compressed = gzip.compress(raw_html)
+
+    with _archive_lock:
+        with open(os.path.join(archive_folder, ARCHIVE_DATA), "ab") as data_file:
+            offset = data_file.seek(0, os.SEEK_END)
+            data_file.write(compressed)
+
+        entry = {"url": url, "offset": offset, "length": len(compressed), "fetched_at": int(time.time())}
+        with open(os.path.join(archive_folder, ARCHIVE_INDEX), "a", encoding="utf-8") as index_file:
+            index_file.write(json.dumps(entry) + "\n")
+
+
+def load_archive_index(archive_folder):
+    """load the archive index, if a url was archived more than once the last copy is used
+
+    Args:
+        archive_folder (str): folder with the archive files
+
+    Returns:
+        dict: url -> (offset, length)
+    """
+    index_path = os.path.join(archive_folder, ARCHIVE_INDEX)
+    if not os.path.exists(index_path):
+        return {}
+
+    index_size = os.path.getsize(index_path)
+    cached = _index_cache.get(archive_folder)
+    if cached is not None and cached[0] == index_size:
+        return cached[1]
+
+    index = {}
+    with open(index_path, encoding="utf-8") as index_file:
+        for line in index_file:
+            if line.strip():
+                entry = json.loads(line)
+                index[entry["url"]] = (entry["offset"], entry["length"])
+
+    _index_cache[archive_folder] = (index_size, index)
+    return index
+
+
+def read_archived_page(archive_folder, url):
+    """read a page from the archive
+
+    Args:
+        archive_folder (str): folder with the archive files
+        url (str): url of the page
+
+    Returns:
+        bytes: page content, None if the url is not archived
+    """
+    location = load_archive_index(archive_folder).get(url)
+    if location is None:
+        return None
+
+    offset, length = location
+    with open(os.path.join(archive_folder, ARCHIVE_DATA), "rb") as data_file:
+        data_file.seek(offset)
+        return gzip.decompress(data_file.read(length))
+
+
+def archived_match_urls(archive_folder):
+    """list the match pages in the archive (tabs and event listings are excluded)
+
+    Args:
+        archive_folder (str): folder with the archive files
+
+    Returns:
+        list: match urls in archive order
+    """
+    return [url for url in load_archive_index(archive_folder) if re.match(r"^https?://[^/]+/\d+/[^/?]+$", url)]
+
+
+def match_id_from_url(url):
+    """numeric vlr match id of a match url
+
+    Args:
+        url (str): vlr match url
+
+    Returns:
+        int: match id, None if the url is not a match url
+    """
+    found = re.match(r"^https?://[^/]+/(\d+)(/|$)", url)
+    return int(found.group(1)) if found else None
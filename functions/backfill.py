@@ -0,0 +1,104 @@
+import csv
+
+from .archive import match_id_from_url
+from .crawler import crawl_matches
+from .extraction import link_extractor
+from .layout import iter_table_files
+
+VLR_URL = "https://www.vlr.gg"
+
+
+def parse_id_ranges(text):
+    """parse a list of ids and ranges like "427000-427100,428005"
+
+    Args:
+        text (str): comma separated ids and inclusive ranges
+
+    Returns:
+        list: ids in the given order
+    """
+    ids = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = (int(x) for x in part.split("-", 1))
+            ids.extend(range(first, last + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+
+def stored_match_urls(folder="csv", encoding="iso-8859-1"):
+    """match urls already stored in the draft files of the folder
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        list: match urls without duplicates
+    """
+    urls = {}
+    for file_path in iter_table_files(folder, "draft"):
+        with open(file_path, newline="", encoding=encoding) as f:
+            for row in csv.DictReader(f):
+                if row.get("source_url"):
+                    urls[row["source_url"]] = None
+    return list(urls)
+
+
+def stored_match_ids(folder="csv", encoding="iso-8859-1"):
+    """match ids already stored in the draft files of the folder
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        set: match ids
+    """
+    return {match_id_from_url(url) for url in stored_match_urls(folder, encoding)} - {None}
+
+
+def backfill(match_ids=None, event_ids=None, folder="csv", encoding="utf-8", workers=1, archive_folder=None,
+             tables_config=None, base_url=VLR_URL, state_path=None):
+    """crawl matches by numeric id and the matches of events by event id, without config.json edits.
+    The matches already stored in the folder are skipped before any request.
+
+    Args:
+        match_ids (list, optional): vlr match ids, the ids that are not a valid final match (not found,
+            forum threads) are skipped by process_match as invalid. Defaults to None.
+        event_ids (list, optional): vlr event ids, one listing request per event. Defaults to None.
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding. Defaults to "utf-8".
+        workers (int, optional): crawl_matches() workers. Defaults to 1.
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        tables_config (dict, optional): tables to extract, see select_tables(). Defaults to None.
+        base_url (str, optional): site url. Defaults to "https://www.vlr.gg".
+        state_path (str, optional): state store with the global match registry. Defaults to None.
+
+    Returns:
+        dict: crawl_matches() result
+    """
+    match_urls = [f"{base_url}/{match_id}" for match_id in match_ids or []]
+
+    for event_id in event_ids or []:
+        listing = f"{base_url}/event/matches/{event_id}/?series_id=all"
+        try:
+            match_urls.extend(link_extractor(listing, archive_folder=archive_folder))
+        except Exception as e:
+            print(f"error reading event {event_id}: {e}")
+
+    stored = stored_match_ids(folder, encoding)
+    scheduled = {}
+    for url in match_urls:
+        match_id = match_id_from_url(url)
+        if match_id is not None and match_id not in stored and match_id not in scheduled:
+            scheduled[match_id] = url
+
+    requested = {match_id_from_url(url) for url in match_urls} - {None}
+    print(f"Backfill: {len(scheduled)} matches to crawl, {len(requested) - len(scheduled)} already stored")
+    return crawl_matches(list(scheduled.values()), folder=folder, encoding=encoding, workers=workers,
+                         archive_folder=archive_folder, tables_config=tables_config, state_path=state_path)
@@ -0,0 +1,240 @@
+import math
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .archive import match_id_from_url
+from .extraction import TABLES, link_extractor, process_match
+from .memory import memory_slot, profile_match
+from .retry import queue_retry
+from .state import claim_match, finish_match
+
+
+def unique_urls(urls):
+    """remove repeated urls keeping the first position
+
+    Args:
+        urls (list): urls
+
+    Returns:
+        list: urls without duplicates
+    """
+    return list(dict.fromkeys(urls))
+
+
+def all_tables(tables_config=None):
+    """True if the tables config extracts every table for every event"""
+    if not tables_config:
+        return True
+    lists = [tables_config.get("tables") or TABLES] + list(tables_config.get("events", {}).values())
+    return all(set(TABLES) <= set(tables) for tables in lists)
+
+
+class MatchRegistry:
+    """matches claimed by a crawl run, by numeric match id. The ids are kept in memory for the run and,
+    with a state store, in its global match registry so that other events and later runs skip them.
+    A run with only some tables records its matches as partial, a later run can still extract the others"""
+
+    def __init__(self, state_path=None, tables_config=None):
+        self.state_path = state_path
+        self.run_id = uuid.uuid4().hex
+        self.claimed = set()
+        self.done_status = "done" if all_tables(tables_config) else "partial"
+
+    def claim(self, url):
+        """True if the match of the url has to be crawled by this run"""
+        match_id = match_id_from_url(url)
+        if match_id is None:
+            return True
+        if match_id in self.claimed:
+            return False
+        if self.state_path is not None and not claim_match(self.state_path, match_id, url, self.run_id):
+            return False
+        self.claimed.add(match_id)
+        return True
+
+    def finish(self, url, status):
+        """record the process_match() status of a claimed match"""
+        match_id = match_id_from_url(url)
+        if match_id is None or self.state_path is None:
+            return
+        status = self.done_status if status in ("processed", "skipped") else status
+        finish_match(self.state_path, match_id, status)
+
+
+def crawl_one(url, folder="csv", encoding="utf-8", archive_folder=None, tables_config=None, state_path=None):
+    """process a match inside the memory budget, the errors are printed. An error before the extraction
+    (the page could not be fetched) is added to the retry queue of state_path, the extraction errors are
+    saved in error_match by process_match
+
+    Returns:
+        tuple: (url, process_match() status or "failed" on error, seconds)
+    """
+    start = time.perf_counter()
+    try:
+        with memory_slot(), profile_match(url):
+            status = process_match(url, folder, encoding, archive_folder=archive_folder,
+                                   tables_config=tables_config)["status"]
+    except Exception as e:
+        print(f"error crawling {url}: {e}")
+        status = "failed"
+        if state_path is not None:
+            queue_retry(state_path, url, f"fetch: {type(e).__name__}: {e}")
+    return url, status, time.perf_counter() - start
+
+
+def crawl_matches(match_urls, folder="csv", encoding="utf-8", workers=1, archive_folder=None, tables_config=None,
+                  state_path=None):
+    """process a list of matches with a pool of threads, the request rate is the global one from
+    fetching.set_request_rate() and the matches wait for memory.set_memory_budget(). A match id is crawled
+    once, with state_path the matches of the global match registry are skipped
+
+    Args:
+        match_urls (list): vlr match urls
+        folder (str, optional): folder name. Defaults to "csv".
+        encoding (str, optional): encoding. Defaults to "utf-8".
+        workers (int, optional): matches processed at the same time. Defaults to 1.
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        tables_config (dict, optional): tables to extract, see select_tables(). Defaults to None.
+        state_path (str, optional): state store with the global match registry. Defaults to None.
+
+    Returns:
+        dict: {"matches", "duplicates", "failed", "seconds", "latencies"} with the time of every match in seconds
+    """
+    registry = MatchRegistry(state_path, tables_config)
+    urls = [url for url in unique_urls(match_urls) if registry.claim(url)]
+    result = {"matches": len(urls), "duplicates": len(unique_urls(match_urls)) - len(urls), "failed": [],
+              "seconds": 0.0, "latencies": []}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for url, status, seconds in pool.map(
+            lambda url: crawl_one(url, folder, encoding, archive_folder, tables_config, state_path), urls
+        ):
+            registry.finish(url, status)
+            result["latencies"].append(seconds)
+            if status == "failed":
+                result["failed"].append(url)
+    result["seconds"] = time.perf_counter() - start
+
+    return result
+
+
+def crawl_regions(listings, folder="csv", encoding="utf-8", workers=1, archive_folder=None, tables_config=None,
+                  on_listing_done=None, state_path=None):
+    """crawl the event listings of several regions at the same time with one pool of threads. The pool is
+    shared fairly: the regions take turns and a region with work has up to workers / regions with work
+    matches in progress, so a slow or failing region does not block the others. The requests of all the
+    regions go through the global rate limit of fetching.set_request_rate(). A match in several listings
+    is crawled once, see crawl_matches()
+
+    Args:
+        listings (dict): region -> event matches page urls, like the "url" of config.json
+        folder (str, optional): folder name. Defaults to "csv".
+        encoding (str, optional): encoding. Defaults to "utf-8".
+        workers (int, optional): matches and listings processed at the same time. Defaults to 1.
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        tables_config (dict, optional): tables to extract, see select_tables(). Defaults to None.
+        on_listing_done (callable, optional): called with the listing url once all its matches were crawled
+            without failure, the listings that could not be read or with failed matches are not passed, they
+            are crawled again by the next run. Defaults to None.
+        state_path (str, optional): state store with the global match registry. Defaults to None.
+
+    Returns:
+        dict: region -> {"listings", "listing_errors", "matches", "duplicates", "failed", "seconds"}
+    """
+    workers = max(workers, 1)
+    registry = MatchRegistry(state_path, tables_config)
+    regions = {
+        region: {"listings": deque(unique_urls(urls)), "matches": deque(), "running": 0, "start": None,
+                 "progress": {"listings": 0, "listing_errors": [], "matches": 0, "duplicates": 0, "failed": [],
+                              "seconds": 0.0}}
+        for region, urls in listings.items() if urls
+    }
+    remaining = {}  # listing -> matches not crawled yet
+    listing_failures = {}  # listing -> failed matches
+    order = deque(regions)
+    running = {}
+
+    def next_task(region, state):
+        if state["matches"]:
+            listing, url = state["matches"].popleft()
+            return "match", listing, pool.submit(crawl_one, url, folder, encoding, archive_folder, tables_config,
+                                                  state_path)
+        if state["listings"]:
+            listing = state["listings"].popleft()
+            print(f"{region}: {listing}")
+            return "listing", listing, pool.submit(link_extractor, listing, archive_folder=archive_folder)
+        return None
+
+    def has_work(state):
+        return state["running"] or state["matches"] or state["listings"]
+
+    def finish_listing(region, listing):
+        progress = regions[region]["progress"]
+        progress["listings"] += 1
+        print(f"{region}: {listing} done, {progress['matches']} matches, {len(progress['failed'])} failed, "
+              f"{progress['duplicates']} already crawled")
+        if listing_failures.get(listing):
+            print(f"{region}: {listing} has {listing_failures[listing]} failed matches, not marked as processed")
+        elif on_listing_done is not None:
+            on_listing_done(listing)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while any(has_work(state) for state in regions.values()):
+            share = math.ceil(workers / sum(1 for state in regions.values() if has_work(state)))
+            submitted = True
+            while len(running) < workers and submitted:  # one task per region and turn
+                submitted = False
+                for _ in range(len(order)):
+                    region = order[0]
+                    order.rotate(-1)
+                    state = regions[region]
+                    if len(running) >= workers or state["running"] >= share:
+                        continue
+                    task = next_task(region, state)
+                    if task is not None:
+                        kind, listing, future = task
+                        running[future] = (region, kind, listing)
+                        state["running"] += 1
+                        state["start"] = state["start"] or time.perf_counter()
+                        submitted = True
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                region, kind, listing = running.pop(future)
+                state = regions[region]
+                state["running"] -= 1
+                progress = state["progress"]
+
+                if kind == "listing":
+                    try:
+                        urls = unique_urls(future.result())
+                    except Exception as e:
+                        print(f"{region}: error reading {listing}: {e}")
+                        progress["listing_errors"].append(listing)
+                        urls = None
+                    if urls is not None:
+                        claimed = [url for url in urls if registry.claim(url)]
+                        progress["duplicates"] += len(urls) - len(claimed)
+                        urls = claimed
+                        remaining[listing] = len(urls)
+                        state["matches"].extend((listing, url) for url in urls)
+                        if not urls:
+                            finish_listing(region, listing)
+                else:
+                    url, status, _ = future.result()
+                    registry.finish(url, status)
+                    progress["matches"] += 1
+                    if status == "failed":
+                        progress["failed"].append(url)
+                        listing_failures[listing] = listing_failures.get(listing, 0) + 1
+                    remaining[listing] -= 1
+                    if remaining[listing] == 0:
+                        finish_listing(region, listing)
+
+                if not has_work(state):
+                    progress["seconds"] = time.perf_counter() - state["start"]
+
+    return {region: state["progress"] for region, state in regions.items()}
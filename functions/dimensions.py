@@ -0,0 +1,135 @@
+import csv
+import io
+import os
+import threading
+
+DIMENSIONS_FOLDER = "_dimensions"
+DIMENSIONS = ("player", "team", "map", "agent", "event")
+
+# dimension of the text columns of each table
+DIMENSION_COLUMNS = {
+    "draft": {
+        "team": "team",
+        "rival": "team",
+        "team_1_select_1": "map",
+        "team_2_select_1": "map",
+        "team_1_select_2": "map",
+        "team_2_select_2": "map",
+        "team_1_select_3": "map",
+        "team_2_select_3": "map",
+        "decider": "map",
+        "event": "event",
+    },
+    "round_detail": {"teamA": "team", "teamB": "team", "map": "map", "event": "event"},
+    "player_stats": {"team": "team", "player": "player", "agent": "agent", "map": "map", "event": "event"},
+    "player_performance": {"player": "player", "team": "team", "map": "map", "event": "event"},
+    "team_economy": {"team_a": "team", "team_b": "team", "map": "map", "event": "event"},
+}
+
+_dimension_lock = threading.Lock()
+_dimensions_cache = {}
+
+
+def set_dimension_lock(lock):
+    """replace the lock used to assign the keys, needed when several processes write the same folder
+
+    Args:
+        lock (Lock): threading or multiprocessing lock
+    """
+    global _dimension_lock
+    _dimension_lock = lock
+
+
+def get_dimension_path(folder, dimension):
+    """csv file of a dimension, with the columns id and value
+
+    Args:
+        folder (str): csv folder
+        dimension (str): dimension name
+
+    Returns:
+        str: file path
+    """
+    return os.path.join(folder, DIMENSIONS_FOLDER, f"{dimension}.csv")
+
+
+def _load_new_keys(folder, dimension):
+    """read the keys appended to the dimension file since the last read, other processes can append keys.
+    Must be called with the dimension lock"""
+    path = get_dimension_path(folder, dimension)
+    cached = _dimensions_cache.setdefault(path, {"keys": {}, "size": 0})
+    if not os.path.exists(path) or os.path.getsize(path) == cached["size"]:
+        return cached
+
+    with open(path, "rb") as f:
+        f.seek(cached["size"])
+        new_lines = f.read()
+    for row in csv.reader(io.StringIO(new_lines.decode("utf-8"), newline="")):
+        if row and row[0] != "id":
+            cached["keys"][row[1]] = int(row[0])
+    cached["size"] += len(new_lines)
+    return cached
+
+
+def load_dimension(folder, dimension):
+    """keys of a dimension, value -> integer key. The keys never change once assigned
+
+    Args:
+        folder (str): csv folder
+        dimension (str): dimension name
+
+    Returns:
+        dict: value -> key
+    """
+    with _dimension_lock:
+        return dict(_load_new_keys(folder, dimension)["keys"])
+
+
+def get_keys(folder, dimension, values):
+    """integer keys of some values, the new values get the next keys and are appended to the dimension file.
+    Empty values have the key 0
+
+    Args:
+        folder (str): csv folder
+        dimension (str): dimension name
+        values (iterable): dimension values
+
+    Returns:
+        dict: value -> key for the given values
+    """
+    values = {str(v) for v in values if v is not None and v == v and str(v) != ""}
+    with _dimension_lock:
+        cached = _load_new_keys(folder, dimension)
+        keys = cached["keys"]
+        new_values = sorted(values - keys.keys())
+
+        if new_values:
+            path = get_dimension_path(folder, dimension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            next_key = max(keys.values(), default=0) + 1
+            with open(path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if cached["size"] == 0 and f.tell() == 0:
+                    writer.writerow(["id", "value"])
+                for key, value in enumerate(new_values, next_key):
+                    writer.writerow([key, value])
+                    keys[value] = key
+            cached["size"] = os.path.getsize(path)
+
+        return {value: keys[value] for value in values}
+
+
+def register_table_values(folder, table, rows):
+    """assign the keys of the dimension values of new table rows, called when the rows are saved
+
+    Args:
+        folder (str): csv folder
+        table (str): table name
+        rows (dict): dict with one list per column
+    """
+    by_dimension = {}
+    for column, dimension in DIMENSION_COLUMNS.get(table, {}).items():
+        by_dimension.setdefault(dimension, set()).update(rows.get(column, ()))
+
+    for dimension, values in by_dimension.items():
+        get_keys(folder, dimension, values)
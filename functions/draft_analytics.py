@@ -0,0 +1,349 @@
+import csv
+import json
+import os
+import threading
+from collections import Counter
+
+from .layout import date_partition, iter_table_files, load_partition_patches, normalize_filename
+from .processed import match_key, match_patches
+
+DRAFT_AGGREGATES_FILE = "_draft_aggregates.json"
+DRAFT_JOURNAL_FILE = "_draft_aggregates.jsonl"
+# journal lines folded into the json snapshot when the aggregates are loaded
+JOURNAL_COMPACT_LINES = 1000
+
+_aggregates_lock = threading.Lock()
+_aggregates_cache = {}
+
+# own selections of a team row: team_1_select_1..3, by bo
+SELECTION_ROLES = {
+    "3": ("ban", "pick", "ban"),
+    "5": ("ban", "pick", "pick"),
+}
+
+
+def get_aggregates_path(folder="csv", name=DRAFT_AGGREGATES_FILE):
+    """path of the materialized draft aggregates
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        name (str, optional): snapshot or journal file name. Defaults to the snapshot.
+
+    Returns:
+        str: file path
+    """
+    return os.path.join(folder, name)
+
+
+def empty_aggregates():
+    """empty aggregates:
+        "teams": team -> list of the team drafts in date order
+        "counts": "team|map|event|patch" -> {"ban", "pick", "decider", "first_ban", "first_pick"}
+        "urls": match url -> teams of its records
+
+    Returns:
+        dict: aggregates dict
+    """
+    return {"teams": {}, "counts": {}, "urls": {}}
+
+
+def load_draft_aggregates(folder="csv"):
+    """load the draft aggregates, they are kept in memory after the first load. The json snapshot is read
+    and the journal of the matches added or removed since then is replayed, a long journal is folded into
+    the snapshot
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        dict: aggregates dict
+    """
+    path = get_aggregates_path(folder)
+    if path not in _aggregates_cache:
+        aggregates = empty_aggregates()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as json_file:
+                aggregates = json.load(json_file)
+        if isinstance(aggregates["urls"], list):  # snapshot written before the url index
+            aggregates["urls"] = {url: [] for url in aggregates["urls"]}
+            for team, team_records in aggregates["teams"].items():
+                for record in team_records:
+                    aggregates["urls"].setdefault(record["url"], []).append(team)
+
+        journal_lines = 0
+        journal_path = get_aggregates_path(folder, DRAFT_JOURNAL_FILE)
+        if os.path.exists(journal_path):
+            with open(journal_path, encoding="utf-8") as journal:
+                for line in journal:
+                    if line.strip():
+                        apply_journal_entry(aggregates, json.loads(line))
+                        journal_lines += 1
+
+        _aggregates_cache[path] = aggregates
+        if journal_lines > JOURNAL_COMPACT_LINES:
+            save_draft_aggregates(aggregates, folder)
+    return _aggregates_cache[path]
+
+
+def save_draft_aggregates(aggregates, folder="csv"):
+    """write the aggregates to a temporary file, replace the old one and empty the journal
+
+    Args:
+        aggregates (dict): aggregates dict
+        folder (str, optional): csv folder. Defaults to "csv".
+    """
+    path = get_aggregates_path(folder)
+    os.makedirs(folder, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as json_file:
+        json.dump(aggregates, json_file)
+    os.replace(path + ".tmp", path)
+    open(get_aggregates_path(folder, DRAFT_JOURNAL_FILE), "w", encoding="utf-8").close()
+
+
+def append_journal_entry(entry, folder="csv"):
+    """add a match change to the journal, one line per match whatever the size of the aggregates"""
+    os.makedirs(folder, exist_ok=True)
+    with open(get_aggregates_path(folder, DRAFT_JOURNAL_FILE), "a", encoding="utf-8") as journal:
+        journal.write(json.dumps(entry) + "\n")
+
+
+def apply_journal_entry(aggregates, entry):
+    """replay a journal entry: {"add": url, "records": [[team, record], ...]} or {"remove": url}"""
+    if "add" in entry:
+        if entry["add"] not in aggregates["urls"]:
+            for team, record in entry["records"]:
+                add_draft_record(aggregates, team, record)
+            aggregates["urls"][entry["add"]] = [team for team, _ in entry["records"]]
+    else:
+        remove_draft_records(aggregates, entry["remove"])
+
+
+def draft_row_to_record(row, patch="unknown"):
+    """summary of a draft csv row (one team perspective)
+
+    Args:
+        row (dict): draft row with the draft csv header
+        patch (str, optional): match patch. Defaults to "unknown".
+
+    Returns:
+        dict: team draft record
+    """
+    roles = SELECTION_ROLES.get(str(row["bo"]), SELECTION_ROLES["3"])
+    selections = [row["team_1_select_1"], row["team_1_select_2"], row["team_1_select_3"]]
+
+    return {
+        "rival": row["rival"],
+        "date": row["date"],
+        "event": row["event"],
+        "patch": patch,
+        "bo": str(row["bo"]),
+        "url": row["source_url"],
+        "bans": [m for m, role in zip(selections, roles) if role == "ban"],
+        "picks": [m for m, role in zip(selections, roles) if role == "pick"],
+        "decider": row["decider"],
+    }
+
+
+def add_draft_record(aggregates, team, record):
+    """add a team draft record and update the counters
+
+    Args:
+        aggregates (dict): aggregates dict
+        team (str): team tricode
+        record (dict): draft_row_to_record() dict
+    """
+    team_records = aggregates["teams"].setdefault(team, [])
+    team_records.append(record)
+    if len(team_records) > 1 and team_records[-2]["date"] > record["date"]:  # matches are not crawled in date order
+        team_records.sort(key=lambda r: r["date"])
+
+    def count(map_name, key):
+        counts_key = "|".join([team, map_name, record["event"], record["patch"]])
+        counters = aggregates["counts"].setdefault(
+            counts_key, {"ban": 0, "pick": 0, "decider": 0, "first_ban": 0, "first_pick": 0}
+        )
+        counters[key] += 1
+
+    for index, map_name in enumerate(record["bans"]):
+        count(map_name, "ban")
+        if index == 0:
+            count(map_name, "first_ban")
+    for index, map_name in enumerate(record["picks"]):
+        count(map_name, "pick")
+        if index == 0:
+            count(map_name, "first_pick")
+    count(record["decider"], "decider")
+
+
+def remove_draft_records(aggregates, url):
+    """remove the records of a match and their counters, only the teams of the match are scanned
+
+    Args:
+        aggregates (dict): aggregates dict
+        url (str): match url
+
+    Returns:
+        bool: True if the match was in the aggregates
+    """
+    if url not in aggregates["urls"]:
+        return False
+
+    for team in set(aggregates["urls"].pop(url)):
+        team_records = aggregates["teams"].get(team, [])
+        for record in [r for r in team_records if r["url"] == url]:
+            team_records.remove(record)
+
+            def uncount(map_name, key):
+                counters = aggregates["counts"].get("|".join([team, map_name, record["event"], record["patch"]]))
+                if counters and counters[key] > 0:
+                    counters[key] -= 1
+
+            for index, map_name in enumerate(record["bans"]):
+                uncount(map_name, "ban")
+                if index == 0:
+                    uncount(map_name, "first_ban")
+            for index, map_name in enumerate(record["picks"]):
+                uncount(map_name, "pick")
+                if index == 0:
+                    uncount(map_name, "first_pick")
+            uncount(record["decider"], "decider")
+    return True
+
+
+def remove_draft_match(url, folder="csv"):
+    """remove a match from the draft aggregates, used before a match is extracted again
+
+    Args:
+        url (str): match url
+        folder (str, optional): csv folder. Defaults to "csv".
+    """
+    with _aggregates_lock:
+        if remove_draft_records(load_draft_aggregates(folder), url):
+            append_journal_entry({"remove": url}, folder)
+
+
+def update_draft_aggregates(draft, url, basic_match_info=None, folder="csv"):
+    """add a match to the draft aggregates, called by process_match after save_draft_to_csv()
+
+    Args:
+        draft (dict): get_picks_bans() dict
+        url (str): match url
+        basic_match_info (dict, optional): basic match info dict, used for the patch. Defaults to None.
+        folder (str, optional): csv folder. Defaults to "csv".
+    """
+    header = draft["header"] + ["source_url"]
+    rows = [dict(zip(header, draft["team_A"] + [url])), dict(zip(header, draft["team_B"] + [url]))]
+    patch = basic_match_info["patch"] if basic_match_info else "unknown"
+    entry = {"add": url, "records": [[row["team"], draft_row_to_record(row, patch)] for row in rows]}
+
+    with _aggregates_lock:
+        aggregates = load_draft_aggregates(folder)
+        if url in aggregates["urls"]:
+            return
+        apply_journal_entry(aggregates, entry)
+        append_journal_entry(entry, folder)
+
+
+def stored_patches(folder="csv"):
+    """patch of the stored matches, from the match info recorded by process_match, the current aggregates
+    and the hive partitions
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        tuple: (match key -> patch, (event, date) -> patches of the hive partitions)
+    """
+    patches = {}
+    if os.path.exists(get_aggregates_path(folder)) or os.path.exists(get_aggregates_path(folder, DRAFT_JOURNAL_FILE)):
+        for team_records in load_draft_aggregates(folder)["teams"].values():
+            for record in team_records:
+                if record["patch"] != "unknown":
+                    patches[match_key(record["url"])] = record["patch"]
+    patches.update(match_patches(folder))
+    return patches, load_partition_patches(folder)
+
+
+def rebuild_draft_aggregates(folder="csv", encoding="iso-8859-1"):
+    """build the aggregates from all the draft csv files, the patch of a match comes from stored_patches()
+    ("unknown" if it was never recorded)
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        dict: aggregates dict
+    """
+    rows = []
+    for file_path in iter_table_files(folder, "draft"):
+        with open(file_path, newline="", encoding=encoding) as f:
+            rows.extend(csv.DictReader(f))
+
+    patches, partition_patches = stored_patches(folder)
+
+    def patch_of(row):
+        if match_key(row["source_url"]) in patches:
+            return patches[match_key(row["source_url"])]
+        partition = partition_patches.get((normalize_filename(row["event"]), date_partition(row["date"])), set())
+        return next(iter(partition)) if len(partition) == 1 else "unknown"
+
+    aggregates = empty_aggregates()
+    for row in sorted(rows, key=lambda r: r["date"]):
+        add_draft_record(aggregates, row["team"], draft_row_to_record(row, patch_of(row)))
+        aggregates["urls"].setdefault(row["source_url"], []).append(row["team"])
+
+    with _aggregates_lock:
+        save_draft_aggregates(aggregates, folder)
+        _aggregates_cache[get_aggregates_path(folder)] = aggregates
+
+    return aggregates
+
+
+def map_rates(team, folder="csv", event=None, patch=None):
+    """ban, pick and decider rates of a team by map
+
+    Args:
+        team (str): team tricode
+        folder (str, optional): csv folder. Defaults to "csv".
+        event (str, optional): only this event. Defaults to None.
+        patch (str, optional): only this patch. Defaults to None.
+
+    Returns:
+        dict: map -> {"ban", "pick", "decider", "first_ban", "first_pick"} as a share of the team matches
+    """
+    aggregates = load_draft_aggregates(folder)
+    matches = [
+        r for r in aggregates["teams"].get(team, [])
+        if (event is None or r["event"] == event) and (patch is None or r["patch"] == patch)
+    ]
+    if not matches:
+        return {}
+
+    totals = {}
+    for counts_key, counters in aggregates["counts"].items():
+        key_team, map_name, key_event, key_patch = counts_key.split("|")
+        if key_team != team or (event is not None and key_event != event) or (patch is not None and key_patch != patch):
+            continue
+        map_totals = totals.setdefault(map_name, Counter())
+        map_totals.update(counters)
+
+    return {map_name: {k: v / len(matches) for k, v in counters.items()} for map_name, counters in totals.items()}
+
+
+def first_ban_distribution(team, last_n=None, folder="csv"):
+    """share of each map as first ban in the last matches of a team
+
+    Args:
+        team (str): team tricode
+        last_n (int, optional): number of matches, all if None. Defaults to None.
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        dict: map -> share of matches
+    """
+    records = load_draft_aggregates(folder)["teams"].get(team, [])
+    if last_n is not None:
+        records = records[-last_n:]
+    first_bans = Counter(r["bans"][0] for r in records if r["bans"])
+    return {map_name: n / len(records) for map_name, n in first_bans.most_common()}
@@ -0,0 +1,102 @@
+import csv
+import gzip
+import io
+import json
+import os
+import time
+
+from .extraction import TABLES
+from .layout import iter_table_files, read_table_tail
+from .state import get_connection
+
+EXPORT_MANIFEST = "_manifest.jsonl"
+
+
+def export_table_delta(table, folder="csv", export_folder="export", state_path="state.sqlite", encoding="iso-8859-1"):
+    """write the rows of a table added since the last export to a gzip csv, one per csv header and mode.
+    The high-water mark of every table file (byte offset and inode) is kept in the state store and
+    moved only after the export file is complete. A file replaced since the last export (refresh, retry)
+    is exported in full in a "replace" part, its previous rows are outdated. The new rows of the other
+    files go to "append" parts. Every source of a part has its rows [start_row, end_row) in the manifest
+
+    Args:
+        table (str): table name
+        folder (str, optional): csv folder. Defaults to "csv".
+        export_folder (str, optional): export output folder. Defaults to "export".
+        state_path (str, optional): state store file. Defaults to "state.sqlite".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        int: exported rows
+    """
+    connection = get_connection(state_path)
+    target = os.path.abspath(export_folder)
+    marks = {row[0]: (row[1], row[2]) for row in connection.execute(
+        "SELECT file, inode, offset FROM export_mark WHERE target = ? AND table_name = ?", (target, table))}
+
+    parts = {}  # (header, mode) -> rows and sources
+    new_marks = []
+    for file_path in iter_table_files(folder, table):
+        stat = os.stat(file_path)
+        mark = marks.get(file_path)
+        if mark is not None and mark == (stat.st_ino, stat.st_size):
+            continue
+        replaced = mark is not None and (mark[0] != stat.st_ino or stat.st_size < mark[1])
+
+        header_line, data, offset = read_table_tail(file_path, mark[1] if mark and not replaced else None)
+        new_marks.append((target, file_path, table, stat.st_ino, offset, time.time()))
+        if not data:
+            continue
+
+        mode = "replace" if replaced else "append"
+        rows = sum(1 for _ in csv.reader(io.StringIO(data.decode(encoding), newline="")))
+        part = parts.setdefault((header_line, mode), {"data": [], "sources": [], "rows": 0})
+        part["data"].append(data)
+        part["sources"].append({"file": os.path.relpath(file_path, folder), "mode": mode,
+                                "start_row": part["rows"], "end_row": part["rows"] + rows})
+        part["rows"] += rows
+
+    exported = 0
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    os.makedirs(os.path.join(export_folder, table), exist_ok=True)
+    index = 0
+    for (header_line, mode), part in parts.items():
+        while os.path.exists(os.path.join(export_folder, table, f"{table}_{stamp}_{index}.csv.gz")):
+            index += 1
+        export_path = os.path.join(export_folder, table, f"{table}_{stamp}_{index}.csv.gz")
+        with gzip.open(export_path + ".tmp", "wb") as f:
+            f.write(header_line)
+            for data in part["data"]:
+                f.write(data)
+        os.replace(export_path + ".tmp", export_path)
+
+        entry = {"table": table, "path": os.path.relpath(export_path, export_folder), "mode": mode,
+                 "rows": part["rows"], "encoding": encoding, "exported_at": stamp, "sources": part["sources"]}
+        with open(os.path.join(export_folder, EXPORT_MANIFEST), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        exported += part["rows"]
+
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO export_mark VALUES (?, ?, ?, ?, ?, ?)", new_marks)
+    return exported
+
+
+def export_delta(folder="csv", export_folder="export", state_path="state.sqlite", tables=None,
+                 encoding="iso-8859-1"):
+    """delta export of the tables, see export_table_delta()
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        export_folder (str, optional): export output folder. Defaults to "export".
+        state_path (str, optional): state store file. Defaults to "state.sqlite".
+        tables (list, optional): tables to export. Defaults to None (all the tables).
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        dict: exported rows by table
+    """
+    exported = {}
+    for table in tables or TABLES:
+        exported[table] = export_table_delta(table, folder, export_folder, state_path, encoding)
+        print(f"{table}: {exported[table]} new rows")
+    return exported
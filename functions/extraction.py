@@ -1,49 +1,144 @@
-from bs4 import BeautifulSoup, Comment
-from urllib.request import urlopen
+from bs4 import BeautifulSoup, Comment, SoupStrainer
+from contextlib import contextmanager
+from urllib.error import HTTPError
+from urllib.parse import urljoin
 import csv
+import html as html_entities
 import re
 import time
 import random
-import pandas as pd
+import threading
 import os
 
+from .archive import archive_page, match_id_from_url, read_archived_page
+from .dimensions import register_table_values
+from .draft_analytics import remove_draft_match, update_draft_aggregates
+from .fetching import fetch_page_with_url, use_politeness_delay
+from .layout import get_dataset_layout, get_table_path, normalize_filename, register_partition
+from .memory import profile_step
+from .processed import (clear_processed_tables, mark_table_processed, mark_table_started, processed_tables,
+                        record_match_patch, started_tables)
+from .stats_aggregates import (columns_to_rows, remove_match_aggregates, update_player_aggregates,
+                               update_team_aggregates)
+from .streaming import stream_match, stream_rows
+
+_write_lock = threading.Lock()
+_fetched_pages = threading.local()
+
+# parts of the vlr match page (and performance / economy tabs) used by the extractors,
+# the navigation, sidebars, comments section and ads are not parsed
+MATCH_PAGE_SECTIONS = SoupStrainer(class_=["match-header", "vm-stats-gamesnav", "vm-stats-container", "vlr-rounds"])
+MATCH_LINKS = SoupStrainer("a", href=True)
+
 
 # Structure for file folders and save csv
-def get_folder_path(folder_name, normalized_tournament, file_prefix):
-    """Create the file path for the csv
+def set_write_lock(lock):
+    """replace the lock used to serialize csv writes, needed when several processes write the same folder
 
     Args:
-        folder_name (string): folder name for the csv
-        normalized_tournament (string): tournament in the path format
-        file_prefix (string): prefix for the file name
+        lock (Lock): threading or multiprocessing lock
+    """
+    global _write_lock
+    _write_lock = lock
 
-    Returns:
-        string: string with the path for the save to csv files
+
+def append_rows_to_csv(file_path, header, rows, encoding='utf-8'):
+    """append rows to a csv and write the header if the file is new
+
+    Args:
+        file_path (str): csv file path
+        header (list): column names
+        rows (iterable): rows to append
+        encoding (str, optional): encoding for the csv file. Defaults to 'utf-8'.
     """
-    if file_prefix is None:
-        print("Add file suffix")
+    with _write_lock:
+        file_exists = os.path.isfile(file_path)
+
+        with open(file_path, "a", newline="", encoding=encoding) as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(header)
 
-    folder_path = os.path.join(folder_name, normalized_tournament)
-    os.makedirs(folder_path, exist_ok=True)
+            writer.writerows(rows)
 
-    file_path = os.path.join(folder_path, f'{file_prefix}_{normalized_tournament}.csv')
 
-    return file_path
+# column with the team of each row, used with "event" and "date" to find the rows of a match
+MATCH_TEAM_COLUMNS = {
+    "draft": "team",
+    "round_detail": "teamA",
+    "player_stats": "team",
+    "player_performance": "team",
+    "team_economy": "team_a",
+}
 
 
-def normalize_filename(name):
-    """normalize the file name for the path
+def remove_match_rows(basic_match_info, folder="csv", encoding="utf-8", tables=None):
+    """remove the rows of a match from the table files, the files are replaced atomically
 
     Args:
-        name (string): string (usually tournamnet name)
+        basic_match_info (dict): basic match info dict of the match
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding of the csv files. Defaults to "utf-8".
+        tables (iterable, optional): tables to clean, all if None. Defaults to None.
 
     Returns:
-        string: normalized tournament name
+        int: removed rows
     """
-    name = name.lower()
-    name = re.sub(r'[^\w\s-]', '', name)
-    name = re.sub(r'\s+', '_', name)
-    return name.strip('_')
+    teams = {basic_match_info[key] for key in ("team_a", "team_b", "team_a_tricode", "team_b_tricode")}
+    removed = 0
+
+    for table in tables or MATCH_TEAM_COLUMNS:
+        file_path = get_table_path(folder, table, basic_match_info["event"], basic_match_info["date"])
+        team_column = MATCH_TEAM_COLUMNS[table]
+
+        with _write_lock:
+            if not os.path.isfile(file_path):
+                continue
+            with open(file_path, newline="", encoding=encoding) as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                rows = list(reader)
+            if header is None:
+                continue
+
+            event_index = header.index("event")
+            date_index = header.index("date")
+            team_index = header.index(team_column)
+            kept = [
+                row for row in rows
+                if not (row[event_index] == basic_match_info["event"]
+                        and row[date_index] == basic_match_info["date"]
+                        and row[team_index] in teams)
+            ]
+            if len(kept) == len(rows):
+                continue
+
+            temp_path = file_path + ".tmp"
+            with open(temp_path, "w", newline="", encoding=encoding) as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(kept)
+            os.replace(temp_path, file_path)
+            removed += len(rows) - len(kept)
+
+    return removed
+
+
+def save_dict_to_csv(table_dict, file_prefix, folder="csv", encoding='utf-8'):
+    """save a dict of columns (all the get_* dicts with an "event" column) to csv
+
+    Args:
+        table_dict (dict): dict with one list per column
+        file_prefix (str): prefix for the file name
+        folder (str, optional): name of the default folder for the export. Defaults to "csv".
+        encoding (str, optional): encoding for the csv file. Defaults to 'utf-8'.
+    """
+    date = table_dict["date"][0] if table_dict.get("date") else None
+    file_path = get_table_path(folder, file_prefix, table_dict["event"][0], date)
+
+    append_rows_to_csv(file_path, list(table_dict), zip(*table_dict.values()), encoding=encoding)
+    register_table_values(folder, file_prefix, table_dict)
+    stream_rows(file_prefix, table_dict)
 
 
 def save_draft_to_csv(draft, url, folder="csv", encoding='utf-8'):
@@ -57,19 +152,17 @@ def save_draft_to_csv(draft, url, folder="csv", encoding='utf-8'):
     """
 
     tournament_name = draft['team_A'][-1]
-    normalized_tournament = normalize_filename(tournament_name)
+    date = draft['team_A'][draft["header"].index("date")]
 
-    file_path = get_folder_path(folder_name=folder, normalized_tournament=normalized_tournament, file_prefix="draft")
+    file_path = get_table_path(folder, "draft", tournament_name, date)
 
     header = draft["header"] + ["source_url"]
-    file_exists = os.path.isfile(file_path)
+    rows = [draft["team_A"] + [url], draft["team_B"] + [url]]
 
-    with open(file_path, mode='a', newline='', encoding=encoding) as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(header)
-        writer.writerow(draft["team_A"] + [url])
-        writer.writerow(draft["team_B"] + [url])
+    append_rows_to_csv(file_path, header, rows, encoding=encoding)
+    draft_dict = dict(zip(header, zip(*rows)))
+    register_table_values(folder, "draft", draft_dict)
+    stream_rows("draft", draft_dict)
 
 
 def save_round_detail_to_csv(detail_round_dict, folder="csv", encoding='utf-8'):  # stats from the teams
@@ -80,22 +173,7 @@ def save_round_detail_to_csv(detail_round_dict, folder="csv", encoding='utf-8'):
         folder (str, optional): name of the default folder for the export. Defaults to "csv".
         encoding (str, optional): encoding for the csv file. Defaults to 'utf-8'.
     """
-    tournament_name = detail_round_dict["event"][0]  # Medio raro esto
-    normalized_tournament = normalize_filename(tournament_name)
-
-    file_path = get_folder_path(folder_name=folder, normalized_tournament=normalized_tournament,
-                                file_prefix="round_detail")
-
-    header = list(detail_round_dict)
-    file_exists = os.path.isfile(file_path)
-
-    with open(file_path, "a", newline="", encoding=encoding) as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(header)
-
-        writer.writerows(zip(*detail_round_dict.values()))
-        f.close()
+    save_dict_to_csv(detail_round_dict, "round_detail", folder=folder, encoding=encoding)
 
 
 def save_player_performance_to_csv(player_performance_dict, folder="csv", encoding='utf-8'):
@@ -106,22 +184,7 @@ def save_player_performance_to_csv(player_performance_dict, folder="csv", encodi
         folder (str, optional): name of the default folder for the export. Defaults to "csv".
         encoding (str, optional): encoding for the csv file. Defaults to 'utf-8'.
     """
-    tournament_name = player_performance_dict["event"][0]
-    normalized_tournament = normalize_filename(tournament_name)
-
-    file_path = get_folder_path(folder_name=folder, normalized_tournament=normalized_tournament,
-                                file_prefix="player_performance")
-
-    header = player_performance_dict.keys()
-    file_exists = os.path.isfile(file_path)
-
-    with open(file_path, "a", newline="", encoding=encoding) as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(header)
-
-        writer.writerows(zip(*player_performance_dict.values()))
-        f.close()
+    save_dict_to_csv(player_performance_dict, "player_performance", folder=folder, encoding=encoding)
 
 
 def save_team_economy(economy_dict, folder="csv", encoding="utf-8"):
@@ -132,22 +195,7 @@ def save_team_economy(economy_dict, folder="csv", encoding="utf-8"):
         folder (str, optional): name of the default folder for the export. Defaults to "csv".
         encoding (str, optional): encoding for the csv file. Defaults to 'utf-8'.
     """
-    tournament_name = economy_dict["event"][0]
-    normalized_tournament = normalize_filename(tournament_name)
-
-    file_path = get_folder_path(folder_name=folder, normalized_tournament=normalized_tournament,
-                                file_prefix="team_economy")
-
-    header = economy_dict.keys()
-    file_exists = os.path.isfile(file_path)
-
-    with open(file_path, "a", newline="", encoding=encoding) as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(header)
-
-        writer.writerows(zip(*economy_dict.values()))
-        f.close()
+    save_dict_to_csv(economy_dict, "team_economy", folder=folder, encoding=encoding)
 
 
 def save_player_stats_to_csv(player_stats_dict, folder="csv", encoding='utf-8'):
@@ -158,22 +206,7 @@ def save_player_stats_to_csv(player_stats_dict, folder="csv", encoding='utf-8'):
         folder (str, optional): name of the default folder for the export. Defaults to "csv".
         encoding (str, optional): encoding for the csv file. Defaults to 'utf-8'.
     """
-    tournament_name = player_stats_dict["event"][0]
-    normalized_tournament = normalize_filename(tournament_name)
-
-    file_path = get_folder_path(folder_name=folder, normalized_tournament=normalized_tournament,
-                                file_prefix="player_stats")
-
-    header = player_stats_dict.keys()
-    file_exists = os.path.isfile(file_path)
-
-    with open(file_path, "a", newline="", encoding=encoding) as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(header)
-
-        writer.writerows(zip(*player_stats_dict.values()))
-        f.close()
+    save_dict_to_csv(player_stats_dict, "player_stats", folder=folder, encoding=encoding)
 
 
 def save_match_error(match_error_dict, folder="csv", encoding='utf-8'):
@@ -184,44 +217,98 @@ def save_match_error(match_error_dict, folder="csv", encoding='utf-8'):
         folder (str, optional): name of the default folder for the export. Defaults to "csv".
         encoding (str, optional): encoding for the csv file. Defaults to 'utf-8'.
     """
-    tournament_name = match_error_dict["event"][0]
-    normalized_tournament = normalize_filename(tournament_name)
-
-    file_path = get_folder_path(folder_name=folder, normalized_tournament=normalized_tournament,
-                                file_prefix="error_match")
+    save_dict_to_csv(match_error_dict, "error_match", folder=folder, encoding=encoding)
 
-    header = match_error_dict.keys()
-    file_exists = os.path.isfile(file_path)
 
-    with open(file_path, "a", newline="", encoding=encoding) as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(header)
+@contextmanager
+def fetched_pages(pages):
+    """let soup_open() use pages the current thread already downloaded instead of requesting them again
 
-        writer.writerows(zip(*match_error_dict.values()))
-        f.close()
+    Args:
+        pages (dict): page url -> (page content in bytes, url after the redirects), the pages are
+            already archived
+    """
+    _fetched_pages.pages = pages
+    try:
+        yield
+    finally:
+        _fetched_pages.pages = None
 
 
-def soup_open(url=None, decode="iso-8859-1"):
+def soup_open(url=None, decode="iso-8859-1", archive_folder=None, offline=False, parse_only=None, return_url=False):
     """Open a url with BeautifulSoup and return a bs4.BeautifulSoup
 
     Args:
         url (str, optional): vlr match url. Defaults to None.
         decode (str, optional): decode for the BeautifulSoup. Defaults to "iso-8859-1".
+        archive_folder (str, optional): folder of the raw html archive, every fetched page is archived. Defaults to None.
+        offline (bool, optional): read the page from the archive instead of the network. Defaults to False.
+            The pages of fetched_pages() are not requested either.
+        parse_only (bs4.SoupStrainer, optional): parse only the matching tags, the page title is always kept. Defaults to None.
+        return_url (bool, optional): also return the url after the redirects (vlr.gg/<id> goes to the full match url). Defaults to False.
 
     Returns:
-        bs4.BeautifulSoup: BeautifulSoup object with the HTML info
+        bs4.BeautifulSoup: BeautifulSoup object with the HTML info, (soup, url) with return_url
     """
     if url is None:
         print("Add a url")
 
-    page = urlopen(url)
-    html = page.read().decode(decode)
-    soup = BeautifulSoup(html, "html.parser")
-
+    if offline:
+        raw_html = read_archived_page(archive_folder, url)
+        if raw_html is None:
+            raise ValueError(f"page not archived: {url}")
+    elif (getattr(_fetched_pages, "pages", None) or {}).get(url) is not None:
+        raw_html, url = _fetched_pages.pages[url]
+    else:
+        raw_html, url = fetch_page_with_url(url)
+        if archive_folder is not None:
+            archive_page(archive_folder, url, raw_html)
+
+    html = raw_html.decode(decode)
+    soup = BeautifulSoup(html, "html.parser", parse_only=parse_only)
+
+    if parse_only is not None:
+        title = re.search(r"<title>(.*?)</title>", html, re.S)
+        if title:
+            title_tag = soup.new_tag("title")
+            title_tag.string = html_entities.unescape(title.group(1))
+            soup.insert(0, title_tag)
+
+    if return_url:
+        return soup, url
     return soup
 
 
+def parse_credits(value):
+    """convert a vlr bank value ("3.4k", "500") to credits
+
+    Args:
+        value (str): bank text
+
+    Returns:
+        int: credits, None if the value is empty
+    """
+    value = value.strip().lower()
+    if not value:
+        return None
+    if value.endswith("k"):
+        return int(round(float(value[:-1]) * 1000))
+    return int(float(value))
+
+
+def parse_percentage(value):
+    """convert a vlr percentage ("73%") to float, the empty cells (non breaking space) are 0
+
+    Args:
+        value (str): percentage text
+
+    Returns:
+        float: percentage value
+    """
+    value = value.replace('\xa0', '').strip().rstrip('%')
+    return float(value) if value else 0.0
+
+
 def get_basic_match_info(soup):
     """extract the basic match info from the vlr match page, used in other functions and for check the match status:
         ["team_a"
@@ -430,12 +517,16 @@ def get_picks_bans(soup, basic_match_info=None):
 # Round detail
 
 def round_detail_to_dict(round_detail, folder="csv", encoding="utf-8"):
-    """process the get_round_detail() dict to a valid format and save the csv
+    """process the get_round_detail() dict to a valid format and save the csv, only the team A perspective
+    is stored (processing.load_round_detail() adds the team B rows)
 
     Args:
         round_detail (dict): dict from get_round_detail()
         folder (str, optional): folder to save the csv. Defaults to "csv".
         encoding (str, optional): encoding to save the csv. Defaults to "utf-8".
+
+    Returns:
+        dict: saved rows, one list per column
     """
     round_detail_for_csv = {
         "teamA": [],
@@ -478,43 +569,24 @@ def round_detail_to_dict(round_detail, folder="csv", encoding="utf-8"):
         round_detail_for_csv["event"].append(round_detail["event"])
 
     save_round_detail_to_csv(round_detail_for_csv, folder=folder, encoding=encoding)
+    return round_detail_for_csv
 
-    team_b_prespective = {
-        "teamA": round_detail_for_csv["teamB"],
-        "map": round_detail_for_csv["map"],
-        "side": ["def" if "atk" in x else "atk" for x in round_detail_for_csv["side"]],
-        "teamB": round_detail_for_csv["teamA"],
-        "rndA": round_detail_for_csv["rndB"],
-        "rndB": round_detail_for_csv["rndA"],
-        "round": round_detail_for_csv["round"],
-        "winCon": round_detail_for_csv["winCon"],
-        "date": round_detail_for_csv["date"],
-        "map_order": round_detail_for_csv["map_order"],
-        'event': round_detail_for_csv["event"]
-    }
 
-    save_round_detail_to_csv(team_b_prespective, folder=folder, encoding=encoding)
-
-
-def get_round_detail(soup, basic_match_info=None, folder="csv", encoding="utf-8"):
-    """extract round info from a vlr match.
+def new_round_info(basic_match_info, map_name, map_order):
+    """empty get_round_detail() dict for one map
 
     Args:
-        soup (bs4.BeautifulSoup): BeautifulSoup object with the HTML info
-        basic_match_info (dict, optional): basic match info dict. Defaults to None.
-        folder (str, optional): folder to save the extracted data. Defaults to "csv".
-        encoding (str, optional): encoding to save the extracted data. Defaults to "utf-8".
+        basic_match_info (dict): basic match info dict
+        map_name (str): map name
+        map_order (int): position of the map in the match
 
     Returns:
-        dict: round info dict
+        dict: round info dict without rounds
     """
-    if basic_match_info is None:
-        print("basic_match_info required")
-
-    round_info = {
-        "team_a": None,
-        "team_b": None,
-        "map": None,
+    return {
+        "team_a": basic_match_info["team_a_tricode"],
+        "team_b": basic_match_info["team_b_tricode"],
+        "map": map_name,
         "teamACT": [],
         "teamATT": [],
         "teamBCT": [],
@@ -523,128 +595,156 @@ def get_round_detail(soup, basic_match_info=None, folder="csv", encoding="utf-8"
         "rdef": [],
         "winConAtk": [],
         "winConDef": [],
-        "date": None,
-        "map_order": None,
-        "event": None,
+        "date": basic_match_info["date"],
+        "map_order": map_order,
+        "event": basic_match_info["event"],
     }
 
-    maps = []
 
-    map_div = soup.find_all("div", class_="map")
+def read_round_column(column):
+    """read a vlr-rounds column from the tag attributes: the first square is team A, the winner square
+    has the mod-win class, the side class (mod-t / mod-ct) and the win condition image
 
-    for map in map_div:
-        map_name_span = map.find("span", attrs={"style": "position: relative;"})
-        map_name = map_name_span.find(string=True, recursive=False).strip()
-        maps.append(map_name)
+    Args:
+        column (bs4.element.Tag): vlr-rounds-row-col div
+
+    Returns:
+        tuple: (round number, team A won, team A attacking, win condition), None for the team name
+        and spacer columns
 
-    bloques = soup.find_all("div", class_="vlr-rounds-row-col")
-    control_value = 0
-    mapNumber = 0
+    Raises:
+        ValueError: if the column has a round number but can't be read
+    """
+    round_number = column.find("div", class_="rnd-num")
+    if round_number is None:
+        return None
 
-    round_info["date"] = basic_match_info["date"]
-    round_info["map"] = maps[mapNumber]
-    round_info["map_order"] = mapNumber
+    value = int(round_number.get_text(strip=True))
 
-    round_info["event"] = basic_match_info["event"]
+    squares = column.find_all("div", class_="rnd-sq")
+    if len(squares) != 2:
+        raise ValueError(f"{len(squares)} round squares")
 
-    for count, ronda in enumerate(bloques):
-        try:
-            round_info["team_a"] = basic_match_info["team_a_tricode"]
-            round_info["team_b"] = basic_match_info["team_b_tricode"]
-            value = int(ronda.find_all("div", class_="rnd-num")[0].text.strip())
-            imgUrl = str(ronda.find_all("img")[0])
-            victory_condition = imgUrl[0:-3].split("/")[-1].rstrip(".webp")
-
-            if value >= control_value:
-                control_value = value
-                round_for_eval = re.findall(r"rnd-sq(.*)", str(bloques[count]))
-                if round_for_eval[0] == ' mod-win mod-ct">':
-                    round_info["teamACT"].append(1)
-                    round_info["teamBTT"].append(0)
-                    round_info["rdef"].append(value)
-                    round_info["winConDef"].append(victory_condition)
-                elif round_for_eval[0] == ' mod-win mod-t">':
-                    round_info["teamATT"].append(1)
-                    round_info["teamBCT"].append(0)
-                    round_info["ratk"].append(value)
-                    round_info["winConAtk"].append(victory_condition)
-                if round_for_eval[1] == ' mod-win mod-ct">':
-                    round_info["teamBCT"].append(1)
-                    round_info["teamATT"].append(0)
-                    round_info["ratk"].append(value)
-                    round_info["winConAtk"].append(victory_condition)
-                elif round_for_eval[1] == ' mod-win mod-t">':
-                    round_info["teamBTT"].append(1)
-                    round_info["teamACT"].append(0)
-                    round_info["rdef"].append(value)
-                    round_info["winConDef"].append(victory_condition)
+    winners = [index for index, square in enumerate(squares) if "mod-win" in square.get("class", [])]
+    if len(winners) != 1:
+        raise ValueError(f"{len(winners)} winners")
+
+    winner_square = squares[winners[0]]
+    classes = winner_square.get("class", [])
+    if "mod-t" in classes:
+        winner_attacking = True
+    elif "mod-ct" in classes:
+        winner_attacking = False
+    else:
+        raise ValueError("winner without side")
+
+    img = winner_square.find("img")
+    if img is None or not img.get("src"):
+        raise ValueError("winner without win condition")
+    victory_condition = os.path.splitext(os.path.basename(img["src"]))[0]
+
+    team_a_won = winners[0] == 0
+    team_a_attacking = winner_attacking == team_a_won
+
+    return value, team_a_won, team_a_attacking, victory_condition
+
+
+def get_round_detail(soup, basic_match_info=None, folder="csv", encoding="utf-8"):
+    """extract round info from a vlr match, every map is read in a single pass over the vlr-rounds block of
+    its vm-stats-game container. Rounds that can't be read are reported and listed in the "malformed_rounds"
+    key of the returned dict, process_match saves them in error_match.
+
+    Args:
+        soup (bs4.BeautifulSoup): BeautifulSoup object with the HTML info
+        basic_match_info (dict, optional): basic match info dict. Defaults to None.
+        folder (str, optional): folder to save the extracted data. Defaults to "csv".
+        encoding (str, optional): encoding to save the extracted data. Defaults to "utf-8".
+
+    Returns:
+        dict: round info dict of the last map, the saved csv rows of every map are in "saved_rows"
 
+    Raises:
+        ValueError: if a map has no rounds block
+    """
+    if basic_match_info is None:
+        print("basic_match_info required")
+
+    malformed_rounds = []
+    round_infos = []
+
+    # every map has its own vm-stats-game container with the map header and the vlr-rounds block,
+    # the "all" container has no map header
+    for game in soup.find_all("div", class_="vm-stats-game"):
+        map_div = game.find("div", class_="map")
+        if map_div is None:
+            continue
+        map_name_span = map_div.find("span", attrs={"style": "position: relative;"})
+        map_name = map_name_span.find(string=True, recursive=False).strip()
+
+        rounds_block = game.find("div", class_="vlr-rounds")
+        if rounds_block is None:
+            raise ValueError(f"no rounds block for {map_name}")
+
+        round_info = new_round_info(basic_match_info, map_name, len(round_infos))
+
+        for column in rounds_block.find_all("div", class_="vlr-rounds-row-col"):
+            try:
+                round_read = read_round_column(column)
+            except ValueError as e:
+                malformed_rounds.append((map_name, column.get_text(" ", strip=True), str(e)))
+                print(f"malformed round in {map_name}: {e}")
+                continue
+
+            if round_read is None:
+                continue
+
+            value, team_a_won, team_a_attacking, victory_condition = round_read
+            if team_a_attacking:
+                round_info["teamATT"].append(int(team_a_won))
+                round_info["teamBCT"].append(int(not team_a_won))
+                round_info["ratk"].append(value)
+                round_info["winConAtk"].append(victory_condition)
             else:
-                mapNumber += 1
-                control_value = value
-                round_detail_to_dict(round_info, folder=folder, encoding=encoding)
-                round_info = {
-                    "team_a": None,
-                    "team_b": None,
-                    "map": None,
-                    "teamACT": [],
-                    "teamATT": [],
-                    "teamBCT": [],
-                    "teamBTT": [],
-                    "ratk": [],
-                    "rdef": [],
-                    "winConAtk": [],
-                    "winConDef": [],
-                    "date": None,
-                    "map_order": None,
-                    "event": None,
-                }
-
-                round_info["team_a"] = basic_match_info["team_a_tricode"]
-                round_info["team_b"] = basic_match_info["team_b_tricode"]
-
-                round_info["map_order"] = mapNumber
-                round_info["map"] = maps[mapNumber]
-                round_for_eval = re.findall(r"rnd-sq(.*)", str(bloques[count]))
-                imgUrl = str(ronda.find_all("img")[0])
-                victory_condition = imgUrl[0:-3].split("/")[-1].rstrip(".webp")
-
-                round_info["date"] = basic_match_info["date"]
-                round_info["event"] = basic_match_info["event"]
-
-                if round_for_eval[0] == ' mod-win mod-ct">':
-                    round_info["teamACT"].append(1)
-                    round_info["teamBTT"].append(0)
-                    round_info["rdef"].append(value)
-                    round_info["winConDef"].append(victory_condition)
-                elif round_for_eval[0] == ' mod-win mod-t">':
-                    round_info["teamATT"].append(1)
-                    round_info["teamBCT"].append(0)
-                    round_info["ratk"].append(value)
-                    round_info["winConAtk"].append(victory_condition)
-                if round_for_eval[1] == ' mod-win mod-ct">':
-                    round_info["teamBCT"].append(1)
-                    round_info["teamATT"].append(0)
-                    round_info["ratk"].append(value)
-                    round_info["winConAtk"].append(victory_condition)
-                elif round_for_eval[1] == ' mod-win mod-t">':
-                    round_info["teamBTT"].append(1)
-                    round_info["teamACT"].append(0)
-                    round_info["rdef"].append(value)
-                    round_info["winConDef"].append(victory_condition)
+                round_info["teamACT"].append(int(team_a_won))
+                round_info["teamBTT"].append(int(not team_a_won))
+                round_info["rdef"].append(value)
+                round_info["winConDef"].append(victory_condition)
 
-        except:
-            pass
-    round_detail_to_dict(round_info, folder=folder, encoding=encoding)
+        round_infos.append(round_info)
+
+    # the maps are saved once all of them are read, a map without rounds does not leave the others behind
+    saved_rows = [round_detail_to_dict(round_info, folder=folder, encoding=encoding) for round_info in round_infos]
+    round_info = round_infos[-1] if round_infos else None
+
+    if round_info is None:
+        return None
+
+    round_info["malformed_rounds"] = malformed_rounds
+    round_info["saved_rows"] = saved_rows
     return round_info
 
 
-def get_player_performance(url, basic_match_info):
+def malformed_rounds_error(malformed_rounds):
+    """error_match message of the rounds get_round_detail() could not read, the match rows are saved
+
+    Args:
+        malformed_rounds (list): (map, column text, error) tuples
+
+    Returns:
+        str: "round_detail: MalformedRounds: ..." error
+    """
+    details = "; ".join(f"{map_name} [{text}]: {error}" for map_name, text, error in malformed_rounds)
+    return f"round_detail: MalformedRounds: {len(malformed_rounds)} rounds not read, {details}"
+
+
+def get_player_performance(url, basic_match_info, archive_folder=None, offline=False):
     """extract the player performance from a vlr match performance tab
 
     Args:
         url (str): BeautifulSoup object with the HTML info
         basic_match_info (dict, optional): basic match info dict. Defaults to None.
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        offline (bool, optional): read the tab from the archive. Defaults to False.
 
     Returns:
         dict: player performance dict
@@ -673,7 +773,8 @@ def get_player_performance(url, basic_match_info):
 
     url_performance = url + performance_tab
 
-    soup_performance = soup_open(url_performance)
+    soup_performance = soup_open(url_performance, archive_folder=archive_folder, offline=offline,
+                                 parse_only=MATCH_PAGE_SECTIONS)
 
     bo = int(basic_match_info["bo"])  # Could be not necesary to do this check
 
@@ -758,15 +859,18 @@ def get_player_performance(url, basic_match_info):
                     performance_dict["event"].append(basic_match_info["event"])
                     performance_dict["map"].append(map_list[index])
 
+    soup_performance.decompose()
     return performance_dict
 
 
-def get_team_economy(url, basic_match_info):
+def get_team_economy(url, basic_match_info, archive_folder=None, offline=False):
     """extract the team economy
 
     Args:
         url (str): vlr match url
         basic_match_info (dict): basic match info dict. Defaults to None.
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        offline (bool, optional): read the pages from the archive. Defaults to False.
     """
     economy_dict = {
         "team_a": [],
@@ -782,8 +886,8 @@ def get_team_economy(url, basic_match_info):
     }
     economy_page = url + "/?game=all&tab=economy"
 
-    soup = soup_open(url)
-    soup_economy = soup_open(economy_page)
+    soup_economy = soup_open(economy_page, archive_folder=archive_folder, offline=offline,
+                             parse_only=MATCH_PAGE_SECTIONS)
 
     get_games_id = soup_economy.find_all("div", {"class": "vm-stats-game"})
     game_ids = [
@@ -792,7 +896,7 @@ def get_team_economy(url, basic_match_info):
 
     map_dict = {}
 
-    map_nav_items = soup.select(".vm-stats-gamesnav-item.js-map-switch")
+    map_nav_items = soup_economy.select(".vm-stats-gamesnav-item.js-map-switch")  # same nav as the match page
 
     for item in map_nav_items:
         game_id = item.get("data-game-id")
@@ -842,10 +946,10 @@ def get_team_economy(url, basic_match_info):
                     economy_dict["team_a"].append(teams[0])
                     economy_dict["team_b"].append(teams[1])
                     economy_dict["team_a_bank"].append(
-                        team_bank[0].get_text(strip=True)
+                        parse_credits(team_bank[0].get_text(strip=True))
                     )
                     economy_dict["team_b_bank"].append(
-                        team_bank[1].get_text(strip=True)
+                        parse_credits(team_bank[1].get_text(strip=True))
                     )
                     economy_dict["round"].append(round)
                     economy_dict["map"].append(map_dict.get(id, "Unknown"))
@@ -865,6 +969,7 @@ def get_team_economy(url, basic_match_info):
             'event': economy_dict["event"],
         }
 
+    soup_economy.decompose()
     return [economy_dict, team_b_economy_dict]
 
 
@@ -1062,14 +1167,14 @@ def get_player_stats(soup, basic_match_info):
                 player_stats["k-dBoth"].append(float(valorTemp))
                 contador += 1
             elif contador == 3:
-                valor = valorTemp.replace('\xa0', '0%')
+                valor = parse_percentage(valorTemp)
                 player_stats["kastBoth"].append(valor)
                 contador += 1
             elif contador == 4:
                 player_stats["adrBoth"].append(float(valorTemp))
                 contador += 1
             elif contador == 5:
-                valor = valorTemp.replace('\xa0', '0%')
+                valor = parse_percentage(valorTemp)
                 player_stats["hsBoth"].append(valor)
                 contador += 1
             elif contador == 6:
@@ -1107,14 +1212,14 @@ def get_player_stats(soup, basic_match_info):
                 player_stats["k-dT"].append(float(valorTemp))
                 contador += 1
             elif contador == 3:
-                valor = valorTemp.replace('\xa0', '0%')
+                valor = parse_percentage(valorTemp)
                 player_stats["kastT"].append(valor)
                 contador += 1
             elif contador == 4:
                 player_stats["adrT"].append(float(valorTemp))
                 contador += 1
             elif contador == 5:
-                valor = valorTemp.replace('\xa0', '0%')
+                valor = parse_percentage(valorTemp)
                 player_stats["hsT"].append(valor)
                 contador += 1
             elif contador == 6:
@@ -1152,14 +1257,14 @@ def get_player_stats(soup, basic_match_info):
                 player_stats["k-dCT"].append(float(valorTemp))
                 contador += 1
             elif contador == 3:
-                valor = valorTemp.replace('\xa0', '0%')
+                valor = parse_percentage(valorTemp)
                 player_stats["kastCT"].append(valor)
                 contador += 1
             elif contador == 4:
                 player_stats["adrCT"].append(float(valorTemp))
                 contador += 1
             elif contador == 5:
-                valor = valorTemp.replace('\xa0', '0%')
+                valor = parse_percentage(valorTemp)
                 player_stats["hsCT"].append(valor)
                 contador += 1
             elif contador == 6:
@@ -1183,13 +1288,16 @@ def check_valid_match(soup):
         soup (bs4.BeautifulSoup): BeautifulSoup object with the HTML info
 
     Returns:
-        bool: False for a valid match
+        bool: False for a match that is not final, a showmatch or a page that is not a match (forum threads
+            share the match ids)
     """
-    event_text = soup.find("title").get_text(strip=True)
+    title = soup.find("title")
     regex = r"^([^|]+)\|([^|]+)\|([^|]+)\|([^|]+)\|([^|]+)$"
-    result = re.search(regex, event_text)
+    result = re.search(regex, title.get_text(strip=True)) if title is not None else None
 
     match_notes = soup.find_all("div", {"class": "match-header-vs-note"})
+    if result is None or not match_notes:
+        return False
     status = match_notes[0].get_text().strip()
 
     if result.group(3).strip() == "Showmatch" or status != "final":
@@ -1199,27 +1307,26 @@ def check_valid_match(soup):
     return valid_match
 
 
-def link_extractor(url):
+def link_extractor(url, archive_folder=None):
     """extrack all the matches from a vlr tournament match page
 
     Args:
         url (str): vlr tournament match page
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
 
     Returns:
-        list: list with the url of all the matchs in the matches page
+        list: list with the url of all the matchs in the matches page, once per match
     """
-    soup = soup_open(url)
+    soup = soup_open(url, archive_folder=archive_folder, parse_only=MATCH_LINKS)
 
-    tempLink = []
-    urlLinkExtract = []
+    # the listing links every match several times, one url per match id in page order
+    urlLinkExtract = {}
     for a in soup.find_all("a", href=True):
-        tempLink.append(a["href"])
-        filtered_links = [link for link in tempLink if re.match(r"^/\d+", link)]
+        found = re.match(r"^/(\d+)", a["href"])
+        if found and found.group(1) not in urlLinkExtract:
+            urlLinkExtract[found.group(1)] = urljoin(url, a["href"])
 
-    for cleanLink in filtered_links:
-        urlLinkExtract.append("https://www.vlr.gg" + cleanLink)
-
-    return urlLinkExtract
+    return list(urlLinkExtract.values())
 
 
 def get_draft_file_path(basic_match_info, folder="csv"):
@@ -1232,96 +1339,220 @@ def get_draft_file_path(basic_match_info, folder="csv"):
     Returns:
         str: path with the file name
     """
-    normalized_tournament = normalize_filename(basic_match_info["event"])
-    folder_path = os.path.join(folder, normalized_tournament)
-    os.makedirs(folder_path, exist_ok=True)
-    return os.path.join(folder_path, f"draft_{normalized_tournament}.csv")
+    return get_table_path(folder, "draft", basic_match_info["event"], basic_match_info["date"])
 
 
-def was_url_already_processed(file_path, url):
-    """check if the url was already process
+def was_url_already_processed(file_path, url, encoding="iso-8859-1"):
+    """check if the url was already process, the same match id under another url counts. Used for the
+    matches stored before processed.py recorded the extracted tables
 
     Args:
         file_path (str): file path for draft
         url (str): url to verify
+        encoding (str, optional): encoding of the draft file. Defaults to "iso-8859-1".
 
     Returns:
         bool: True if ulr is already process
     """
     if not os.path.exists(file_path):
         return False
-    df = pd.read_csv(file_path)
-    return url in set(df.source_url)
+    match_id = match_id_from_url(url)
+    with open(file_path, newline="", encoding=encoding) as f:
+        for row in csv.DictReader(f):
+            source_url = row.get("source_url") or ""
+            if source_url == url or (match_id is not None and match_id_from_url(source_url) == match_id):
+                return True
+    return False
+
+
+TABLES = ["draft", "round_detail", "player_stats", "player_performance", "team_economy"]
+
+
+def select_tables(tables_config=None, event=None):
+    """tables to extract for a match, from the tables_config.json dict:
+        {"tables": [...], "events": {"<normalized event name>": [...]}}
+    the event list replaces the default list for the matches of that event
+
+    Args:
+        tables_config (dict, optional): tables config dict, all the tables if None. Defaults to None.
+        event (str, optional): event name from basic_match_info. Defaults to None.
+
+    Returns:
+        set: table names
+    """
+    if not tables_config:
+        return set(TABLES)
+
+    tables = tables_config.get("tables") or TABLES
+    if event is not None:
+        tables = tables_config.get("events", {}).get(normalize_filename(event), tables)
 
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        print(f"Unknown tables in tables config: {sorted(unknown)}")
 
-def process_match(url, folder="csv", encoding="utf-8"):
+    return set(tables) & set(TABLES)
+
+
+def process_match(url, folder="csv", encoding="utf-8", archive_folder=None, offline=False, update_aggregates=True,
+                  tables_config=None, replace=False):
     """main function to process match url
 
     Args:
         url (str): match url from vlr
         folder (str, optional): folder name. Defaults to "csv".
         encoding (str, optional): encoding. Defaults to "utf-8".
-    """
-    time.sleep(random.randint(1, 2))
-    soup = soup_open(url)
-    error_url = {"event": [], "url": [], "error": []}
-    if check_valid_match(soup):
-        # print(f"processing: {url}")
-        basic_match_info = get_basic_match_info(soup)
-        path = get_draft_file_path(basic_match_info=basic_match_info, folder=folder)
-        # Check if match is processed
-        not_processed = not was_url_already_processed(file_path=path, url=url)
-        if not_processed:
-            try:
-                # Draft
-                draft = get_picks_bans(soup=soup, basic_match_info=basic_match_info)
-                save_draft_to_csv(draft, url, folder=folder, encoding=encoding)
-
-                # Round detail
-                get_round_detail(
-                    soup=soup,
-                    basic_match_info=basic_match_info,
-                    folder=folder,
-                    encoding=encoding,
-                )
+        archive_folder (str, optional): raw html archive folder, fetched pages are archived there. Defaults to None.
+        offline (bool, optional): reprocess the pages from archive_folder without network. Defaults to False.
+        update_aggregates (bool, optional): update the draft, player and team aggregates of the folder.
+            Defaults to True.
+        tables_config (dict, optional): tables to extract, see select_tables(). The performance and economy
+            tabs are only fetched if their table is selected. Defaults to None (all the tables).
+        replace (bool, optional): remove the stored rows of the match and extract it again, the draft is
+            always extracted again as it feeds the draft aggregates. Defaults to False.
 
-                # Player performance
-                performance_dict = get_player_performance(
-                    url=url, basic_match_info=basic_match_info
-                )
-                save_player_performance_to_csv(
-                    player_performance_dict=performance_dict,
-                    folder=folder,
-                    encoding=encoding,
-                )
-
-                # Team economy
-                team_economy_dict = get_team_economy(
-                    url, basic_match_info=basic_match_info
-                )
-                save_team_economy(
-                    team_economy_dict[0], folder=folder, encoding=encoding
-                )
-                save_team_economy(
-                    team_economy_dict[1], folder=folder, encoding=encoding
-                )
+    Returns:
+        dict: {"status": "processed", "skipped", "invalid" or "failed", "step": table that failed, "error": message}
+    """
+    if not offline and use_politeness_delay():  # with a global rate limit the requests are already spaced
+        time.sleep(random.randint(1, 2))
+    try:
+        soup, url = soup_open(url, archive_folder=archive_folder, offline=offline, parse_only=MATCH_PAGE_SECTIONS,
+                              return_url=True)
+    except HTTPError as e:
+        if e.code != 404:
+            raise
+        print(f"Not valid match: {url} (not found)")
+        return {"status": "invalid", "step": None, "error": None}
+    with stream_match(url):
+        error_url = {"event": [], "url": [], "error": []}
+        result = {"status": "processed", "step": None, "error": None}
+        if check_valid_match(soup):
+            # print(f"processing: {url}")
+            basic_match_info = get_basic_match_info(soup)
+            path = get_draft_file_path(basic_match_info=basic_match_info, folder=folder)
+            tables = select_tables(tables_config, basic_match_info["event"])
+            if replace:
+                tables.add("draft")
+                remove_match_rows(basic_match_info, folder=folder, encoding=encoding, tables=tables)
+                clear_processed_tables(folder, url, tables)
+                if update_aggregates:
+                    remove_draft_match(url, folder=folder)
+                    remove_match_aggregates(basic_match_info, folder=folder)
+            # Check which tables of the match are processed
+            done = processed_tables(folder, url)
+            if not done and was_url_already_processed(file_path=path, url=url, encoding=encoding):
+                done = set(TABLES)  # stored before the processed tables were recorded
+            tables -= done
+            if tables:
+                # tables that failed in an earlier run can have part of their rows written
+                unfinished = tables & started_tables(folder, url)
+                if unfinished:
+                    remove_match_rows(basic_match_info, folder=folder, encoding=encoding, tables=unfinished)
+                record_match_patch(folder, url, basic_match_info["patch"])
+                if get_dataset_layout(folder) == "hive":
+                    register_partition(folder, basic_match_info["event"], basic_match_info["date"],
+                                       basic_match_info["patch"])
+                step = None
+                try:
+                    # Draft
+                    if "draft" in tables:
+                        step = "draft"
+                        mark_table_started(folder, url, step)
+                        with profile_step(step):
+                            draft = get_picks_bans(soup=soup, basic_match_info=basic_match_info)
+                            save_draft_to_csv(draft, url, folder=folder, encoding=encoding)
+                            if update_aggregates:
+                                update_draft_aggregates(draft, url, basic_match_info=basic_match_info, folder=folder)
+                        mark_table_processed(folder, url, step)
+
+                    # Round detail
+                    if "round_detail" in tables:
+                        step = "round_detail"
+                        mark_table_started(folder, url, step)
+                        with profile_step(step):
+                            round_detail = get_round_detail(
+                                soup=soup,
+                                basic_match_info=basic_match_info,
+                                folder=folder,
+                                encoding=encoding,
+                            )
+                            if round_detail is not None and round_detail["malformed_rounds"]:
+                                save_match_error({
+                                    "event": [basic_match_info["event"]],
+                                    "url": [url],
+                                    "error": [malformed_rounds_error(round_detail["malformed_rounds"])],
+                                }, folder=folder, encoding=encoding)
+                            if update_aggregates and round_detail is not None:
+                                update_team_aggregates(
+                                    [row for rows in round_detail["saved_rows"] for row in columns_to_rows(rows)],
+                                    folder=folder,
+                                )
+                        mark_table_processed(folder, url, step)
+
+                    # Player stats
+                    if "player_stats" in tables:
+                        step = "player_stats"
+                        mark_table_started(folder, url, step)
+                        with profile_step(step):
+                            player_stats_dict = get_player_stats(
+                                soup=soup, basic_match_info=basic_match_info
+                            )
+                            save_player_stats_to_csv(
+                                player_stats_dict, folder=folder, encoding=encoding
+                            )
+                            if update_aggregates:
+                                update_player_aggregates(columns_to_rows(player_stats_dict), folder=folder)
+                        mark_table_processed(folder, url, step)
+
+                    # the match page is not needed by the tab extractors
+                    soup.decompose()
+
+                    # Player performance
+                    if "player_performance" in tables:
+                        step = "player_performance"
+                        mark_table_started(folder, url, step)
+                        with profile_step(step):
+                            performance_dict = get_player_performance(
+                                url=url, basic_match_info=basic_match_info, archive_folder=archive_folder,
+                                offline=offline,
+                            )
+                            save_player_performance_to_csv(
+                                player_performance_dict=performance_dict,
+                                folder=folder,
+                                encoding=encoding,
+                            )
+                        mark_table_processed(folder, url, step)
+
+                    # Team economy
+                    if "team_economy" in tables:
+                        step = "team_economy"
+                        mark_table_started(folder, url, step)
+                        with profile_step(step):
+                            team_economy_dict = get_team_economy(
+                                url, basic_match_info=basic_match_info, archive_folder=archive_folder, offline=offline
+                            )
+                            # team B rows are mirrored on load by processing.load_team_economy()
+                            save_team_economy(
+                                team_economy_dict[0], folder=folder, encoding=encoding
+                            )
+                        mark_table_processed(folder, url, step)
+                except Exception as e:
+                    print(f"error processing {url}: {e}")
+                    # "<table>: <exception>", read back by the retry queue
+                    error = f"{step}: {type(e).__name__}: {e}"
+                    error_url["event"].append(basic_match_info["event"])
+                    error_url["url"].append(url)
+                    error_url["error"].append(error)
+                    save_match_error(match_error_dict=error_url,folder=folder,encoding=encoding)
+                    result = {"status": "failed", "step": step, "error": error}
 
-                # Player stats
-                player_stats_dict = get_player_stats(
-                    soup=soup, basic_match_info=basic_match_info
-                )
-                save_player_stats_to_csv(
-                    player_stats_dict, folder=folder, encoding=encoding
-                )
-            except Exception as e:
-                print(f"error processing {url}: {e}")
-                error_url["event"].append(basic_match_info["event"])
-                error_url["url"].append(url)
-                error_url["error"].append(e)
-                save_match_error(match_error_dict=error_url,folder=folder,encoding=encoding)
+            else:
+                print(f"already processed: {url}")
+                result["status"] = "skipped"
 
         else:
-            print(f"already processed: {url}")
+            print(f"Not valid match: {url}")
+            result["status"] = "invalid"
 
-    else:
-        print(f"Not valid match: {url}")
\ No newline at end of file
+    return result
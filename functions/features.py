@@ -0,0 +1,289 @@
+import csv
+import io
+import json
+import os
+from datetime import date as calendar_date
+
+import numpy as np
+
+from .dimensions import get_keys
+from .draft_analytics import SELECTION_ROLES
+from .layout import iter_table_files, read_table_tail
+from .processing import BUY_TYPES, classify_buy_column
+from .query import query_table
+from .stats_aggregates import to_number
+
+FEATURES_FOLDER = "_features"
+FEATURES_MANIFEST = "manifest.json"
+
+PLAYER_FEATURES = {"rating": "ratingBoth", "acs": "acsBoth", "adr": "adrBoth", "kast": "kastBoth", "fk": "fkBoth"}
+
+FEATURE_COLUMNS = (
+    ["date_days", "event_key", "map_key", "team_a_key", "team_b_key", "map_order",
+     "picked_by_a", "picked_by_b", "decider", "a_drafts_first",
+     "rounds", "a_started_atk", "a_atk_rounds", "a_atk_wins", "a_def_rounds", "a_def_wins"]
+    + [f"{team}_{buy}" for team in ("a", "b") for buy in BUY_TYPES]
+    + ["a_bank_mean", "b_bank_mean"]
+    + [f"{team}_{stat}" for team in ("a", "b") for stat in PLAYER_FEATURES]
+    + ["a_won"]
+)
+
+
+def map_key(event, date, team_a, team_b, map_name):
+    """key of a played map in the feature matrix"""
+    return "|".join([event, date, team_a, team_b, map_name])
+
+
+def get_features_path(folder="csv", name=FEATURES_MANIFEST):
+    """path of a feature matrix file
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        name (str, optional): file name. Defaults to the manifest.
+
+    Returns:
+        str: file path
+    """
+    return os.path.join(folder, FEATURES_FOLDER, name)
+
+
+def load_features_manifest(folder="csv"):
+    """column manifest of the feature matrix:
+        "columns": feature names, "chunks": npy files, "rows": map key -> [chunk, row] of its current row,
+        "next_chunk": number of the next chunk file (the names are never used twice),
+        "offsets": round_detail file -> [inode, byte offset] read by the last build
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        dict: manifest
+    """
+    path = get_features_path(folder)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"columns": FEATURE_COLUMNS, "chunks": [], "rows": {}, "offsets": {}, "next_chunk": 0}
+
+
+def new_chunk_name(manifest):
+    """file name of a new chunk, the counter of the manifest is moved"""
+    number = manifest.get("next_chunk")
+    if number is None:  # manifest written before the counter
+        number = max((int(chunk[6:-4]) + 1 for chunk in manifest["chunks"]), default=0)
+    manifest["next_chunk"] = number + 1
+    return f"chunk_{number:05d}.npy"
+
+
+def save_features_manifest(manifest, folder="csv"):
+    """write the manifest to a temporary file and replace the old one"""
+    path = get_features_path(folder)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def new_round_rows(folder, manifest, encoding="iso-8859-1"):
+    """round_detail rows written since the last build, the offsets of the manifest are moved
+
+    Returns:
+        list: round_detail row dicts
+    """
+    rows = []
+    offsets = {}
+    for file_path in iter_table_files(folder, "round_detail"):
+        stat = os.stat(file_path)
+        inode, offset = manifest["offsets"].get(file_path, (None, None))
+        if inode != stat.st_ino or stat.st_size < (offset or 0):
+            offset = None  # replaced file, its maps are built again
+        header_line, data, offsets[file_path] = read_table_tail(file_path, offset)
+        header = next(csv.reader([header_line.decode(encoding)]))
+        rows.extend(dict(zip(header, row)) for row in csv.reader(io.StringIO(data.decode(encoding), newline=""))
+                    if row)
+        offsets[file_path] = [stat.st_ino, offsets[file_path]]
+    manifest["offsets"] = offsets
+    return rows
+
+
+def date_days(date):
+    """days since 1970-01-01 of a match date, NaN for an empty or "unknown" date"""
+    try:
+        return (calendar_date.fromisoformat(str(date)[:10]) - calendar_date(1970, 1, 1)).days
+    except ValueError:
+        return np.nan
+
+
+def _mean(values):
+    values = [v for v in map(to_number, values) if v is not None]
+    return float(np.mean(values)) if values else np.nan
+
+
+def build_map_features(round_rows, draft, economy, player_stats, folder="csv"):
+    """feature rows of the maps of some round_detail rows
+
+    Args:
+        round_rows (list): round_detail row dicts of the maps
+        draft (pd.DataFrame): draft rows of the matches
+        economy (pd.DataFrame): team_economy rows of the matches, both perspectives
+        player_stats (pd.DataFrame): player_stats rows of the matches
+        folder (str, optional): csv folder with the dimension files. Defaults to "csv".
+
+    Returns:
+        tuple: (map keys, float32 matrix with FEATURE_COLUMNS)
+    """
+    maps = {}
+    for row in round_rows:
+        maps.setdefault((row["event"], row["date"], row["map"], frozenset((row["teamA"], row["teamB"]))),
+                        []).append(row)
+
+    event_keys = get_keys(folder, "event", {key[0] for key in maps})
+    map_keys = get_keys(folder, "map", {key[2] for key in maps})
+    team_keys = get_keys(folder, "team", {team for key in maps for team in key[3]})
+
+    draft_by_team = {(r["event"], r["date"], r["team"]): r for r in draft.to_dict("records")} if len(draft) else {}
+    economy_groups = economy.groupby(["event", "date", "map", "team_a"]) if len(economy) else {}
+    stats_groups = player_stats.groupby(["event", "date", "map", "team"]) if len(player_stats) else {}
+
+    keys = []
+    matrix = np.full((len(maps), len(FEATURE_COLUMNS)), np.nan, dtype=np.float32)
+    for index, ((event, date, map_name, _), rows) in enumerate(maps.items()):
+        team_a, team_b = rows[0]["teamA"], rows[0]["teamB"]
+        rows = [r for r in rows if r["teamA"] == team_a]  # files with both perspectives
+        keys.append(map_key(event, date, team_a, team_b, map_name))
+        features = {
+            "date_days": date_days(date),
+            "event_key": event_keys[event],
+            "map_key": map_keys[map_name],
+            "team_a_key": team_keys[team_a],
+            "team_b_key": team_keys[team_b],
+            "map_order": float(rows[0]["map_order"]),
+        }
+
+        sides = [(r["side"], int(r["rndA"]), int(r["round"])) for r in rows]
+        features["rounds"] = len(sides)
+        features["a_started_atk"] = float(min(sides, key=lambda s: s[2])[0] == "atk") if sides else np.nan
+        for side in ("atk", "def"):
+            features[f"a_{side}_rounds"] = sum(1 for s in sides if s[0] == side)
+            features[f"a_{side}_wins"] = sum(s[1] for s in sides if s[0] == side)
+        features["a_won"] = float(sum(s[1] for s in sides) * 2 > len(sides))
+
+        draft_row = draft_by_team.get((event, date, team_a))
+        if draft_row is not None:
+            roles = SELECTION_ROLES.get(str(draft_row["bo"]), SELECTION_ROLES["3"])
+            own = [draft_row[f"team_1_select_{i}"] for i, role in enumerate(roles, 1) if role == "pick"]
+            rival = [draft_row[f"team_2_select_{i}"] for i, role in enumerate(roles, 1) if role == "pick"]
+            features["picked_by_a"] = float(map_name in own)
+            features["picked_by_b"] = float(map_name in rival)
+            features["decider"] = float(map_name == draft_row["decider"])
+            features["a_drafts_first"] = float(draft_row["order"] == "A")
+
+        for team, other in (("a", team_a), ("b", team_b)):
+            if (event, date, map_name, other) in getattr(economy_groups, "groups", {}):
+                team_economy = economy_groups.get_group((event, date, map_name, other))
+                buys = classify_buy_column(team_economy["team_a_economy"])
+                for buy in BUY_TYPES:
+                    features[f"{team}_{buy}"] = float((buys == buy).mean())
+                features[f"{team}_bank_mean"] = float(team_economy["team_a_bank"].mean())
+            if (event, date, map_name, other) in getattr(stats_groups, "groups", {}):
+                team_stats = stats_groups.get_group((event, date, map_name, other))
+                for stat, column in PLAYER_FEATURES.items():
+                    features[f"{team}_{stat}"] = _mean(team_stats[column].tolist())
+
+        for column, value in features.items():
+            matrix[index, FEATURE_COLUMNS.index(column)] = value
+
+    return keys, matrix
+
+
+def update_feature_matrix(folder="csv", encoding="iso-8859-1", compact_after=20):
+    """add the maps stored since the last build to the feature matrix, each build writes a new npy chunk.
+    A map built again (refreshed match) moves to the new chunk. The chunks are merged after compact_after
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+        compact_after (int, optional): chunks before a merge. Defaults to 20.
+
+    Returns:
+        int: maps added or rebuilt
+    """
+    manifest = load_features_manifest(folder)
+    if manifest["columns"] != FEATURE_COLUMNS:  # new feature set, full build
+        manifest = {"columns": FEATURE_COLUMNS, "chunks": [], "rows": {}, "offsets": {},
+                    "next_chunk": manifest.get("next_chunk")}
+
+    round_rows = new_round_rows(folder, manifest, encoding)
+    if not round_rows:
+        save_features_manifest(manifest, folder)
+        return 0
+
+    events = sorted({r["event"] for r in round_rows})
+    days = sorted(r["date"][:10] for r in round_rows)
+    window = {"event": events, "date_from": days[0], "date_to": days[-1], "encoding": encoding}
+    matches = {(r["event"], r["date"]) for r in round_rows}
+
+    def match_rows(table):
+        df = query_table(table, folder, **window)
+        if df.empty:
+            return df
+        return df[[key in matches for key in zip(df["event"], df["date"].astype(str))]]
+
+    keys, matrix = build_map_features(round_rows, match_rows("draft"), match_rows("team_economy"),
+                                      match_rows("player_stats"), folder)
+
+    chunk = new_chunk_name(manifest)
+    os.makedirs(get_features_path(folder, ""), exist_ok=True)
+    np.save(get_features_path(folder, chunk), matrix)
+    manifest["chunks"].append(chunk)
+    for row, key in enumerate(keys):
+        manifest["rows"][key] = [len(manifest["chunks"]) - 1, row]
+    save_features_manifest(manifest, folder)
+
+    if len(manifest["chunks"]) > compact_after:
+        compact_feature_matrix(folder)
+    return len(keys)
+
+
+def load_feature_matrix(folder="csv"):
+    """open the feature matrix, a single compacted chunk is memory mapped without copy
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        tuple: (float32 matrix, column names, map keys in row order)
+    """
+    manifest = load_features_manifest(folder)
+    chunks = [np.load(get_features_path(folder, chunk), mmap_mode="r") for chunk in manifest["chunks"]]
+    current = sorted(manifest["rows"].items(), key=lambda item: item[1])
+    keys = [key for key, _ in current]
+
+    if len(chunks) == 1 and len(current) == len(chunks[0]):
+        return chunks[0], manifest["columns"], keys
+    if not current:
+        return np.empty((0, len(manifest["columns"])), dtype=np.float32), manifest["columns"], keys
+    matrix = np.concatenate([chunks[chunk][[row for c, row in (position for _, position in current) if c == chunk]]
+                             for chunk in range(len(chunks))])
+    return matrix, manifest["columns"], keys
+
+
+def compact_feature_matrix(folder="csv"):
+    """merge the chunks into one npy file with the current row of every map
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+    """
+    manifest = load_features_manifest(folder)
+    matrix, _, keys = load_feature_matrix(folder)
+    old_chunks = manifest["chunks"]
+
+    chunk = new_chunk_name(manifest)
+    np.save(get_features_path(folder, chunk), np.ascontiguousarray(matrix))
+    manifest["chunks"] = [chunk]
+    manifest["rows"] = {key: [0, row] for row, key in enumerate(keys)}
+    save_features_manifest(manifest, folder)
+
+    for old in old_chunks:
+        if old != chunk and os.path.exists(get_features_path(folder, old)):
+            os.remove(get_features_path(folder, old))
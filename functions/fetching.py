@@ -0,0 +1,137 @@
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+fetch_stats = {"requests": 0, "retries": 0, "failures": 0, "not_modified": 0}
+
+_stats_lock = threading.Lock()
+_rate_lock = threading.Lock()
+_request_interval = None
+_next_request_at = 0.0
+_politeness_delay = True
+
+
+def set_request_rate(requests_per_second=None):
+    """set a global rate limit for all the requests of the process, shared by all the threads
+
+    Args:
+        requests_per_second (float, optional): max requests per second, no limit if None. Defaults to None.
+    """
+    global _request_interval
+    _request_interval = 1 / requests_per_second if requests_per_second else None
+
+
+def is_rate_limited():
+    """True if set_request_rate() is active"""
+    return _request_interval is not None
+
+
+def set_politeness_delay(enabled=True):
+    """turn on or off the 1-2 s sleep of process_match() before each match when there is no global rate
+    limit, the load test turns it off to measure the crawler
+
+    Args:
+        enabled (bool, optional): sleep before each match. Defaults to True.
+    """
+    global _politeness_delay
+    _politeness_delay = enabled
+
+
+def use_politeness_delay():
+    """True if process_match() has to sleep before a match: the delay is on and no rate limit is set"""
+    return _politeness_delay and _request_interval is None
+
+
+def wait_for_request_slot():
+    """block until the rate limit allows a new request, the slots are given in call order"""
+    global _next_request_at
+    if _request_interval is None:
+        return
+
+    with _rate_lock:
+        now = time.monotonic()
+        slot = max(now, _next_request_at)
+        _next_request_at = slot + _request_interval
+
+    if slot > now:
+        time.sleep(slot - now)
+
+
+def count_fetch(key):
+    with _stats_lock:
+        fetch_stats[key] += 1
+
+
+def reset_fetch_stats():
+    """reset the request counters"""
+    with _stats_lock:
+        for key in fetch_stats:
+            fetch_stats[key] = 0
+
+
+def fetch_page_with_url(url, retries=3, backoff=1.0, timeout=30):
+    """download a page, 429 and 5xx responses and connection errors are retried with exponential backoff
+    (the Retry-After header is used when the server sends it)
+
+    Args:
+        url (str): page url
+        retries (int, optional): max retries. Defaults to 3.
+        backoff (float, optional): first retry delay in seconds. Defaults to 1.0.
+        timeout (int, optional): request timeout in seconds. Defaults to 30.
+
+    Returns:
+        tuple: (page content in bytes, url after the redirects)
+    """
+    content, url, _ = fetch_page_if_modified(url, retries=retries, backoff=backoff, timeout=timeout)
+    return content, url
+
+
+def fetch_page_if_modified(url, etag=None, last_modified=None, retries=3, backoff=1.0, timeout=30):
+    """conditional download of a page, with the validators of a previous response the server can answer
+    304 Not Modified without a body. Retries like fetch_page_with_url()
+
+    Args:
+        url (str): page url
+        etag (str, optional): ETag of the previous response. Defaults to None.
+        last_modified (str, optional): Last-Modified of the previous response. Defaults to None.
+        retries (int, optional): max retries. Defaults to 3.
+        backoff (float, optional): first retry delay in seconds. Defaults to 1.0.
+        timeout (int, optional): request timeout in seconds. Defaults to 30.
+
+    Returns:
+        tuple: (page content in bytes or None if not modified, url after the redirects,
+            {"etag", "last_modified"} of the response)
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    for attempt in range(retries + 1):
+        wait_for_request_slot()
+        count_fetch("requests")
+        try:
+            with urlopen(Request(url, headers=headers), timeout=timeout) as page:
+                validators = {"etag": page.headers.get("ETag"), "last_modified": page.headers.get("Last-Modified")}
+                return page.read(), page.geturl(), validators
+        except HTTPError as e:
+            if e.code == 304:
+                count_fetch("not_modified")
+                return None, e.geturl() or url, {"etag": etag, "last_modified": last_modified}
+            if e.code not in RETRY_STATUS or attempt == retries:
+                count_fetch("failures")
+                raise
+            retry_after = e.headers.get("Retry-After") if e.headers else None
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff * 2 ** attempt
+        except (URLError, ConnectionError, TimeoutError):
+            if attempt == retries:
+                count_fetch("failures")
+                raise
+            delay = backoff * 2 ** attempt
+
+        count_fetch("retries")
+        time.sleep(delay)
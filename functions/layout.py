@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import threading
+
+DATASET_FILE = "_dataset.json"
+PARTITIONS_FILE = "_partitions.jsonl"
+LAYOUTS = ("tournament", "hive")
+
+_layout_cache = {}
+_partitions_lock = threading.Lock()
+
+
+def normalize_filename(name):
+    """normalize the file name for the path
+
+    Args:
+        name (string): string (usually tournamnet name)
+
+    Returns:
+        string: normalized tournament name
+    """
+    name = name.lower()
+    name = re.sub(r'[^\w\s-]', '', name)
+    name = re.sub(r'\s+', '_', name)
+    return name.strip('_')
+
+
+def set_dataset_layout(folder, layout="tournament"):
+    """set the layout of the csv folder:
+        "tournament": <folder>/<tournament>/<table>_<tournament>.csv
+        "hive": <folder>/<table>/event=<tournament>/date=<YYYY-MM-DD>/<table>.csv
+
+    Args:
+        folder (str): csv folder
+        layout (str, optional): "tournament" or "hive". Defaults to "tournament".
+
+    Raises:
+        ValueError: unknown layout or the folder already has the other one
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout}, use one of {LAYOUTS}")
+
+    current = get_dataset_layout(folder)
+    if current != layout and os.path.exists(os.path.join(folder, DATASET_FILE)):
+        raise ValueError(f"{folder} already uses the {current} layout")
+
+    if current != layout:
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, DATASET_FILE), "w", encoding="utf-8") as f:
+            json.dump({"layout": layout}, f)
+    _layout_cache[folder] = layout
+
+
+def get_dataset_layout(folder):
+    """layout of the csv folder, "tournament" if it was never set
+
+    Args:
+        folder (str): csv folder
+
+    Returns:
+        str: layout name
+    """
+    if folder not in _layout_cache:
+        path = os.path.join(folder, DATASET_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                _layout_cache[folder] = json.load(f)["layout"]
+        else:
+            return "tournament"
+    return _layout_cache[folder]
+
+
+def date_partition(date):
+    """partition value of a match date (data-utc-ts "YYYY-MM-DD hh:mm:ss")
+
+    Args:
+        date (str): match date
+
+    Returns:
+        str: YYYY-MM-DD or "unknown"
+    """
+    if date and re.match(r"^\d{4}-\d{2}-\d{2}", str(date)):
+        return str(date)[:10]
+    return "unknown"
+
+
+def get_table_path(folder, table, event, date=None):
+    """csv path of a table for a match, following the folder layout
+
+    Args:
+        folder (str): csv folder
+        table (str): table name (file prefix)
+        event (str): event name
+        date (str, optional): match date, used by the hive layout. Defaults to None.
+
+    Returns:
+        str: file path, the parent folders are created
+    """
+    normalized_tournament = normalize_filename(event)
+
+    if get_dataset_layout(folder) == "hive":
+        folder_path = os.path.join(folder, table, f"event={normalized_tournament}", f"date={date_partition(date)}")
+        file_name = f"{table}.csv"
+    else:
+        folder_path = os.path.join(folder, normalized_tournament)
+        file_name = f"{table}_{normalized_tournament}.csv"
+
+    os.makedirs(folder_path, exist_ok=True)
+    return os.path.join(folder_path, file_name)
+
+
+def is_table_file(file_name, table):
+    """True if the file belongs to the table in any layout"""
+    return file_name == f"{table}.csv" or (file_name.startswith(f"{table}_") and file_name.endswith(".csv"))
+
+
+def iter_table_files(folder, table):
+    """all the csv files of a table
+
+    Args:
+        folder (str): csv folder
+        table (str): table name
+
+    Returns:
+        list: file paths
+    """
+    return [
+        os.path.join(dirpath, file)
+        for dirpath, _, filenames in os.walk(folder)
+        for file in sorted(filenames)
+        if is_table_file(file, table)
+    ]
+
+
+def read_table_tail(file_path, offset=None):
+    """read the rows appended to a table file after a byte offset, the table files are append only.
+    A row being written (no end of line yet) is left for the next read
+
+    Args:
+        file_path (str): csv file
+        offset (int, optional): end of the last read, None to read all the rows. Defaults to None.
+
+    Returns:
+        tuple: (header line, new rows, offset after the new rows) in bytes
+    """
+    with open(file_path, "rb") as f:
+        header_line = f.readline()
+        f.seek(len(header_line) if offset is None else offset)
+        data = f.read()
+    data = data[:data.rfind(b"\n") + 1]
+    return header_line, data, (len(header_line) if offset is None else offset) + len(data)
+
+
+def register_partition(folder, event, date, patch):
+    """record the patch of a match partition, used to prune partitions by patch on read
+
+    Args:
+        folder (str): csv folder
+        event (str): event name
+        date (str): match date
+        patch (str): match patch
+    """
+    entry = {"event": normalize_filename(event), "date": date_partition(date), "patch": patch}
+    with _partitions_lock:
+        with open(os.path.join(folder, PARTITIONS_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+def load_partition_patches(folder):
+    """patches of each partition
+
+    Args:
+        folder (str): csv folder
+
+    Returns:
+        dict: (event, date) -> set of patches
+    """
+    patches = {}
+    path = os.path.join(folder, PARTITIONS_FILE)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    patches.setdefault((entry["event"], entry["date"]), set()).add(entry["patch"])
+    return patches
+
+
+def patch_matches(patch, pattern):
+    """compare a vlr patch ("Patch 10.04") with a pattern ("10.04", "10.x" or "10")
+
+    Args:
+        patch (str): patch from get_basic_match_info()
+        pattern (str): patch pattern
+
+    Returns:
+        bool: True if the patch is in the pattern
+    """
+    version = str(patch).replace("Patch", "").strip()
+    pattern = str(pattern).replace("Patch", "").strip()
+    if pattern.endswith(".x"):
+        return version.startswith(pattern[:-1])
+    return version == pattern or version.startswith(pattern + ".")
+
+
+def list_partitions(folder, table, events=None, date_from=None, date_to=None, patch=None):
+    """hive partitions of a table that can hold rows for the filters
+
+    Args:
+        folder (str): csv folder with the hive layout
+        table (str): table name
+        events (list, optional): event names. Defaults to None.
+        date_from (str, optional): first date, YYYY-MM-DD. Defaults to None.
+        date_to (str, optional): last date, YYYY-MM-DD. Defaults to None.
+        patch (str, optional): patch pattern, see patch_matches(). Defaults to None.
+
+    Returns:
+        list: csv file paths
+    """
+    table_folder = os.path.join(folder, table)
+    if not os.path.isdir(table_folder):
+        return []
+
+    wanted_events = {normalize_filename(e) for e in events} if events else None
+    patches = load_partition_patches(folder) if patch is not None else None
+
+    files = []
+    for event_dir in sorted(os.listdir(table_folder)):
+        event = event_dir.split("=", 1)[-1]
+        if wanted_events is not None and event not in wanted_events:
+            continue
+        for date_dir in sorted(os.listdir(os.path.join(table_folder, event_dir))):
+            date = date_dir.split("=", 1)[-1]
+            if date_from is not None and date < date_from:
+                continue
+            if date_to is not None and date > date_to:
+                continue
+            if patches is not None and not any(patch_matches(p, patch) for p in patches.get((event, date), ())):
+                continue
+            path = os.path.join(table_folder, event_dir, date_dir, f"{table}.csv")
+            if os.path.exists(path):
+                files.append(path)
+    return files
@@ -0,0 +1,84 @@
+import shutil
+import tempfile
+
+from .archive import load_archive_index
+from .crawler import crawl_matches
+from .extraction import link_extractor
+from .fetching import fetch_stats, reset_fetch_stats, set_politeness_delay, set_request_rate
+from .replay_server import start_replay_server, url_key
+
+
+def percentile(values, share):
+    """nearest rank percentile
+
+    Args:
+        values (list): numbers
+        share (float): percentile between 0 and 1
+
+    Returns:
+        float: percentile value, 0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def run_load_test(archive_folder, workers=4, requests_per_second=None, latency=0.05, error_rate=0.0,
+                  throttle_rate=0.0, encoding="utf-8"):
+    """crawl the event listings recorded in the archive from a local replay server and report the throughput
+
+    Args:
+        archive_folder (str): raw html archive folder with the recorded event listings and matches
+        workers (int, optional): crawl_matches() workers. Defaults to 4.
+        requests_per_second (float, optional): global rate limit, none if None. Defaults to None.
+        latency (float, optional): mean server response time in seconds. Defaults to 0.05.
+        error_rate (float, optional): share of 500 responses. Defaults to 0.0.
+        throttle_rate (float, optional): share of 429 responses. Defaults to 0.0.
+        encoding (str, optional): encoding of the csv output. Defaults to "utf-8".
+
+    Returns:
+        dict: load test report
+    """
+    server = start_replay_server(archive_folder, latency=latency, error_rate=error_rate,
+                                 throttle_rate=throttle_rate)
+    output_folder = tempfile.mkdtemp(prefix="vlr_load_test_")
+    listings = [url for url in load_archive_index(archive_folder) if "/event/matches/" in url]
+
+    reset_fetch_stats()
+    set_request_rate(requests_per_second)
+    set_politeness_delay(False)  # the sleep between matches would hide the crawler throughput
+    try:
+        match_urls = []
+        for listing in listings:
+            match_urls.extend(link_extractor(server.base_url + url_key(listing)))
+
+        result = crawl_matches(match_urls, folder=output_folder, encoding=encoding, workers=workers)
+    finally:
+        set_request_rate(None)
+        set_politeness_delay(True)
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+    report = {
+        "matches": result["matches"],
+        "failed": len(result["failed"]),
+        "seconds": round(result["seconds"], 3),
+        "matches_per_second": round(result["matches"] / result["seconds"], 3) if result["seconds"] else 0.0,
+        "p50": round(percentile(result["latencies"], 0.50), 3),
+        "p95": round(percentile(result["latencies"], 0.95), 3),
+        "p99": round(percentile(result["latencies"], 0.99), 3),
+        "requests": fetch_stats["requests"],
+        "retries": fetch_stats["retries"],
+        "request_failures": fetch_stats["failures"],
+        "server": dict(server.stats),
+    }
+
+    print(f"{report['matches']} matches in {report['seconds']} s ({report['matches_per_second']} matches/s), "
+          f"{report['failed']} failed")
+    print(f"match latency p50 {report['p50']} s, p95 {report['p95']} s, p99 {report['p99']} s")
+    print(f"requests {report['requests']}, retries {report['retries']}, failures {report['request_failures']}, "
+          f"server {report['server']}")
+
+    return report
@@ -0,0 +1,197 @@
+import gc
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_profile = {"path": None, "top": 10}
+_profile_lock = threading.Lock()
+_current_match = threading.local()
+
+_budget_bytes = None
+_resume_bytes = None
+_throttled = False
+_active_lock = threading.Lock()
+_active_matches = 0
+
+
+def enable_memory_profiling(path, top=10, frames=1):
+    """start tracemalloc and write one json line per processed match to path:
+        {"url", "seconds", "allocated", "peak", "steps": {step: allocated}, "top": [[file:line, size diff]]}
+    tracemalloc counts the memory of the whole process, with several workers the steps of concurrent
+    matches are mixed, use one worker for exact numbers
+
+    Args:
+        path (str): jsonl output file
+        top (int, optional): lines with the largest allocation of each match. Defaults to 10.
+        frames (int, optional): frames kept by tracemalloc for each allocation. Defaults to 1.
+    """
+    _profile["path"] = path
+    _profile["top"] = top
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def disable_memory_profiling():
+    """stop tracemalloc and the profile output"""
+    _profile["path"] = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+@contextmanager
+def profile_match(url):
+    """profile the memory allocated while a match is processed, no-op without enable_memory_profiling()
+
+    Args:
+        url (str): match url
+    """
+    if _profile["path"] is None:
+        yield
+        return
+
+    record = {"url": url, "steps": {}}
+    _current_match.record = record
+    start_snapshot = tracemalloc.take_snapshot()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_match.record = None
+        current, peak = tracemalloc.get_traced_memory()
+        top_stats = tracemalloc.take_snapshot().compare_to(start_snapshot, "lineno")[:_profile["top"]]
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        record["allocated"] = current - start_memory
+        record["peak"] = peak
+        record["top"] = [[str(stat.traceback), stat.size_diff] for stat in top_stats]
+        with _profile_lock:
+            with open(_profile["path"], "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def profile_step(step):
+    """profile an extractor inside profile_match(), no-op without enable_memory_profiling()
+
+    Args:
+        step (str): extractor name
+    """
+    record = getattr(_current_match, "record", None)
+    if record is None:
+        yield
+        return
+
+    before = tracemalloc.get_traced_memory()[0]
+    try:
+        yield
+    finally:
+        record["steps"][step] = record["steps"].get(step, 0) + tracemalloc.get_traced_memory()[0] - before
+
+
+def current_rss():
+    """resident memory of the process in bytes, read from /proc. Without /proc the traced memory is used
+    if tracemalloc is running
+
+    Returns:
+        int: bytes, None if it can not be measured
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return None
+
+
+def memory_usage():
+    """memory compared to the budget: the traced memory if tracemalloc is running (it goes down as soon as
+    the trees of a match are freed), otherwise the resident memory of current_rss()
+
+    Returns:
+        int: bytes, None if it can not be measured
+    """
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return current_rss()
+
+
+def set_memory_budget(megabytes=None, resume=0.8):
+    """set a memory budget for the crawl, over the budget new matches wait until the running ones end
+    (at least one match always runs) and the memory goes back under resume * budget
+
+    Args:
+        megabytes (float, optional): max memory in MB, see memory_usage(). No budget if None. Defaults to None.
+        resume (float, optional): share of the budget under which the matches run in parallel again.
+            Defaults to 0.8.
+    """
+    global _budget_bytes, _resume_bytes, _throttled
+    _budget_bytes = megabytes * 1024 * 1024 if megabytes else None
+    _resume_bytes = _budget_bytes * resume if _budget_bytes else None
+    _throttled = False
+
+
+def over_memory_budget():
+    """True if the process is over the memory budget"""
+    if _budget_bytes is None:
+        return False
+    usage = memory_usage()
+    return usage is not None and usage > _budget_bytes
+
+
+def _update_throttle():
+    """switch the throttle on over the budget and off under the resume mark, called with _active_lock
+
+    Returns:
+        bool: True if the budget was just crossed
+    """
+    global _throttled
+    if _budget_bytes is None:
+        return False
+    usage = memory_usage()
+    if usage is None:
+        return False
+    if not _throttled and usage > _budget_bytes:
+        _throttled = True
+        return True
+    if _throttled and usage < _resume_bytes:
+        _throttled = False
+    return False
+
+
+@contextmanager
+def memory_slot(poll=0.1):
+    """run a match within the memory budget: once over the budget a new match waits until it is the only
+    one running or the memory is back under the resume mark of set_memory_budget(), so the concurrency
+    drops under memory pressure and goes back to the number of workers after. The garbage collector runs
+    every time the budget is crossed and when a match ends over it. The resident memory does not always go
+    down after a collection (fragmentation), with a budget close to the working set the crawl can stay at
+    one match at a time, enable_memory_profiling() makes the budget use the traced memory
+
+    Args:
+        poll (float, optional): seconds between the memory checks. Defaults to 0.1.
+    """
+    global _active_matches
+    while True:
+        with _active_lock:
+            crossed = _update_throttle()
+            if _active_matches == 0 or not _throttled:
+                _active_matches += 1
+                break
+        if crossed:  # the trees of the finished matches can be waiting in reference cycles
+            gc.collect()
+        time.sleep(poll)
+    if crossed:
+        gc.collect()
+
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active_matches -= 1
+            throttled = _throttled
+        if throttled:
+            gc.collect()
@@ -0,0 +1,150 @@
+import os
+import time
+
+from .archive import match_id_from_url
+from .state import get_connection
+
+PROCESSED_FILE = "_processed.sqlite"
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS processed_table (
+        match TEXT,
+        table_name TEXT,
+        url TEXT,
+        processed_at REAL,
+        PRIMARY KEY (match, table_name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS started_table (
+        match TEXT,
+        table_name TEXT,
+        PRIMARY KEY (match, table_name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS match_patch (
+        match TEXT PRIMARY KEY,
+        patch TEXT
+    )""",
+]
+
+
+def get_processed_path(folder="csv"):
+    """path of the tables extracted for each match of the folder
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        str: sqlite file path
+    """
+    return os.path.join(folder, PROCESSED_FILE)
+
+
+def _connection(folder):
+    os.makedirs(folder, exist_ok=True)
+    return get_connection(get_processed_path(folder), schema=SCHEMA)
+
+
+def match_key(url):
+    """the match id, the same match can have several urls"""
+    match_id = match_id_from_url(url)
+    return str(match_id) if match_id is not None else url
+
+
+def processed_tables(folder, url):
+    """tables already extracted for a match
+
+    Args:
+        folder (str): csv folder
+        url (str): match url
+
+    Returns:
+        set: table names
+    """
+    rows = _connection(folder).execute("SELECT table_name FROM processed_table WHERE match = ?", (match_key(url),))
+    return {row[0] for row in rows}
+
+
+def started_tables(folder, url):
+    """tables of a match whose extraction started but did not end, some of their rows can be written
+
+    Args:
+        folder (str): csv folder
+        url (str): match url
+
+    Returns:
+        set: table names
+    """
+    rows = _connection(folder).execute("SELECT table_name FROM started_table WHERE match = ?", (match_key(url),))
+    return {row[0] for row in rows}
+
+
+def mark_table_started(folder, url, table):
+    """record that the extraction of a table of a match started, see mark_table_processed()
+
+    Args:
+        folder (str): csv folder
+        url (str): match url
+        table (str): table name
+    """
+    connection = _connection(folder)
+    with connection:
+        connection.execute("INSERT OR IGNORE INTO started_table (match, table_name) VALUES (?, ?)",
+                           (match_key(url), table))
+
+
+def mark_table_processed(folder, url, table):
+    """record a table of a match as extracted, the rows are in the table file
+
+    Args:
+        folder (str): csv folder
+        url (str): match url
+        table (str): table name
+    """
+    connection = _connection(folder)
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO processed_table (match, table_name, url, processed_at) VALUES (?, ?, ?, ?)",
+            (match_key(url), table, url, time.time()),
+        )
+        connection.execute("DELETE FROM started_table WHERE match = ? AND table_name = ?", (match_key(url), table))
+
+
+def clear_processed_tables(folder, url, tables):
+    """forget the tables of a match, used when its rows are removed
+
+    Args:
+        folder (str): csv folder
+        url (str): match url
+        tables (iterable): table names
+    """
+    rows = [(match_key(url), table) for table in tables]
+    connection = _connection(folder)
+    with connection:
+        connection.executemany("DELETE FROM processed_table WHERE match = ? AND table_name = ?", rows)
+        connection.executemany("DELETE FROM started_table WHERE match = ? AND table_name = ?", rows)
+
+
+def record_match_patch(folder, url, patch):
+    """record the patch of a match, the draft rows do not have it
+
+    Args:
+        folder (str): csv folder
+        url (str): match url
+        patch (str): patch from get_basic_match_info()
+    """
+    connection = _connection(folder)
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO match_patch (match, patch) VALUES (?, ?)", (match_key(url), patch))
+
+
+def match_patches(folder):
+    """recorded patch of every match
+
+    Args:
+        folder (str): csv folder
+
+    Returns:
+        dict: match key -> patch
+    """
+    if not os.path.exists(get_processed_path(folder)):
+        return {}
+    return dict(_connection(folder).execute("SELECT match, patch FROM match_patch"))
@@ -1,13 +1,72 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
 import os
 
+from .dimensions import DIMENSION_COLUMNS, get_keys, load_dimension
+from .layout import get_dataset_layout, iter_table_files, list_partitions, normalize_filename
+
+
+PERCENTAGE_COLUMNS = ["kastBoth", "kastT", "kastCT", "hsBoth", "hsT", "hsCT"]
+BANK_COLUMNS = ["team_a_bank", "team_b_bank"]
+BUY_TYPES = ["eco", "semi_eco", "semi_buy", "full_buy"]
+BANK_DIFF_BINS = [-np.inf, -5000, -2000, -500, 500, 2000, 5000, np.inf]
+
 
 def convert_k(valor):
     "remove k in money columns and change the format to int"
     if 'k' in valor:
         return int(float(valor.replace('k', '')) * 1000)
+    return int(float(valor))
+
+
+def convert_k_column(column):
+    """vectorized convert_k for a bank column, the numeric columns (typed csv) are returned as they are
+
+    Args:
+        column (pd.Series): bank values like "3.4k" or "500"
+
+    Returns:
+        pd.Series: credits
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        return column
+    text = column.astype("string").str.strip().str.lower()
+    thousands = text.str.endswith("k", na=False)
+    values = pd.to_numeric(text.str.rstrip("k"), errors="coerce")
+    return values.where(~thousands, values * 1000).round().astype("Int64")
+
+
+def convert_percentage_column(column):
+    """vectorized "73%" -> 73.0 for the csv written before the typed extraction
+
+    Args:
+        column (pd.Series): percentage values
+
+    Returns:
+        pd.Series: float values
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        return column
+    text = column.astype("string").str.replace("\xa0", "", regex=False).str.strip().str.rstrip("%")
+    return pd.to_numeric(text.replace("", "0"), errors="coerce")
+
+
+def convert_numeric_columns(df):
+    """convert the bank and percentage string columns of legacy csv files to numbers
+
+    Args:
+        df (pd.DataFrame): team_economy or player_stats table
+
+    Returns:
+        pd.DataFrame: table with numeric columns
+    """
+    for column in BANK_COLUMNS:
+        if column in df.columns:
+            df[column] = convert_k_column(df[column])
+    for column in PERCENTAGE_COLUMNS:
+        if column in df.columns:
+            df[column] = convert_percentage_column(df[column])
+    return df
 
 
 def find_files_by_prefix(root_folder, prefix):
@@ -48,6 +107,261 @@ def concat_csv_from_different_folders(folder="csv", prefix=None):
     return df_concat
 
 
+def read_table(folder="csv", table="player_stats", events=None, date_from=None, date_to=None, patch=None,
+               columns=None, encoding="iso-8859-1"):
+    """read a table with partition pruning and column projection. With the hive layout only the partitions
+    of the events, dates and patch are opened, with the tournament layout the files are filtered by event
+    and the rows by date (the patch filter needs the hive layout).
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        table (str, optional): table name. Defaults to "player_stats".
+        events (list, optional): event names. Defaults to None.
+        date_from (str, optional): first date, YYYY-MM-DD. Defaults to None.
+        date_to (str, optional): last date, YYYY-MM-DD. Defaults to None.
+        patch (str, optional): patch like "10.04" or "10.x". Defaults to None.
+        columns (list, optional): columns to read. Defaults to None (all).
+        encoding (str, optional): encoding of the csv files. Defaults to 'iso-8859-1'.
+
+    Returns:
+        pd.DataFrame: table rows
+    """
+    if get_dataset_layout(folder) == "hive":
+        files = list_partitions(folder, table, events=events, date_from=date_from, date_to=date_to, patch=patch)
+        filter_dates = False
+    else:
+        if patch is not None:
+            print("patch filter needs the hive layout, ignored")
+        files = iter_table_files(folder, table)
+        if events:
+            wanted = {normalize_filename(e) for e in events}
+            files = [f for f in files if os.path.basename(os.path.dirname(f)) in wanted]
+        filter_dates = date_from is not None or date_to is not None
+
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(list(columns) + (["date"] if filter_dates else [])))
+
+    dataframes = [pd.read_csv(f, encoding=encoding, usecols=usecols) for f in files]
+    if not dataframes:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(dataframes, ignore_index=True)
+
+    if filter_dates:
+        day = df["date"].astype(str).str[:10]
+        keep = pd.Series(True, index=df.index)
+        if date_from is not None:
+            keep &= day >= date_from
+        if date_to is not None:
+            keep &= day <= date_to
+        df = df[keep]
+        if columns is not None:
+            df = df[list(columns)]
+
+    return df.reset_index(drop=True)
+
+
+ROUND_DETAIL_MIRROR = {"teamA": "teamB", "teamB": "teamA", "rndA": "rndB", "rndB": "rndA"}
+TEAM_ECONOMY_MIRROR = {
+    "team_a": "team_b",
+    "team_b": "team_a",
+    "team_a_economy": "team_b_economy",
+    "team_b_economy": "team_a_economy",
+    "team_a_bank": "team_b_bank",
+    "team_b_bank": "team_a_bank",
+}
+
+
+def mirror_perspective(df, swap_columns, side_column=None):
+    """add the other team perspective to a table stored from the team A perspective only.
+    Tables written before the single perspective storage already have both, the repeated rows are dropped.
+
+    Args:
+        df (pd.DataFrame): stored table
+        swap_columns (dict): column -> column of the other team
+        side_column (str, optional): atk/def column to swap. Defaults to None.
+
+    Returns:
+        pd.DataFrame: table with both perspectives and the same columns
+    """
+    if df.empty:
+        return df
+
+    mirrored = df.rename(columns=swap_columns)[df.columns]
+    if side_column is not None:
+        mirrored[side_column] = df[side_column].map({"atk": "def", "def": "atk"})
+
+    return pd.concat([df, mirrored], ignore_index=True).drop_duplicates(ignore_index=True)
+
+
+def load_round_detail(folder="csv"):
+    """load all the round_detail csv files with the rows of both teams
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        pd.DataFrame: round detail table
+    """
+    df = concat_csv_from_different_folders(folder=folder, prefix="round_detail")
+    return mirror_perspective(df, ROUND_DETAIL_MIRROR, side_column="side")
+
+
+def load_team_economy(folder="csv"):
+    """load all the team_economy csv files with the rows of both teams
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        pd.DataFrame: team economy table
+    """
+    df = concat_csv_from_different_folders(folder=folder, prefix="team_economy")
+    return mirror_perspective(convert_numeric_columns(df), TEAM_ECONOMY_MIRROR)
+
+
+def load_player_stats(folder="csv"):
+    """load all the player_stats csv files with numeric kast and hs columns
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        pd.DataFrame: player stats table
+    """
+    df = concat_csv_from_different_folders(folder=folder, prefix="player_stats")
+    return convert_numeric_columns(df)
+
+
+def encode_dimensions(df, table, folder="csv"):
+    """add an int32 column <column>_key with the stable dimension key of each text column of the table
+    (see dimensions.DIMENSION_COLUMNS). The keys do not depend on the loaded rows, values saved before
+    the dimension files existed get new keys. Empty values have the key 0
+
+    Args:
+        df (pd.DataFrame): table rows
+        table (str): table name
+        folder (str, optional): csv folder with the dimension files. Defaults to "csv".
+
+    Returns:
+        pd.DataFrame: the same frame with the key columns
+    """
+    for column, dimension in DIMENSION_COLUMNS[table].items():
+        if column in df.columns:
+            values = df[column].astype("string")
+            keys = get_keys(folder, dimension, values.dropna().unique())
+            df[column + "_key"] = values.map(keys).fillna(0).astype("int32")
+    return df
+
+
+def dimension_frame(dimension, folder="csv"):
+    """dimension table to join the key columns of encode_dimensions()
+
+    Args:
+        dimension (str): "player", "team", "map", "agent" or "event"
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        pd.DataFrame: columns <dimension>_key and <dimension>
+    """
+    keys = load_dimension(folder, dimension)
+    return pd.DataFrame({f"{dimension}_key": list(keys.values()), dimension: list(keys.keys())}).astype(
+        {f"{dimension}_key": "int32"}
+    )
+
+
+def classify_buy_column(column):
+    """vectorized buy type of the vlr economy labels ("Eco", "Semi-eco", "Semi-buy", "Full buy",
+    sometimes with the credit range like "Eco: 0-5k")
+
+    Args:
+        column (pd.Series): team_a_economy or team_b_economy values
+
+    Returns:
+        pd.Series: categorical with BUY_TYPES, NaN for unknown labels
+    """
+    text = column.astype("string").str.lower().str.replace(r"[\s_]+", "-", regex=True).fillna("")
+    conditions = [text.str.contains(label, regex=False).to_numpy(dtype=bool)
+                  for label in ("eco", "semi-eco", "semi-buy", "full")]
+    buy = np.select(conditions[::-1], BUY_TYPES[::-1], default=None)  # "semi-eco" also contains "eco"
+    return pd.Series(pd.Categorical(buy, categories=BUY_TYPES), index=column.index)
+
+
+def economy_rounds(economy, round_detail):
+    """one row per team and round with the buy types of both teams, the banks and the round outcome
+
+    Args:
+        economy (pd.DataFrame): team_economy rows of both teams, see load_team_economy()
+        round_detail (pd.DataFrame): round_detail rows of both teams, see load_round_detail()
+
+    Returns:
+        pd.DataFrame: event, date, map, round, team, rival, side, buy, rival_buy, bank, rival_bank,
+            bank_diff, bank_diff_range and won
+    """
+    keys = ["event", "date", "map", "round", "team"]
+    economy = economy.rename(columns={"team_a": "team", "team_b": "rival", "team_a_bank": "bank",
+                                      "team_b_bank": "rival_bank"})
+    rounds = round_detail.rename(columns={"teamA": "team"})[keys + ["side", "rndA"]]
+    for df in (economy, rounds):
+        df["date"] = df["date"].astype(str)
+        df["round"] = pd.to_numeric(df["round"], errors="coerce")
+
+    df = economy.merge(rounds, on=keys, how="inner")
+    df["buy"] = classify_buy_column(df["team_a_economy"])
+    df["rival_buy"] = classify_buy_column(df["team_b_economy"])
+    df["bank"] = pd.to_numeric(df["bank"], errors="coerce")
+    df["rival_bank"] = pd.to_numeric(df["rival_bank"], errors="coerce")
+    df["bank_diff"] = df["bank"] - df["rival_bank"]
+    df["bank_diff_range"] = pd.cut(df["bank_diff"], BANK_DIFF_BINS)
+    df["won"] = pd.to_numeric(df["rndA"], errors="coerce").eq(1)
+    return df[keys + ["rival", "side", "buy", "rival_buy", "bank", "rival_bank", "bank_diff", "bank_diff_range",
+                      "won"]]
+
+
+def buy_win_rates(rounds, by=("buy",)):
+    """rounds, wins and win rate of each group of economy rounds
+
+    Args:
+        rounds (pd.DataFrame): economy_rounds() rows
+        by (tuple, optional): group columns, e.g. ("buy", "rival_buy"), ("bank_diff_range",) or
+            ("team", "buy", "side"). Defaults to ("buy",).
+
+    Returns:
+        pd.DataFrame: group columns, rounds, wins and win_rate
+    """
+    by = list(by)
+    result = rounds.groupby(by, observed=True)["won"].agg(rounds="size", wins="sum").reset_index()
+    result["win_rate"] = result["wins"] / result["rounds"]
+    return result
+
+
+def economy_analytics(folder="csv", events=None, date_from=None, date_to=None, by=("buy", "side"),
+                      encoding="iso-8859-1"):
+    """buy type win rates of a season in one pass: the team_economy and round_detail files of the events and
+    dates are read once, classified and joined
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        events (list, optional): event names. Defaults to None (all).
+        date_from (str, optional): first date, YYYY-MM-DD. Defaults to None.
+        date_to (str, optional): last date, YYYY-MM-DD. Defaults to None.
+        by (tuple, optional): group columns of buy_win_rates(). Defaults to ("buy", "side").
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        pd.DataFrame: win rates by group
+    """
+    filters = {"events": events, "date_from": date_from, "date_to": date_to, "encoding": encoding}
+    economy = read_table(folder, "team_economy", **filters)
+    round_detail = read_table(folder, "round_detail", **filters)
+    if economy.empty or round_detail.empty:
+        return pd.DataFrame(columns=list(by) + ["rounds", "wins", "win_rate"])
+
+    economy = mirror_perspective(convert_numeric_columns(economy), TEAM_ECONOMY_MIRROR)
+    round_detail = mirror_perspective(round_detail, ROUND_DETAIL_MIRROR, side_column="side")
+    return buy_win_rates(economy_rounds(economy, round_detail), by=by)
+
+
 def get_game_instance(value):
     last_char = value.split("-")[-1]
     return last_char
@@ -61,10 +375,18 @@ def text_to_index(df, name, number=0, extra_id=""):
 
 
 def tournament_names(folder='csv'):
+    if get_dataset_layout(folder) == "hive":
+        tournament_list = set()
+        for table in os.listdir(folder):
+            table_path = os.path.join(folder, table)
+            if os.path.isdir(table_path):
+                tournament_list.update(e.split("=", 1)[-1] for e in os.listdir(table_path) if e.startswith("event="))
+        return sorted(tournament_list)
+
     tournament_list = []
     for name in os.listdir(folder):
         path = os.path.join(folder, name)
-        if os.path.isdir(path):
+        if os.path.isdir(path) and not name.startswith("_"):  # _dimensions, _features
             tournament_list.append(name)
     return tournament_list
 
@@ -0,0 +1,356 @@
+import csv
+import io
+import os
+import time
+
+import pandas as pd
+
+from .dimensions import DIMENSION_COLUMNS
+from .layout import iter_table_files, read_table_tail
+from .processing import ROUND_DETAIL_MIRROR, TEAM_ECONOMY_MIRROR, convert_numeric_columns, mirror_perspective
+from .state import get_connection
+
+QUERY_INDEX_FILE = "_query_index.sqlite"
+# rows of a file indexed together, a query reads only the byte ranges of the blocks that hold its values
+BLOCK_ROWS = 1000
+
+# column filtered by each dimension, the round_detail and team_economy rows of the other team are
+# mirrored before the filter so a team query returns the rows from that team perspective
+QUERY_COLUMNS = {
+    "draft": {"team": "team", "map": ["team_1_select_1", "team_2_select_1", "team_1_select_2", "team_2_select_2",
+                                      "team_1_select_3", "team_2_select_3", "decider"], "event": "event"},
+    "round_detail": {"team": "teamA", "map": "map", "event": "event"},
+    "player_stats": {"player": "player", "team": "team", "map": "map", "agent": "agent", "event": "event"},
+    "player_performance": {"player": "player", "team": "team", "map": "map", "event": "event"},
+    "team_economy": {"team": "team_a", "map": "map", "event": "event"},
+}
+MIRRORS = {"round_detail": (ROUND_DETAIL_MIRROR, "side"), "team_economy": (TEAM_ECONOMY_MIRROR, None)}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS indexed_file (
+        file TEXT PRIMARY KEY, table_name TEXT, inode INTEGER, offset INTEGER, rows INTEGER,
+        min_date TEXT, max_date TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS file_block (
+        file TEXT, start INTEGER, end INTEGER, rows INTEGER, min_date TEXT, max_date TEXT,
+        PRIMARY KEY (file, start)
+    )""",
+    """CREATE TABLE IF NOT EXISTS block_value (
+        dimension TEXT, value TEXT, file TEXT, start INTEGER, rows INTEGER,
+        PRIMARY KEY (dimension, value, file, start)
+    )""",
+    "CREATE INDEX IF NOT EXISTS block_value_file ON block_value (file)",
+]
+
+
+def _connection(folder):
+    return get_connection(os.path.join(folder, QUERY_INDEX_FILE), schema=SCHEMA)
+
+
+def iter_rows_with_offsets(data, offset, encoding):
+    """csv rows of a part of a table file with the byte offset after each row
+
+    Args:
+        data (bytes): complete rows read at offset
+        offset (int): byte offset of data in the file
+        encoding (str): encoding of the csv file
+
+    Yields:
+        tuple: (row, byte offset after the row)
+    """
+    position = offset
+
+    def lines():
+        nonlocal position
+        for line in io.BytesIO(data):
+            position += len(line)
+            yield line.decode(encoding)
+
+    for row in csv.reader(lines()):  # the reader takes the lines of one row at a time
+        yield row, position
+
+
+def _new_block(start, rows=0, dates=None):
+    return {"start": start, "end": start, "rows": rows, "dates": dates or [], "counts": {}}
+
+
+def update_query_index(folder="csv", table="player_stats", encoding="iso-8859-1"):
+    """bring the index of a table up to date. The files are cut in blocks of BLOCK_ROWS rows, the index has
+    the byte range and date range of every block and the value -> blocks index of every dimension, so that
+    a query reads only the rows near its values whatever the dataset layout. The csv files are append only,
+    only the bytes added since the last update are read (a file replaced by refresh or retry is indexed again)
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        table (str, optional): table name. Defaults to "player_stats".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        int: rows indexed
+    """
+    connection = _connection(folder)
+    files = iter_table_files(folder, table)
+    indexed_rows = 0
+
+    with connection:
+        known = {row[0] for row in connection.execute("SELECT file FROM indexed_file WHERE table_name = ?", (table,))}
+        for file_path in known - set(files):
+            connection.execute("DELETE FROM indexed_file WHERE file = ?", (file_path,))
+            connection.execute("DELETE FROM file_block WHERE file = ?", (file_path,))
+            connection.execute("DELETE FROM block_value WHERE file = ?", (file_path,))
+
+    for file_path in files:
+        stat = os.stat(file_path)
+        state = connection.execute(
+            "SELECT inode, offset, rows, min_date, max_date FROM indexed_file WHERE file = ?", (file_path,)
+        ).fetchone()
+        if state is not None and state[0] == stat.st_ino and state[1] == stat.st_size:
+            continue
+        last_block = connection.execute(
+            "SELECT start, end, rows, min_date, max_date FROM file_block WHERE file = ? ORDER BY start DESC LIMIT 1",
+            (file_path,),
+        ).fetchone()
+        # indexes built before the blocks have no file_block rows, the file is indexed again
+        full = state is None or last_block is None or state[0] != stat.st_ino or stat.st_size < state[1]
+
+        header_line, data, offset = read_table_tail(file_path, None if full else state[1])
+
+        header = next(csv.reader([header_line.decode(encoding)]))
+        columns = {column: header.index(column) for column in DIMENSION_COLUMNS.get(table, {}) if column in header}
+        date_index = header.index("date") if "date" in header else None
+
+        data_start = offset - len(data)
+        if full or last_block[2] >= BLOCK_ROWS:
+            block = _new_block(data_start)
+        else:  # the last block is not full, the new rows go on with it
+            block = _new_block(last_block[0], last_block[2], [d for d in last_block[3:] if d is not None])
+        blocks = []
+        rows = 0
+        for row, end in iter_rows_with_offsets(data, data_start, encoding):
+            block["end"] = end
+            if not row:
+                continue
+            rows += 1
+            block["rows"] += 1
+            for column, index in columns.items():
+                key = (DIMENSION_COLUMNS[table][column], row[index])
+                block["counts"][key] = block["counts"].get(key, 0) + 1
+            if date_index is not None:
+                block["dates"].append(row[date_index])
+            if block["rows"] >= BLOCK_ROWS:
+                blocks.append(block)
+                block = _new_block(end)
+        if block["end"] > block["start"]:
+            blocks.append(block)
+
+        dates = [] if full or state[3] is None else [state[3], state[4]]
+        with connection:
+            if full:
+                connection.execute("DELETE FROM file_block WHERE file = ?", (file_path,))
+                connection.execute("DELETE FROM block_value WHERE file = ?", (file_path,))
+            for block in blocks:
+                dates.extend(block["dates"])
+                connection.execute(
+                    "INSERT OR REPLACE INTO file_block VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_path, block["start"], block["end"], block["rows"],
+                     min(block["dates"]) if block["dates"] else None, max(block["dates"]) if block["dates"] else None),
+                )
+                connection.executemany(
+                    "INSERT INTO block_value VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(dimension, value, file, start) DO UPDATE SET rows = rows + excluded.rows",
+                    [(dimension, value, file_path, block["start"], count)
+                     for (dimension, value), count in block["counts"].items()],
+                )
+            connection.execute(
+                "INSERT OR REPLACE INTO indexed_file VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_path, table, stat.st_ino, offset, rows + (0 if full else state[2]),
+                 min(dates) if dates else None, max(dates) if dates else None),
+            )
+        indexed_rows += rows
+
+    return indexed_rows
+
+
+def as_list(value):
+    """filter value as a list, None for no filter"""
+    if value is None:
+        return None
+    return [value] if isinstance(value, str) else list(value)
+
+
+def plan_query(table, folder="csv", filters=None, date_from=None, date_to=None):
+    """blocks of the table files that can hold rows for the filters, from the query index
+
+    Args:
+        table (str): table name
+        folder (str, optional): csv folder. Defaults to "csv".
+        filters (dict, optional): dimension -> list of values. Defaults to None.
+        date_from (str, optional): first date, YYYY-MM-DD. Defaults to None.
+        date_to (str, optional): last date, YYYY-MM-DD. Defaults to None.
+
+    Returns:
+        tuple: (files, plan steps), the files are (file, [(start, end) byte ranges]) and the steps have the
+            estimated rows left after each step
+    """
+    connection = _connection(folder)
+    blocks = {(row[0], row[1]): (row[2], row[3]) for row in connection.execute(
+        "SELECT b.file, b.start, b.end, b.rows FROM file_block b JOIN indexed_file f ON f.file = b.file "
+        "WHERE f.table_name = ?", (table,))}
+
+    def describe(blocks, estimate=""):
+        return (f"{len({file_path for file_path, _ in blocks})} files, {len(blocks)} blocks, "
+                f"{estimate}{sum(rows for _, rows in blocks.values())} rows")
+
+    steps = [f"index scan {table}: {describe(blocks)}"]
+
+    if date_from is not None or date_to is not None:
+        in_range = {(row[0], row[1]) for row in connection.execute(
+            "SELECT b.file, b.start FROM file_block b JOIN indexed_file f ON f.file = b.file "
+            "WHERE f.table_name = ? AND b.max_date >= ? AND b.min_date <= ?",
+            (table, date_from or "", (date_to or "9999-12-31") + "~"))}
+        blocks = {key: block for key, block in blocks.items() if key in in_range}
+        steps.append(f"date range {date_from or '*'}..{date_to or '*'}: {describe(blocks)}")
+
+    for dimension, values in (filters or {}).items():
+        placeholders = ",".join("?" * len(values))
+        matches = {}
+        for file_path, start, rows in connection.execute(
+                f"SELECT file, start, SUM(rows) FROM block_value WHERE dimension = ? AND value IN ({placeholders}) "
+                f"GROUP BY file, start", [dimension] + values):
+            if (file_path, start) in blocks:
+                end, block_rows = blocks[(file_path, start)]
+                matches[(file_path, start)] = (end, min(rows, block_rows))
+        blocks = matches
+        steps.append(f"index lookup {dimension} in {values}: {describe(blocks, '<= ')}")
+
+    files = {}
+    for (file_path, start), (end, _) in sorted(blocks.items()):
+        files.setdefault(file_path, []).append((start, end))
+    return sorted(files.items()), steps
+
+
+def read_blocks(file_path, ranges, encoding="iso-8859-1"):
+    """rows of byte ranges of a table file, the adjacent ranges are read at once
+
+    Args:
+        file_path (str): csv file
+        ranges (list): sorted (start, end) byte ranges of whole rows
+        encoding (str, optional): encoding of the csv file. Defaults to "iso-8859-1".
+
+    Returns:
+        pd.DataFrame: rows
+    """
+    merged = []
+    for start, end in ranges:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    with open(file_path, "rb") as f:
+        parts = [f.readline()]
+        for start, end in merged:
+            f.seek(start)
+            parts.append(f.read(end - start))
+    return pd.read_csv(io.BytesIO(b"".join(parts)), encoding=encoding)
+
+
+def query_table(table, folder="csv", player=None, team=None, map_name=None, agent=None, event=None,
+                date_from=None, date_to=None, columns=None, as_numpy=False, explain=False, encoding="iso-8859-1"):
+    """rows of a table by player, team, map, agent, event and date range. The query index gives the blocks
+    of rows that hold the values (see update_query_index()), only those byte ranges of the files are read,
+    with the tournament layout as with the hive one. The round_detail and team_economy rows are returned
+    from the perspective of the filtered team
+
+    Args:
+        table (str): "draft", "round_detail", "player_stats", "player_performance" or "team_economy"
+        folder (str, optional): csv folder. Defaults to "csv".
+        player (str or list, optional): player names. Defaults to None.
+        team (str or list, optional): team tricodes. Defaults to None.
+        map_name (str or list, optional): map names. Defaults to None.
+        agent (str or list, optional): agents. Defaults to None.
+        event (str or list, optional): event names. Defaults to None.
+        date_from (str, optional): first date, YYYY-MM-DD. Defaults to None.
+        date_to (str, optional): last date, YYYY-MM-DD. Defaults to None.
+        columns (list, optional): columns to return. Defaults to None (all).
+        as_numpy (bool, optional): return a numpy array instead of a DataFrame. Defaults to False.
+        explain (bool, optional): print the query plan with the time of every step. Defaults to False.
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Raises:
+        ValueError: filter on a dimension the table does not have
+
+    Returns:
+        pd.DataFrame or np.ndarray: matching rows
+    """
+    start = time.perf_counter()
+    filters = {}
+    for dimension, value in (("player", player), ("team", team), ("map", map_name), ("agent", agent),
+                             ("event", event)):
+        if value is not None:
+            if dimension not in QUERY_COLUMNS[table]:
+                raise ValueError(f"{table} has no {dimension} column")
+            filters[dimension] = as_list(value)
+
+    indexed_rows = update_query_index(folder, table, encoding=encoding)
+    steps = [f"index update: {indexed_rows} new rows ({time.perf_counter() - start:.3f} s)"]
+
+    files, plan = plan_query(table, folder, filters, date_from, date_to)
+    steps.extend(plan)
+    steps[-1] += f" ({time.perf_counter() - start:.3f} s)"
+
+    dataframes = [read_blocks(file_path, ranges, encoding=encoding) for file_path, ranges in files]
+    df = pd.concat(dataframes, ignore_index=True) if dataframes else pd.DataFrame()
+    steps.append(f"read {len(files)} files, {sum(len(ranges) for _, ranges in files)} blocks: {len(df)} rows "
+                 f"({time.perf_counter() - start:.3f} s)")
+
+    if not df.empty:
+        df = convert_numeric_columns(df)
+        if table in MIRRORS:
+            df = mirror_perspective(df, *MIRRORS[table])
+
+        keep = pd.Series(True, index=df.index)
+        for dimension, values in filters.items():
+            query_columns = as_list(QUERY_COLUMNS[table][dimension])
+            matches = pd.Series(False, index=df.index)
+            for column in query_columns:
+                matches |= df[column].astype(str).isin(values)
+            keep &= matches
+        if date_from is not None or date_to is not None:
+            day = df["date"].astype(str).str[:10]
+            if date_from is not None:
+                keep &= day >= date_from
+            if date_to is not None:
+                keep &= day <= date_to
+        df = df[keep].reset_index(drop=True)
+    steps.append(f"filter: {len(df)} rows ({time.perf_counter() - start:.3f} s)")
+
+    if columns is not None:
+        df = df.reindex(columns=list(columns))
+
+    if explain:
+        print("\n".join(steps))
+    return df.to_numpy() if as_numpy else df
+
+
+def explain_query(table, folder="csv", player=None, team=None, map_name=None, agent=None, event=None,
+                  date_from=None, date_to=None, encoding="iso-8859-1"):
+    """query plan of query_table() without reading the files: the files, blocks and estimated rows left
+    after the date range and each index lookup
+
+    Args:
+        table (str): table name
+        folder (str, optional): csv folder. Defaults to "csv".
+        player, team, map_name, agent, event (str or list, optional): filters, see query_table().
+        date_from (str, optional): first date, YYYY-MM-DD. Defaults to None.
+        date_to (str, optional): last date, YYYY-MM-DD. Defaults to None.
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        list: plan steps
+    """
+    filters = {dimension: as_list(value) for dimension, value in
+               (("player", player), ("team", team), ("map", map_name), ("agent", agent), ("event", event))
+               if value is not None}
+    update_query_index(folder, table, encoding=encoding)
+    return plan_query(table, folder, filters, date_from, date_to)[1]
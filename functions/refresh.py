@@ -0,0 +1,168 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from bs4 import BeautifulSoup
+
+from .archive import archive_page, read_archived_page
+from .backfill import stored_match_urls
+from .extraction import MATCH_PAGE_SECTIONS, fetched_pages, process_match, select_tables
+from .fetching import fetch_page_if_modified
+from .state import get_page_state, save_page_state
+
+PERFORMANCE_TAB = "/?game=all&tab=performance"
+ECONOMY_TAB = "/?game=all&tab=economy"
+
+
+def section_hash(raw_html, decode="iso-8859-1"):
+    """hash of the page sections read by the extractors (MATCH_PAGE_SECTIONS), the rest of the page
+    (ads, sidebars, comments) changes all the time and is ignored
+
+    Args:
+        raw_html (bytes): page content
+        decode (str, optional): page encoding. Defaults to "iso-8859-1".
+
+    Returns:
+        str: sha256 hex digest
+    """
+    soup = BeautifulSoup(raw_html.decode(decode), "html.parser", parse_only=MATCH_PAGE_SECTIONS)
+    digest = hashlib.sha256(str(soup).encode("utf-8")).hexdigest()
+    soup.decompose()
+    return digest
+
+
+def match_pages(url, tables_config=None):
+    """pages of a match read by the extraction of the selected tables
+
+    Args:
+        url (str): vlr match url
+        tables_config (dict, optional): tables config dict, see select_tables(). Defaults to None.
+
+    Returns:
+        list: page urls
+    """
+    tables = select_tables(tables_config)
+    for event_tables in (tables_config or {}).get("events", {}).values():
+        tables |= set(event_tables)
+
+    pages = [url]
+    if "player_performance" in tables:
+        pages.append(url + PERFORMANCE_TAB)
+    if "team_economy" in tables:
+        pages.append(url + ECONOMY_TAB)
+    return pages
+
+
+def check_page(page_url, state_path, archive_folder=None):
+    """conditional request for a page and hash of its sections
+
+    Args:
+        page_url (str): page url
+        state_path (str): state store file
+        archive_folder (str, optional): raw html archive folder, downloaded pages are archived. Defaults to None.
+
+    Returns:
+        tuple: (status, new page state, (page content, url after the redirects)) with status "unchanged",
+            "changed" or "new", the state and the page are None if the server answered Not Modified
+    """
+    state = get_page_state(state_path, page_url) or {}
+    content, final_url, validators = fetch_page_if_modified(page_url, state.get("etag"), state.get("last_modified"))
+    if content is None:
+        return "unchanged", None, None
+
+    if archive_folder is not None:
+        archive_page(archive_folder, final_url, content)
+
+    new_state = dict(validators, content_hash=section_hash(content))
+    page = (content, final_url)
+    if not state:
+        return "new", new_state, page
+    if state["content_hash"] == new_state["content_hash"]:
+        return "unchanged", new_state, page
+    return "changed", new_state, page
+
+
+def refresh_match(url, folder="csv", encoding="utf-8", state_path="state.sqlite", archive_folder=None,
+                  tables_config=None, force=False):
+    """check a stored match and extract it again if vlr.gg changed its pages since the last check.
+    The first check of a match only records its hashes. The extraction uses the pages downloaded by the check
+    (and the archived copy of the not modified ones) instead of requesting them again. The new hashes are not
+    saved when the extraction fails, the next refresh tries the match again
+
+    Args:
+        url (str): stored vlr match url
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding. Defaults to "utf-8".
+        state_path (str, optional): state store file. Defaults to "state.sqlite".
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        tables_config (dict, optional): tables config dict, see select_tables(). Defaults to None.
+        force (bool, optional): extract the match again even if the pages did not change. Defaults to False.
+
+    Returns:
+        str: "unchanged", "new", "refreshed" or "failed"
+    """
+    checks = {page_url: check_page(page_url, state_path, archive_folder)
+              for page_url in match_pages(url, tables_config)}
+    statuses = {status for status, _, _ in checks.values()}
+
+    if force or "changed" in statuses:
+        # the pages downloaded by the checks are not requested again, the not modified ones are read from the
+        # archive when it has them
+        pages = {}
+        for page_url, (_, _, page) in checks.items():
+            if page is None and archive_folder is not None:
+                content = read_archived_page(archive_folder, page_url)
+                page = (content, page_url) if content is not None else None
+            if page is not None:
+                pages[page_url] = page
+        pages.update({page[1]: page for page in list(pages.values())})
+        with fetched_pages(pages):
+            status = process_match(url, folder, encoding, archive_folder=archive_folder,
+                                   tables_config=tables_config, replace=True)["status"]
+        if status != "processed":
+            return "failed"
+        result = "refreshed"
+    else:
+        result = "new" if "new" in statuses else "unchanged"
+
+    for page_url, (_, new_state, _) in checks.items():
+        if new_state is not None:
+            save_page_state(state_path, page_url, new_state["etag"], new_state["last_modified"],
+                            new_state["content_hash"])
+    return result
+
+
+def refresh_matches(folder="csv", encoding="utf-8", state_path="state.sqlite", workers=1, archive_folder=None,
+                    tables_config=None, force=False):
+    """consistency sweep over all the stored matches, only the matches whose pages changed are extracted again
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding. Defaults to "utf-8".
+        state_path (str, optional): state store file. Defaults to "state.sqlite".
+        workers (int, optional): matches checked at the same time. Defaults to 1.
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        tables_config (dict, optional): tables config dict, see select_tables(). Defaults to None.
+        force (bool, optional): extract all the matches again. Defaults to False.
+
+    Returns:
+        dict: number of matches by result, and the failed urls in "failed"
+    """
+    def refresh_one(url):
+        try:
+            return url, refresh_match(url, folder, encoding, state_path=state_path, archive_folder=archive_folder,
+                                      tables_config=tables_config, force=force)
+        except Exception as e:
+            print(f"error refreshing {url}: {e}")
+            return url, "failed"
+
+    summary = {"unchanged": 0, "new": 0, "refreshed": 0, "failed": []}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for url, result in pool.map(refresh_one, stored_match_urls(folder, encoding)):
+            if result == "failed":
+                summary["failed"].append(url)
+            else:
+                summary[result] += 1
+
+    print(f"Refresh: {summary['refreshed']} refreshed, {summary['unchanged']} unchanged, "
+          f"{summary['new']} first checks, {len(summary['failed'])} failed")
+    return summary
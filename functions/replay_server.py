@@ -0,0 +1,115 @@
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from .archive import archived_match_urls, load_archive_index, read_archived_page
+
+
+def url_key(url):
+    """path and query of a url, used to find the archived pages from a local request
+
+    Args:
+        url (str): full url or request path
+
+    Returns:
+        str: path?query
+    """
+    parts = urlsplit(url)
+    return parts.path + ("?" + parts.query if parts.query else "")
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """serve the archived vlr.gg pages, the behaviour is set in the server attributes. The pages have an
+    ETag and If-None-Match requests get a 304 like on vlr.gg"""
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(max(random.gauss(server.latency, server.latency / 4), 0))
+
+        with server.stats_lock:
+            server.stats["requests"] += 1
+
+        roll = random.random()
+        if roll < server.throttle_rate:
+            self.send_error_status(429, "throttled", {"Retry-After": str(server.retry_after)})
+            return
+        if roll < server.throttle_rate + server.error_rate:
+            self.send_error_status(500, "errors")
+            return
+
+        key = url_key(self.path)
+        url = server.pages.get(key)
+        if url is None and key.strip("/") in server.match_ids:  # like vlr.gg, /<id> redirects to the match url
+            self.send_response(301)
+            self.send_header("Location", url_key(server.match_ids[key.strip("/")]))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if url is None:
+            self.send_error_status(404, "not_found")
+            return
+
+        body = read_archived_page(server.archive_folder, url)
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            with server.stats_lock:
+                server.stats["not_modified"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_status(self, code, stat, headers=None):
+        with self.server.stats_lock:
+            self.server.stats[stat] += 1
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_replay_server(archive_folder, host="127.0.0.1", port=0, latency=0.05, error_rate=0.0,
+                        throttle_rate=0.0, retry_after=1):
+    """serve the raw html archive over http in a background thread, as a local copy of vlr.gg
+
+    Args:
+        archive_folder (str): raw html archive folder with the recorded pages
+        host (str, optional): host. Defaults to "127.0.0.1".
+        port (int, optional): port, 0 for a free one. Defaults to 0.
+        latency (float, optional): mean response time in seconds. Defaults to 0.05.
+        error_rate (float, optional): share of 500 responses. Defaults to 0.0.
+        throttle_rate (float, optional): share of 429 responses. Defaults to 0.0.
+        retry_after (int, optional): Retry-After seconds of the 429 responses. Defaults to 1.
+
+    Returns:
+        ThreadingHTTPServer: running server, base url in server.base_url and counters in server.stats
+    """
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    server.archive_folder = archive_folder
+    server.pages = {url_key(url): url for url in load_archive_index(archive_folder)}
+    server.match_ids = {url_key(url).split("/")[1]: url for url in archived_match_urls(archive_folder)}
+    server.latency = latency
+    server.error_rate = error_rate
+    server.throttle_rate = throttle_rate
+    server.retry_after = retry_after
+    server.stats = {"requests": 0, "throttled": 0, "errors": 0, "not_found": 0, "not_modified": 0}
+    server.stats_lock = threading.Lock()
+    server.base_url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,213 @@
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+
+import pandas as pd
+
+from .draft_analytics import draft_row_to_record
+from .processing import (ROUND_DETAIL_MIRROR, convert_numeric_columns, mirror_perspective, read_table,
+                         tournament_names)
+
+REPORT_CACHE = "_report_cache.json"
+REPORT_TABLES = ["draft", "side_wins", "players"]
+PLAYER_COLUMNS = {"ratingBoth": "rating", "acsBoth": "acs", "adrBoth": "adr", "kastBoth": "kast", "fkBoth": "fk"}
+
+
+def draft_table(draft):
+    """bans, picks and deciders of every team and map
+
+    Args:
+        draft (pd.DataFrame): draft rows of a tournament
+
+    Returns:
+        pd.DataFrame: team, map, ban, pick, decider, first_ban and first_pick
+    """
+    counts = {}
+    for row in draft.astype(str).to_dict("records"):
+        record = draft_row_to_record(row)
+        selections = [(m, "ban") for m in record["bans"]] + [(m, "pick") for m in record["picks"]]
+        selections += [(record["bans"][0], "first_ban")] if record["bans"] else []
+        selections += [(record["picks"][0], "first_pick")] if record["picks"] else []
+        selections.append((record["decider"], "decider"))
+        for map_name, key in selections:
+            counters = counts.setdefault((row["team"], map_name), dict.fromkeys(
+                ["ban", "pick", "decider", "first_ban", "first_pick"], 0))
+            counters[key] += 1
+
+    rows = [{"team": team, "map": map_name, **counters} for (team, map_name), counters in sorted(counts.items())]
+    return pd.DataFrame(rows, columns=["team", "map", "ban", "pick", "decider", "first_ban", "first_pick"])
+
+
+def side_wins_table(round_detail):
+    """rounds and round win rate of each map side
+
+    Args:
+        round_detail (pd.DataFrame): round_detail rows of a tournament
+
+    Returns:
+        pd.DataFrame: map, side, rounds, wins and win_rate
+    """
+    if round_detail.empty:
+        return pd.DataFrame(columns=["map", "side", "rounds", "wins", "win_rate"])
+    df = mirror_perspective(round_detail, ROUND_DETAIL_MIRROR, side_column="side")
+    df = df.assign(won=pd.to_numeric(df["rndA"], errors="coerce").eq(1))
+    result = df.groupby(["map", "side"])["won"].agg(rounds="size", wins="sum").reset_index()
+    result["win_rate"] = (result["wins"] / result["rounds"]).round(4)
+    return result
+
+
+def players_table(player_stats):
+    """maps played and mean stats of every player, from the per map rows
+
+    Args:
+        player_stats (pd.DataFrame): player_stats rows of a tournament
+
+    Returns:
+        pd.DataFrame: team, player, maps and the PLAYER_COLUMNS means, by rating
+    """
+    if player_stats.empty:
+        return pd.DataFrame(columns=["team", "player", "maps"] + list(PLAYER_COLUMNS.values()))
+    df = convert_numeric_columns(player_stats[player_stats["map"] != "all"].copy())
+    for column in PLAYER_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    result = df.groupby(["team", "player"]).agg(
+        maps=("map", "size"), **{name: (column, "mean") for column, name in PLAYER_COLUMNS.items()}
+    ).reset_index()
+    return result.sort_values("rating", ascending=False, ignore_index=True).round(2)
+
+
+def tournament_tables(folder, tournament, encoding="iso-8859-1"):
+    """the standard report tables of a tournament
+
+    Args:
+        folder (str): csv folder
+        tournament (str): normalized tournament name, see tournament_names()
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+
+    Returns:
+        dict: REPORT_TABLES name -> pd.DataFrame
+    """
+    def read(table):
+        return read_table(folder, table, events=[tournament], encoding=encoding)
+
+    return {
+        "draft": draft_table(read("draft")),
+        "side_wins": side_wins_table(read("round_detail")),
+        "players": players_table(read("player_stats")),
+    }
+
+
+def table_hash(df):
+    """hash of the data of a report table, a figure is rendered again only when it changes"""
+    return hashlib.sha1(df.to_csv(index=False).encode("utf-8")).hexdigest()
+
+
+def render_figure(name, df, path, title):
+    """draw a report table with the headless Agg backend
+
+    Args:
+        name (str): REPORT_TABLES name
+        df (pd.DataFrame): report table
+        path (str): png path
+        title (str): figure title
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    if name == "draft":
+        df.groupby("map")[["pick", "ban", "decider"]].sum().plot.barh(stacked=True, ax=ax)
+        ax.set_xlabel("maps")
+    elif name == "side_wins":
+        df.pivot(index="map", columns="side", values="win_rate").plot.bar(ax=ax)
+        ax.axhline(0.5, color="grey", linewidth=0.8)
+        ax.set_ylabel("round win rate")
+    else:
+        top = df.head(15)
+        ax.barh(top["player"] + " (" + top["team"] + ")", top["rating"])
+        ax.invert_yaxis()
+        ax.set_xlabel("rating")
+    ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+
+
+def _report_one(job):
+    """tables and figures of one tournament in a worker process
+
+    Returns:
+        tuple: (tournament, table hashes, rendered tables)
+    """
+    folder, tournament, report_folder, encoding, cached, draw = job
+    output = os.path.join(report_folder, tournament)
+    os.makedirs(output, exist_ok=True)
+
+    hashes = {}
+    rendered = []
+    for name, df in tournament_tables(folder, tournament, encoding).items():
+        hashes[name] = table_hash(df)
+        figure = os.path.join(output, f"{name}.png")
+        if cached.get(name) == hashes[name] and os.path.exists(os.path.join(output, f"{name}.csv")):
+            if df.empty or os.path.exists(figure):
+                continue
+        df.to_csv(os.path.join(output, f"{name}.csv"), index=False)
+        if df.empty:
+            continue
+        if not draw:
+            hashes.pop(name)  # drawn on the next run with matplotlib
+            continue
+        try:
+            render_figure(name, df, figure, f"{tournament} {name}")
+        except Exception as e:
+            print(f"error drawing {tournament} {name}: {e}")
+            hashes.pop(name)
+            continue
+        rendered.append(name)
+    return tournament, hashes, rendered
+
+
+def build_reports(folder="csv", report_folder="reports", encoding="iso-8859-1", workers=None):
+    """report tables (csv) and figures (png) of every tournament, one tournament per process. The figures
+    are cached by the hash of their table, a tournament without new matches is not drawn again
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        report_folder (str, optional): output folder, <report_folder>/<tournament>/<table>.csv|png.
+            Defaults to "reports".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+        workers (int, optional): number of processes. Defaults to the number of cores.
+
+    Returns:
+        dict: tournament -> tables drawn again
+    """
+    os.makedirs(report_folder, exist_ok=True)
+    cache_path = os.path.join(report_folder, REPORT_CACHE)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+
+    draw = importlib.util.find_spec("matplotlib") is not None
+    if not draw:
+        print("matplotlib is not installed, only the report tables are written")
+
+    tournaments = tournament_names(folder)
+    jobs = [(folder, t, report_folder, encoding, cache.get(t, {}), draw) for t in tournaments]
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+
+    rendered = {}
+    with multiprocessing.Pool(workers) as pool:
+        for tournament, hashes, names in pool.imap_unordered(_report_one, jobs):
+            cache[tournament] = hashes
+            rendered[tournament] = names
+
+    with open(cache_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(cache_path + ".tmp", cache_path)
+
+    print(f"Reports: {sum(1 for names in rendered.values() if names)}/{len(tournaments)} tournaments drawn again")
+    return rendered
@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+
+from .archive import archived_match_urls, load_archive_index
+from .dimensions import set_dimension_lock
+from .draft_analytics import rebuild_draft_aggregates
+from .extraction import process_match, set_write_lock
+from .stats_aggregates import rebuild_stats_aggregates
+
+
+def _init_worker(lock):
+    set_write_lock(lock)
+    set_dimension_lock(lock)
+
+
+def _reprocess_one(job):
+    url, archive_folder, folder, encoding, tables_config = job
+    try:
+        result = process_match(url, folder=folder, encoding=encoding, archive_folder=archive_folder, offline=True,
+                               update_aggregates=False, tables_config=tables_config)
+    except Exception as e:
+        print(f"error reprocessing {url}: {e}")
+        return url, "failed"
+    if result["status"] == "failed":  # the extractor error is saved in error_match
+        print(f"error reprocessing {url}: {result['error']}")
+    # "invalid": not final matches and showmatches are archived too, they are skipped on purpose
+    return url, result["status"]
+
+
+def reprocess_archive(archive_folder, folder="csv", encoding="utf-8", workers=None, tables_config=None):
+    """run all the extractors over the archived matches, without network and in parallel
+
+    Args:
+        archive_folder (str): raw html archive folder
+        folder (str, optional): output folder, should be empty for a full rebuild. Defaults to "csv".
+        encoding (str, optional): encoding. Defaults to "utf-8".
+        workers (int, optional): number of processes. Defaults to the number of cores.
+        tables_config (dict, optional): tables to extract, see select_tables(). Defaults to None (all the tables).
+
+    Returns:
+        list: urls that failed, the matches that are not final and the showmatches are skipped and not listed
+    """
+    if not load_archive_index(archive_folder):
+        print(f"Empty archive: {archive_folder}")
+        return []
+
+    urls = archived_match_urls(archive_folder)
+    jobs = [(url, archive_folder, folder, encoding, tables_config) for url in urls]
+    workers = workers or os.cpu_count() or 1
+
+    failed = []
+    invalid = 0
+    lock = multiprocessing.Lock()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(lock,)) as pool:
+        for url, status in pool.imap_unordered(_reprocess_one, jobs, chunksize=4):
+            if status == "failed":
+                failed.append(url)
+            elif status == "invalid":
+                invalid += 1
+
+    # the workers don't share the aggregates, they are rebuilt once from the csv files
+    rebuild_draft_aggregates(folder, encoding=encoding)
+    rebuild_stats_aggregates(folder, encoding=encoding)
+
+    print(f"Reprocessed {len(urls) - len(failed) - invalid}/{len(urls)} matches, {len(failed)} failed, "
+          f"{invalid} skipped (not final or showmatch)")
+    return failed
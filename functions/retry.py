@@ -0,0 +1,197 @@
+import csv
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .extraction import process_match
+from .layout import iter_table_files
+from .state import get_connection
+
+
+def error_step(error):
+    """extractor that raised a process_match() error ("<table>: <exception>")
+
+    Args:
+        error (str): error column of error_match
+
+    Returns:
+        str: table name, "unknown" for the errors saved before the table was recorded
+    """
+    found = re.match(r"^(\w+): ", error or "")
+    return found.group(1) if found else "unknown"
+
+
+def import_match_errors(state_path, folder="csv", encoding="utf-8"):
+    """add the matches of the error_match files to the retry queue, the matches already in the queue keep
+    their attempts
+
+    Args:
+        state_path (str): state store file
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding of the csv files. Defaults to "utf-8".
+
+    Returns:
+        int: matches added to the queue
+    """
+    rows = []
+    for file_path in iter_table_files(folder, "error_match"):
+        with open(file_path, newline="", encoding=encoding) as f:
+            for row in csv.DictReader(f):
+                rows.append((row["url"], row["event"], error_step(row["error"]), row["error"]))
+
+    connection = get_connection(state_path)
+    with connection:
+        before = connection.total_changes
+        connection.executemany(
+            "INSERT OR IGNORE INTO retry_queue (url, event, step, error) VALUES (?, ?, ?, ?)", rows
+        )
+        return connection.total_changes - before
+
+
+def queue_retry(state_path, url, error, event=None):
+    """add a match that failed before its extraction (no error_match row) to the retry queue
+
+    Args:
+        state_path (str): state store file
+        url (str): match url
+        error (str): "<step>: <exception>" error
+        event (str, optional): event name. Defaults to None.
+    """
+    connection = get_connection(state_path)
+    with connection:
+        connection.execute(
+            "INSERT OR IGNORE INTO retry_queue (url, event, step, error) VALUES (?, ?, ?, ?)",
+            (url, event, error_step(error), error),
+        )
+
+
+def due_retries(state_path, max_attempts=5, now=None):
+    """pending matches whose backoff is over, the matches of an open circuit are left in the queue
+
+    Args:
+        state_path (str): state store file
+        max_attempts (int, optional): attempts before a match is given up. Defaults to 5.
+        now (float, optional): current time. Defaults to None (time.time()).
+
+    Returns:
+        list: (url, step) tuples
+    """
+    now = time.time() if now is None else now
+    return get_connection(state_path).execute(
+        """SELECT url, step FROM retry_queue
+           WHERE status = 'pending' AND attempts < ? AND next_attempt_at <= ?
+             AND step NOT IN (SELECT step FROM circuit_breaker WHERE opened_until > ?)
+           ORDER BY next_attempt_at, url""",
+        (max_attempts, now, now),
+    ).fetchall()
+
+
+def is_circuit_open(state_path, step, now=None):
+    """True if the circuit of an extractor is open
+
+    Args:
+        state_path (str): state store file
+        step (str): extractor table name
+        now (float, optional): current time. Defaults to None (time.time()).
+
+    Returns:
+        bool: True if the retries of the extractor are paused
+    """
+    now = time.time() if now is None else now
+    row = get_connection(state_path).execute(
+        "SELECT opened_until FROM circuit_breaker WHERE step = ?", (step,)
+    ).fetchone()
+    return row is not None and row[0] > now
+
+
+def record_retry(state_path, url, result, max_attempts=5, backoff=3600.0, breaker_threshold=5,
+                 breaker_cooldown=86400.0):
+    """update the queue and the circuit breakers with the result of a retry. A failed match waits
+    backoff * 2 ** (attempts - 1) seconds, and after breaker_threshold failures in a row of the same
+    extractor its circuit opens for breaker_cooldown seconds
+
+    Args:
+        state_path (str): state store file
+        url (str): match url
+        result (dict): process_match() result
+        max_attempts (int, optional): attempts before a match is given up. Defaults to 5.
+        backoff (float, optional): delay after the first failure in seconds. Defaults to 3600.0.
+        breaker_threshold (int, optional): failures in a row that open a circuit. Defaults to 5.
+        breaker_cooldown (float, optional): seconds a circuit stays open. Defaults to 86400.0.
+
+    Returns:
+        str: new status of the match, "done", "pending" or "gave_up"
+    """
+    now = time.time()
+    connection = get_connection(state_path)
+    with connection:
+        attempts = connection.execute("SELECT attempts FROM retry_queue WHERE url = ?", (url,)).fetchone()[0] + 1
+
+        if result["status"] in ("processed", "skipped"):
+            status = "done"
+            connection.execute("UPDATE retry_queue SET attempts = ?, status = ? WHERE url = ?", (attempts, status, url))
+            connection.execute("UPDATE circuit_breaker SET failures = 0 WHERE step = (SELECT step FROM retry_queue "
+                               "WHERE url = ?)", (url,))
+            return status
+
+        status = "gave_up" if result["status"] == "invalid" or attempts >= max_attempts else "pending"
+        step = result.get("step") or "unknown"
+        connection.execute(
+            "UPDATE retry_queue SET step = ?, error = ?, attempts = ?, next_attempt_at = ?, status = ? WHERE url = ?",
+            (step, result.get("error"), attempts, now + backoff * 2 ** (attempts - 1), status, url),
+        )
+        connection.execute(
+            "INSERT INTO circuit_breaker (step, failures) VALUES (?, 1) "
+            "ON CONFLICT(step) DO UPDATE SET failures = failures + 1",
+            (step,),
+        )
+        connection.execute(
+            "UPDATE circuit_breaker SET opened_until = ?, failures = 0 WHERE step = ? AND failures >= ?",
+            (now + breaker_cooldown, step, breaker_threshold),
+        )
+    return status
+
+
+def retry_failures(folder="csv", encoding="utf-8", state_path="state.sqlite", workers=1, archive_folder=None,
+                   tables_config=None, max_attempts=5, backoff=3600.0, breaker_threshold=5, breaker_cooldown=86400.0):
+    """retry the failed matches of the error_match files, only those matches are requested. The stored
+    rows of a retried match are replaced (see process_match(replace=True))
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding. Defaults to "utf-8".
+        state_path (str, optional): state store file. Defaults to "state.sqlite".
+        workers (int, optional): matches retried at the same time. Defaults to 1.
+        archive_folder (str, optional): raw html archive folder. Defaults to None.
+        tables_config (dict, optional): tables to extract, see select_tables(). Defaults to None.
+        max_attempts (int, optional): attempts before a match is given up. Defaults to 5.
+        backoff (float, optional): delay after the first failure in seconds. Defaults to 3600.0.
+        breaker_threshold (int, optional): failures in a row of an extractor that open its circuit. Defaults to 5.
+        breaker_cooldown (float, optional): seconds a circuit stays open. Defaults to 86400.0.
+
+    Returns:
+        dict: number of retried matches by new status, and the matches skipped by an open circuit in "paused"
+    """
+    import_match_errors(state_path, folder, encoding)
+    summary = {"done": 0, "pending": 0, "gave_up": 0, "paused": 0}
+
+    def retry_one(job):
+        url, step = job
+        if is_circuit_open(state_path, step):  # opened by another worker during this run
+            return "paused"
+        try:
+            result = process_match(url, folder, encoding, archive_folder=archive_folder, tables_config=tables_config,
+                                   replace=True)
+        except Exception as e:
+            print(f"error retrying {url}: {e}")
+            result = {"status": "failed", "step": "fetch", "error": f"fetch: {type(e).__name__}: {e}"}
+        return record_retry(state_path, url, result, max_attempts=max_attempts, backoff=backoff,
+                            breaker_threshold=breaker_threshold, breaker_cooldown=breaker_cooldown)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for status in pool.map(retry_one, due_retries(state_path, max_attempts)):
+            summary[status] += 1
+
+    print(f"Retry: {summary['done']} recovered, {summary['pending']} still failing, {summary['gave_up']} given up, "
+          f"{summary['paused']} paused by an open circuit")
+    return summary
@@ -0,0 +1,52 @@
+import re
+import subprocess
+import sys
+
+CRAWL_IMPORTS = "import functions.extraction"
+
+
+def measure_import_time(statement=CRAWL_IMPORTS, runs=3):
+    """measure the import time of a statement with python -X importtime in a clean interpreter
+
+    Args:
+        statement (str, optional): python code to measure. Defaults to the crawl path imports.
+        runs (int, optional): number of measures, the fastest is kept. Defaults to 3.
+
+    Returns:
+        tuple: (total time in ms, list of (module, cumulative ms) sorted by cumulative time)
+    """
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement],
+            capture_output=True, text=True,
+        )
+        modules = []
+        for line in result.stderr.splitlines():
+            found = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+            if found and not found.group(3):  # only top level imports, the nested ones are in cumulative
+                modules.append((found.group(4), int(found.group(2)) / 1000))
+
+        total = sum(ms for _, ms in modules)
+        if best is None or total < best[0]:
+            best = (total, sorted(modules, key=lambda x: x[1], reverse=True))
+
+    return best
+
+
+def check_import_budget(budget_ms, statement=CRAWL_IMPORTS):
+    """print the import time of the crawl path and compare it with the budget
+
+    Args:
+        budget_ms (float): import time budget in ms
+        statement (str, optional): python code to measure. Defaults to the crawl path imports.
+
+    Returns:
+        bool: True if the imports fit in the budget
+    """
+    total, modules = measure_import_time(statement)
+    print(f"import time: {total:.1f} ms (budget {budget_ms} ms)")
+    for name, ms in modules[:5]:
+        print(f"    {name}: {ms:.1f} ms")
+
+    return total <= budget_ms
@@ -0,0 +1,249 @@
+import sqlite3
+import threading
+import time
+
+from .archive import match_id_from_url
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS processed_listing (
+        url TEXT PRIMARY KEY,
+        processed_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS match_page (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT NOT NULL,
+        checked_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS retry_queue (
+        url TEXT PRIMARY KEY,
+        event TEXT,
+        step TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending'
+    )""",
+    """CREATE TABLE IF NOT EXISTS export_mark (
+        target TEXT,
+        file TEXT,
+        table_name TEXT,
+        inode INTEGER,
+        offset INTEGER,
+        exported_at REAL,
+        PRIMARY KEY (target, file)
+    )""",
+    """CREATE TABLE IF NOT EXISTS circuit_breaker (
+        step TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL DEFAULT 0,
+        opened_until REAL NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS match_registry (
+        match_id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL,
+        status TEXT NOT NULL,
+        run_id TEXT,
+        updated_at REAL NOT NULL
+    )""",
+]
+
+# a match running for another run is taken over after this time, the run was stopped before the end
+MATCH_LEASE_SECONDS = 30 * 60
+
+_connections = threading.local()
+
+
+def get_connection(path, schema=None):
+    """sqlite connection to the run state store, one per thread and path. The store uses WAL so that
+    several threads or processes can read while one commits.
+
+    Args:
+        path (str): state store file
+        schema (list, optional): create statements, other sqlite stores of the package pass their own.
+            Defaults to None (SCHEMA).
+
+    Returns:
+        sqlite3.Connection: connection with the schema created
+    """
+    connections = getattr(_connections, "by_path", None)
+    if connections is None:
+        connections = _connections.by_path = {}
+
+    if path not in connections:
+        connection = sqlite3.connect(path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            for statement in SCHEMA if schema is None else schema:
+                connection.execute(statement)
+        connections[path] = connection
+
+    return connections[path]
+
+
+def mark_listing_processed(path, url):
+    """record an event listing as processed, the commit is atomic
+
+    Args:
+        path (str): state store file
+        url (str): event matches page url
+    """
+    connection = get_connection(path)
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO processed_listing (url, processed_at) VALUES (?, ?)", (url, time.time())
+        )
+
+
+def processed_listings(path):
+    """event listings already processed
+
+    Args:
+        path (str): state store file
+
+    Returns:
+        set: urls
+    """
+    return {row[0] for row in get_connection(path).execute("SELECT url FROM processed_listing")}
+
+
+def import_processed_urls(path, urls):
+    """copy the processed_url list of an old config.json into the state store, the urls already
+    in the store are kept
+
+    Args:
+        path (str): state store file
+        urls (list): processed urls
+    """
+    connection = get_connection(path)
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO processed_listing (url, processed_at) VALUES (?, ?)",
+            [(url, time.time()) for url in urls],
+        )
+
+
+def get_page_state(path, url):
+    """validators and content hash stored for a page
+
+    Args:
+        path (str): state store file
+        url (str): page url
+
+    Returns:
+        dict: {"etag", "last_modified", "content_hash"}, None if the page was never checked
+    """
+    row = get_connection(path).execute(
+        "SELECT etag, last_modified, content_hash FROM match_page WHERE url = ?", (url,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"etag": row[0], "last_modified": row[1], "content_hash": row[2]}
+
+
+def save_page_state(path, url, etag, last_modified, content_hash):
+    """store the validators and content hash of a page
+
+    Args:
+        path (str): state store file
+        url (str): page url
+        etag (str): ETag of the response, can be None
+        last_modified (str): Last-Modified of the response, can be None
+        content_hash (str): hash of the page sections used by the extractors
+    """
+    connection = get_connection(path)
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO match_page (url, etag, last_modified, content_hash, checked_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (url, etag, last_modified, content_hash, time.time()),
+        )
+
+
+def claim_match(path, match_id, url, run_id, lease=MATCH_LEASE_SECONDS):
+    """claim a match for a run in the global match registry, every match id is crawled once whatever the
+    listings that have it. A match can be claimed if it is not in the registry, if it failed, if it was
+    crawled with only some tables or if it is running for another run since more than the lease (stopped
+    before the end). The claim is one atomic statement
+
+    Args:
+        path (str): state store file
+        match_id (int): vlr match id
+        url (str): match url
+        run_id (str): id of the crawl run
+        lease (float, optional): seconds before a running match of another run is taken over.
+            Defaults to MATCH_LEASE_SECONDS.
+
+    Returns:
+        bool: True if the run has to crawl the match
+    """
+    now = time.time()
+    connection = get_connection(path)
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO match_registry (match_id, url, status, run_id, updated_at) VALUES (?, ?, 'running', ?, ?) "
+            "ON CONFLICT (match_id) DO UPDATE SET url = excluded.url, status = 'running', "
+            "run_id = excluded.run_id, updated_at = excluded.updated_at "
+            "WHERE match_registry.status IN ('failed', 'partial') "
+            "OR (match_registry.status = 'running' AND match_registry.run_id != excluded.run_id "
+            "AND match_registry.updated_at < ?)",
+            (match_id, url, run_id, now, now - lease),
+        )
+    return cursor.rowcount == 1
+
+
+def finish_match(path, match_id, status):
+    """record the end of a claimed match: "done", "partial" (only some tables extracted) and "failed" stay
+    in the registry, a match that is not final yet (status "invalid" of process_match) is removed so that
+    a later run crawls it again. Only "done" matches are skipped by the next runs
+
+    Args:
+        path (str): state store file
+        match_id (int): vlr match id
+        status (str): "done", "partial", "failed" or "invalid"
+    """
+    connection = get_connection(path)
+    with connection:
+        if status == "invalid":
+            connection.execute("DELETE FROM match_registry WHERE match_id = ?", (match_id,))
+        else:
+            connection.execute(
+                "UPDATE match_registry SET status = ?, updated_at = ? WHERE match_id = ?",
+                (status, time.time(), match_id),
+            )
+
+
+def match_registry_size(path):
+    """number of matches in the global match registry"""
+    return get_connection(path).execute("SELECT COUNT(*) FROM match_registry").fetchone()[0]
+
+
+def seed_match_registry(path, urls):
+    """add the matches already stored in the csv folder to the registry as done, the matches already
+    in the registry are kept
+
+    Args:
+        path (str): state store file
+        urls (list): stored match urls
+    """
+    rows = {match_id_from_url(url): url for url in urls}
+    rows.pop(None, None)
+    connection = get_connection(path)
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO match_registry (match_id, url, status, run_id, updated_at) "
+            "VALUES (?, ?, 'done', NULL, ?)",
+            [(match_id, url, time.time()) for match_id, url in rows.items()],
+        )
+
+
+def compact_state(path):
+    """fold the WAL journal into the database file and reclaim the free pages
+
+    Args:
+        path (str): state store file
+    """
+    connection = get_connection(path)
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.execute("VACUUM")
@@ -0,0 +1,326 @@
+import csv
+import os
+from datetime import datetime, timedelta
+
+from .layout import iter_table_files
+from .state import get_connection
+
+STATS_AGGREGATES_FILE = "_stats_aggregates.sqlite"
+
+# player_stats columns (both sides) kept by map
+PLAYER_STATS = {"rating": "ratingBoth", "acs": "acsBoth", "adr": "adrBoth", "kast": "kastBoth", "fk": "fkBoth"}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS player_map (
+        player TEXT, team TEXT, event TEXT, date TEXT, map TEXT,
+        rating REAL, acs REAL, adr REAL, kast REAL, fk REAL,
+        PRIMARY KEY (player, event, date, map)
+    )""",
+    "CREATE INDEX IF NOT EXISTS player_map_date ON player_map (player, date)",
+    """CREATE TABLE IF NOT EXISTS player_total (
+        player TEXT PRIMARY KEY, maps INTEGER,
+        rating_sum REAL, rating_n INTEGER, acs_sum REAL, acs_n INTEGER, adr_sum REAL, adr_n INTEGER,
+        kast_sum REAL, kast_n INTEGER, fk_sum REAL, fk_n INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS team_map (
+        team TEXT, event TEXT, date TEXT, map TEXT,
+        atk_rounds INTEGER, atk_wins INTEGER, def_rounds INTEGER, def_wins INTEGER,
+        PRIMARY KEY (team, event, date, map)
+    )""",
+    "CREATE INDEX IF NOT EXISTS team_map_date ON team_map (team, date)",
+    """CREATE TABLE IF NOT EXISTS team_total (
+        team TEXT PRIMARY KEY, maps INTEGER,
+        atk_rounds INTEGER, atk_wins INTEGER, def_rounds INTEGER, def_wins INTEGER
+    )""",
+]
+
+
+def get_stats_aggregates_path(folder="csv"):
+    """path of the materialized player and team aggregates
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+
+    Returns:
+        str: sqlite file path
+    """
+    return os.path.join(folder, STATS_AGGREGATES_FILE)
+
+
+def _connection(folder):
+    os.makedirs(folder, exist_ok=True)
+    return get_connection(get_stats_aggregates_path(folder), schema=SCHEMA)
+
+
+def to_number(value):
+    """float of a stored stat ("45%" in the csv saved before the typed values), None for the empty values"""
+    try:
+        number = float(str(value).rstrip("%"))
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number
+
+
+def _add_player_map(connection, row, sign=1):
+    """add (sign=1) or remove (sign=-1) a player_map row from the player totals"""
+    stats = [row[stat] for stat in PLAYER_STATS]
+    values = []
+    for value in stats:
+        values.extend([sign * (value or 0.0), sign * int(value is not None)])
+    connection.execute(
+        """INSERT INTO player_total VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(player) DO UPDATE SET maps = maps + excluded.maps,
+             rating_sum = rating_sum + excluded.rating_sum, rating_n = rating_n + excluded.rating_n,
+             acs_sum = acs_sum + excluded.acs_sum, acs_n = acs_n + excluded.acs_n,
+             adr_sum = adr_sum + excluded.adr_sum, adr_n = adr_n + excluded.adr_n,
+             kast_sum = kast_sum + excluded.kast_sum, kast_n = kast_n + excluded.kast_n,
+             fk_sum = fk_sum + excluded.fk_sum, fk_n = fk_n + excluded.fk_n""",
+        [row["player"], sign] + values,
+    )
+
+
+def _add_team_map(connection, row, sign=1):
+    """add (sign=1) or remove (sign=-1) a team_map row from the team totals"""
+    connection.execute(
+        """INSERT INTO team_total VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT(team) DO UPDATE SET maps = maps + excluded.maps,
+             atk_rounds = atk_rounds + excluded.atk_rounds, atk_wins = atk_wins + excluded.atk_wins,
+             def_rounds = def_rounds + excluded.def_rounds, def_wins = def_wins + excluded.def_wins""",
+        [row["team"], sign] + [sign * row[key] for key in ("atk_rounds", "atk_wins", "def_rounds", "def_wins")],
+    )
+
+
+def columns_to_rows(table_dict):
+    """row dicts of a dict with one list per column (the get_* dicts)"""
+    return [dict(zip(table_dict, values)) for values in zip(*table_dict.values())]
+
+
+def player_map_rows(player_stats):
+    """player_map rows of player_stats rows, the "all" maps are skipped
+
+    Args:
+        player_stats (list): player_stats row dicts
+
+    Returns:
+        list: player_map row dicts
+    """
+    return [
+        dict({"player": row["player"], "team": row["team"], "event": row["event"], "date": row["date"],
+              "map": row["map"]},
+             **{stat: to_number(row.get(column)) for stat, column in PLAYER_STATS.items()})
+        for row in player_stats
+        if row["map"] != "all"
+    ]
+
+
+def team_map_rows(round_rows):
+    """team_map rows (rounds and round wins by side) of round_detail rows. Rows of both perspectives
+    (files saved before the single perspective) are read without counting the rounds twice
+
+    Args:
+        round_rows (list): round_detail row dicts
+
+    Returns:
+        list: team_map row dicts
+    """
+    maps = {}
+    for row in round_rows:
+        key = (row["event"], row["date"], row["map"], frozenset((row["teamA"], row["teamB"])))
+        maps.setdefault(key, []).append(row)
+
+    team_rows = []
+    for (event, date, map_name, teams), rows in maps.items():
+        for team in teams:
+            own = [r for r in rows if r["teamA"] == team]
+            if own:
+                sides = [(r["side"], int(r["rndA"])) for r in own]
+            else:
+                sides = [("def" if r["side"] == "atk" else "atk", int(r["rndB"])) for r in rows if r["teamB"] == team]
+            team_rows.append({
+                "team": team, "event": event, "date": date, "map": map_name,
+                "atk_rounds": sum(1 for side, _ in sides if side == "atk"),
+                "atk_wins": sum(won for side, won in sides if side == "atk"),
+                "def_rounds": sum(1 for side, _ in sides if side == "def"),
+                "def_wins": sum(won for side, won in sides if side == "def"),
+            })
+    return team_rows
+
+
+def update_player_aggregates(player_stats, folder="csv"):
+    """add the maps of a match to the player aggregates, called by process_match after the player stats
+    are saved. The maps already stored are ignored
+
+    Args:
+        player_stats (list): player_stats row dicts
+        folder (str, optional): csv folder. Defaults to "csv".
+    """
+    connection = _connection(folder)
+    with connection:
+        for row in player_map_rows(player_stats):
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO player_map VALUES (:player, :team, :event, :date, :map, "
+                ":rating, :acs, :adr, :kast, :fk)", row
+            ).rowcount
+            if inserted:
+                _add_player_map(connection, row)
+
+
+def update_team_aggregates(round_rows, folder="csv"):
+    """add the maps of a match to the team aggregates, called by process_match after the round detail
+    is saved. The maps already stored are ignored
+
+    Args:
+        round_rows (list): round_detail row dicts
+        folder (str, optional): csv folder. Defaults to "csv".
+    """
+    connection = _connection(folder)
+    with connection:
+        for row in team_map_rows(round_rows):
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO team_map VALUES (:team, :event, :date, :map, "
+                ":atk_rounds, :atk_wins, :def_rounds, :def_wins)", row
+            ).rowcount
+            if inserted:
+                _add_team_map(connection, row)
+
+
+def remove_match_aggregates(basic_match_info, folder="csv"):
+    """remove a match from the player and team aggregates, used before a match is extracted again
+
+    Args:
+        basic_match_info (dict): basic match info dict of the match
+        folder (str, optional): csv folder. Defaults to "csv".
+    """
+    if not os.path.exists(get_stats_aggregates_path(folder)):
+        return
+
+    teams = {basic_match_info[key] for key in ("team_a", "team_b", "team_a_tricode", "team_b_tricode")}
+    match = {"event": basic_match_info["event"], "date": basic_match_info["date"]}
+    connection = _connection(folder)
+    with connection:
+        columns = ["player", "team", "event", "date", "map"] + list(PLAYER_STATS)
+        for values in connection.execute("SELECT * FROM player_map WHERE event = :event AND date = :date",
+                                         match).fetchall():
+            row = dict(zip(columns, values))
+            if row["team"] in teams:
+                _add_player_map(connection, row, sign=-1)
+                connection.execute("DELETE FROM player_map WHERE player = ? AND event = ? AND date = ? AND map = ?",
+                                   (row["player"], row["event"], row["date"], row["map"]))
+
+        columns = ["team", "event", "date", "map", "atk_rounds", "atk_wins", "def_rounds", "def_wins"]
+        for values in connection.execute("SELECT * FROM team_map WHERE event = :event AND date = :date",
+                                         match).fetchall():
+            row = dict(zip(columns, values))
+            if row["team"] in teams:
+                _add_team_map(connection, row, sign=-1)
+                connection.execute("DELETE FROM team_map WHERE team = ? AND event = ? AND date = ? AND map = ?",
+                                   (row["team"], row["event"], row["date"], row["map"]))
+
+
+def rebuild_stats_aggregates(folder="csv", encoding="iso-8859-1"):
+    """build the aggregates from all the player_stats and round_detail csv files
+
+    Args:
+        folder (str, optional): csv folder. Defaults to "csv".
+        encoding (str, optional): encoding of the csv files. Defaults to "iso-8859-1".
+    """
+    connection = _connection(folder)
+    with connection:
+        for table in ("player_map", "player_total", "team_map", "team_total"):
+            connection.execute(f"DELETE FROM {table}")
+
+    for file_path in iter_table_files(folder, "player_stats"):
+        with open(file_path, newline="", encoding=encoding) as f:
+            update_player_aggregates(list(csv.DictReader(f)), folder)
+
+    for file_path in iter_table_files(folder, "round_detail"):
+        with open(file_path, newline="", encoding=encoding) as f:
+            update_team_aggregates(list(csv.DictReader(f)), folder)
+
+
+def _window(connection, table, key_column, key, last_n=None, days=None):
+    """rows of the last maps of a player or team, newest first"""
+    query = f"SELECT * FROM {table} WHERE {key_column} = ?"
+    params = [key]
+    if days is not None:
+        last = connection.execute(f"SELECT MAX(date) FROM {table} WHERE {key_column} = ?", (key,)).fetchone()[0]
+        if last is None:
+            return []
+        since = datetime.strptime(last[:10], "%Y-%m-%d") - timedelta(days=days)
+        query += " AND date >= ?"
+        params.append(since.strftime("%Y-%m-%d"))
+    query += " ORDER BY date DESC"
+    if last_n is not None:
+        query += " LIMIT ?"
+        params.append(last_n)
+    return connection.execute(query, params).fetchall()
+
+
+def player_averages(player, folder="csv", last_n=None, days=None):
+    """average rating, ACS, ADR, KAST and first kills by map of a player. All time from the totals, or over
+    the last maps / days before the last map of the player
+
+    Args:
+        player (str): player name
+        folder (str, optional): csv folder. Defaults to "csv".
+        last_n (int, optional): last maps. Defaults to None.
+        days (int, optional): days before the last map. Defaults to None.
+
+    Returns:
+        dict: {"maps", "rating", "acs", "adr", "kast", "fk"}, None for a player without maps
+    """
+    connection = _connection(folder)
+    if last_n is None and days is None:
+        row = connection.execute("SELECT * FROM player_total WHERE player = ?", (player,)).fetchone()
+        if row is None or row[1] == 0:
+            return None
+        averages = {"maps": row[1]}
+        for index, stat in enumerate(PLAYER_STATS):
+            total, count = row[2 + 2 * index], row[3 + 2 * index]
+            averages[stat] = total / count if count else None
+        return averages
+
+    rows = _window(connection, "player_map", "player", player, last_n, days)
+    if not rows:
+        return None
+    averages = {"maps": len(rows)}
+    for index, stat in enumerate(PLAYER_STATS):
+        values = [row[5 + index] for row in rows if row[5 + index] is not None]
+        averages[stat] = sum(values) / len(values) if values else None
+    return averages
+
+
+def team_side_rates(team, folder="csv", last_n=None, days=None):
+    """round win rate by side of a team. All time from the totals, or over the last maps / days before the
+    last map of the team
+
+    Args:
+        team (str): team tricode
+        folder (str, optional): csv folder. Defaults to "csv".
+        last_n (int, optional): last maps. Defaults to None.
+        days (int, optional): days before the last map. Defaults to None.
+
+    Returns:
+        dict: {"maps", "atk_rounds", "atk_win_rate", "def_rounds", "def_win_rate"}, None for a team without maps
+    """
+    connection = _connection(folder)
+    if last_n is None and days is None:
+        row = connection.execute("SELECT maps, atk_rounds, atk_wins, def_rounds, def_wins FROM team_total "
+                                 "WHERE team = ?", (team,)).fetchone()
+        if row is None or row[0] == 0:
+            return None
+        maps, atk_rounds, atk_wins, def_rounds, def_wins = row
+    else:
+        rows = _window(connection, "team_map", "team", team, last_n, days)
+        if not rows:
+            return None
+        maps = len(rows)
+        atk_rounds, atk_wins, def_rounds, def_wins = (sum(row[i] for row in rows) for i in range(4, 8))
+
+    return {
+        "maps": maps,
+        "atk_rounds": atk_rounds,
+        "atk_win_rate": atk_wins / atk_rounds if atk_rounds else None,
+        "def_rounds": def_rounds,
+        "def_win_rate": def_wins / def_rounds if def_rounds else None,
+    }
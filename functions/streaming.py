@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import stat
+import sys
+import threading
+from contextlib import contextmanager, redirect_stdout
+from logging.handlers import RotatingFileHandler
+
+from .archive import match_id_from_url
+
+_stream_logger = logging.getLogger("vlr.stream")
+_stream_logger.propagate = False
+_stream_logger.setLevel(logging.INFO)
+_current_match = threading.local()
+
+
+def set_stream_output(target=None, max_bytes=100 * 1024 * 1024, backup_count=5):
+    """stream every saved row as a json line {"table", "match_id", "url", <row columns>}, the rows of a match
+    are written and flushed together when the match ends. The rows for "-" go to the original stdout of the
+    process, see stream_output() to keep the print() messages out of them
+
+    Args:
+        target (str, optional): "-" for stdout, a named pipe (opened when the first reader connects) or
+            a file rotated at max_bytes. No streaming if None. Defaults to None.
+        max_bytes (int, optional): size of the rotated files. Defaults to 100 MB.
+        backup_count (int, optional): rotated files kept. Defaults to 5.
+    """
+    for handler in list(_stream_logger.handlers):
+        _stream_logger.removeHandler(handler)
+        handler.close()
+
+    if target is None:
+        return
+    if target == "-":
+        handler = logging.StreamHandler(sys.__stdout__)
+    elif os.path.exists(target) and stat.S_ISFIFO(os.stat(target).st_mode):
+        handler = logging.StreamHandler(open(target, "w", encoding="utf-8"))
+    else:
+        handler = RotatingFileHandler(target, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _stream_logger.addHandler(handler)
+
+
+@contextmanager
+def stream_output(target=None, **kwargs):
+    """set_stream_output() for the duration of a run, with stdout the print() messages go to stderr until
+    the end of the run and the stream is closed at the end
+
+    Args:
+        target (str, optional): see set_stream_output(). Defaults to None.
+        **kwargs: other set_stream_output() arguments
+    """
+    set_stream_output(target, **kwargs)
+    try:
+        if target == "-":
+            with redirect_stdout(sys.stderr):
+                yield
+        else:
+            yield
+    finally:
+        set_stream_output(None)
+
+
+def is_streaming():
+    """True if set_stream_output() is active"""
+    return bool(_stream_logger.handlers)
+
+
+@contextmanager
+def stream_match(url):
+    """collect the rows streamed while a match is processed and write them in one flush at the end
+
+    Args:
+        url (str): match url
+    """
+    if not is_streaming():
+        yield
+        return
+
+    _current_match.rows = []
+    _current_match.url = url
+    try:
+        yield
+    finally:
+        lines = _current_match.rows
+        _current_match.rows = None
+        _current_match.url = None
+        if lines:
+            _stream_logger.info("\n".join(lines))
+
+
+def stream_rows(table, table_dict):
+    """stream the rows of a saved table dict, kept until the end of the current match
+
+    Args:
+        table (str): table name
+        table_dict (dict): dict with one list per column
+    """
+    if not is_streaming():
+        return
+
+    url = getattr(_current_match, "url", None)
+    tags = {"table": table, "match_id": match_id_from_url(url) if url else None, "url": url}
+    lines = [json.dumps(dict(tags, **dict(zip(table_dict, values))), default=str)
+             for values in zip(*table_dict.values())]
+
+    if getattr(_current_match, "rows", None) is not None:
+        _current_match.rows.extend(lines)
+    elif lines:
+        _stream_logger.info("\n".join(lines))
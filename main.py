@@ -1,34 +1,262 @@
+import argparse
 import json
-from functions import link_extractor, process_match
+import os
 
 def load_json(path):
     with open(path) as json_file:
         config = json.load(json_file)
     return config
 
-def main():
+def parse_tables(tables):
+    from functions.extraction import TABLES
+
+    names = [name.strip() for name in tables.split(",") if name.strip()]
+    unknown = [name for name in names if name not in TABLES]
+    if unknown:
+        raise SystemExit(f"Unknown tables {unknown}, the tables are {TABLES}")
+    return names
+
+def load_tables_config(tables=None):
+    tables_config = load_json("tables_config.json") if os.path.exists("tables_config.json") else {}
+    if tables:
+        tables_config = {"tables": parse_tables(tables)}  # the run selection replaces the per event ones
+    return tables_config
+
+def main(tables=None, stream=None):
+    from functions.backfill import stored_match_urls
+    from functions.crawler import crawl_regions
+    from functions.fetching import set_request_rate
+    from functions.layout import set_dataset_layout
+    from functions.memory import enable_memory_profiling, set_memory_budget
+    from functions.state import (import_processed_urls, mark_listing_processed, match_registry_size,
+                                 processed_listings, seed_match_registry)
+    from functions.streaming import stream_output
+
     config = load_json("config.json")
+    tables_config = load_tables_config(tables)
     folder = config["folder"]
+    set_dataset_layout(folder, config.get("layout", "tournament"))
     encoding = config["encoding"]
-    processed_url = config["processed_url"]
-    urls = []
+    archive_folder = config.get("archive_folder")
+    state_path = config.get("state_path", "state.sqlite")
+    import_processed_urls(state_path, config.get("processed_url", []))
+    processed_url = processed_listings(state_path)
+    if not match_registry_size(state_path):  # matches crawled before the registry
+        seed_match_registry(state_path, stored_match_urls(folder, encoding))
+    workers = config.get("workers", 1)
+    set_request_rate(config.get("requests_per_second"))
+    set_memory_budget(config.get("memory_budget_mb"))
+    if config.get("memory_profile"):
+        enable_memory_profiling(config["memory_profile"])
+    listings = {
+        region: [url for url in urls if url not in processed_url] for region, urls in config["url"].items()
+    }
+    with stream_output(stream or config.get("stream_output")):
+        crawl_regions(listings, folder, encoding, workers=workers, archive_folder=archive_folder,
+                      tables_config=tables_config, state_path=state_path,
+                      on_listing_done=lambda matches_page_url: mark_listing_processed(state_path, matches_page_url))
+
+        print("Done processing")
+
+def reprocess(folder=None, workers=None, tables=None):
+    from functions.layout import set_dataset_layout
+    from functions.reprocess import reprocess_archive
+
+    config = load_json("config.json")
+    archive_folder = config.get("archive_folder")
+    if archive_folder is None:
+        print("Set archive_folder in config.json")
+        return
+
+    folder = folder or config["folder"]
+    set_dataset_layout(folder, config.get("layout", "tournament"))
+    reprocess_archive(archive_folder, folder=folder, encoding=config["encoding"], workers=workers,
+                      tables_config=load_tables_config(tables))
+
+def import_time():
+    from functions.startup import check_import_budget
+
+    config = load_json("config.json")
+    if not check_import_budget(config.get("import_budget_ms", 200)):
+        print("Crawl imports are over budget")
+
+def backfill(matches=None, events=None, workers=None, tables=None, stream=None):
+    from functions.backfill import backfill as backfill_matches, parse_id_ranges
+    from functions.fetching import set_request_rate
+    from functions.layout import set_dataset_layout
+    from functions.memory import enable_memory_profiling, set_memory_budget
+    from functions.streaming import stream_output
+
+    config = load_json("config.json")
+    set_request_rate(config.get("requests_per_second"))
+    set_memory_budget(config.get("memory_budget_mb"))
+    if config.get("memory_profile"):
+        enable_memory_profiling(config["memory_profile"])
+    set_dataset_layout(config["folder"], config.get("layout", "tournament"))
+    with stream_output(stream or config.get("stream_output")):
+        backfill_matches(
+            match_ids=parse_id_ranges(matches) if matches else None,
+            event_ids=parse_id_ranges(events) if events else None,
+            folder=config["folder"],
+            encoding=config["encoding"],
+            workers=workers or config.get("workers", 1),
+            archive_folder=config.get("archive_folder"),
+            tables_config=load_tables_config(tables),
+            state_path=config.get("state_path", "state.sqlite"),
+        )
+
+def refresh(workers=None, force=False, tables=None):
+    from functions.fetching import set_request_rate
+    from functions.layout import set_dataset_layout
+    from functions.refresh import refresh_matches
+
+    config = load_json("config.json")
+    set_request_rate(config.get("requests_per_second"))
+    set_dataset_layout(config["folder"], config.get("layout", "tournament"))
+    refresh_matches(
+        folder=config["folder"],
+        encoding=config["encoding"],
+        state_path=config.get("state_path", "state.sqlite"),
+        workers=workers or config.get("workers", 1),
+        archive_folder=config.get("archive_folder"),
+        tables_config=load_tables_config(tables),
+        force=force,
+    )
+
+def retry(workers=None, tables=None):
+    from functions.fetching import set_request_rate
+    from functions.layout import set_dataset_layout
+    from functions.retry import retry_failures
 
-    for key in config["url"].keys():
-        for url in config["url"][key]:
-            urls.append(url)
+    config = load_json("config.json")
+    set_request_rate(config.get("requests_per_second"))
+    set_dataset_layout(config["folder"], config.get("layout", "tournament"))
+    retry_failures(
+        folder=config["folder"],
+        encoding=config["encoding"],
+        state_path=config.get("state_path", "state.sqlite"),
+        workers=workers or config.get("workers", 1),
+        archive_folder=config.get("archive_folder"),
+        tables_config=load_tables_config(tables),
+    )
 
-    for matches_page_url in urls:
-        if matches_page_url not in processed_url:
-            print(matches_page_url)
-            matches_links = link_extractor(matches_page_url)
-            for match_url in matches_links:
-                process_match(match_url, folder, encoding)
+def export(export_folder=None, tables=None):
+    from functions.export import export_delta
+
+    config = load_json("config.json")
+    export_folder = export_folder or config.get("export_folder")
+    if export_folder is None:
+        print("Set export_folder in config.json or use --to")
+        return
+
+    export_delta(
+        folder=config["folder"],
+        export_folder=export_folder,
+        state_path=config.get("state_path", "state.sqlite"),
+        tables=parse_tables(tables) if tables else None,
+        encoding=config["encoding"],
+    )
+
+def features(compact=False):
+    from functions.features import compact_feature_matrix, update_feature_matrix
+
+    config = load_json("config.json")
+    added = update_feature_matrix(folder=config["folder"], encoding=config["encoding"])
+    print(f"{added} maps added to the feature matrix")
+    if compact:
+        compact_feature_matrix(folder=config["folder"])
 
-            config["processed_url"].append(matches_page_url)
-            with open("config.json", "w") as outfile:
-                json.dump(config, outfile,indent=4)
+def report(report_folder=None, workers=None):
+    from functions.reports import build_reports
+
+    config = load_json("config.json")
+    build_reports(
+        folder=config["folder"],
+        report_folder=report_folder or config.get("report_folder", "reports"),
+        encoding=config["encoding"],
+        workers=workers,
+    )
+
+def compact_state():
+    from functions.state import compact_state as compact
+
+    config = load_json("config.json")
+    compact(config.get("state_path", "state.sqlite"))
+
+def load_test(workers=4, requests_per_second=None, latency=0.05, error_rate=0.0, throttle_rate=0.0):
+    from functions.loadtest import run_load_test
+
+    config = load_json("config.json")
+    archive_folder = config.get("archive_folder")
+    if archive_folder is None:
+        print("Set archive_folder in config.json")
+        return
 
-    print("Done processing")
+    run_load_test(archive_folder, workers=workers, requests_per_second=requests_per_second, latency=latency,
+                  error_rate=error_rate, throttle_rate=throttle_rate)
 
-main()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="vlr.gg scraper")
+    commands = parser.add_subparsers(dest="command")
+    crawl_parser = commands.add_parser("crawl", help="crawl the events in config.json (default)")
+    crawl_parser.add_argument("--tables", help="comma separated tables to extract, defaults to tables_config.json")
+    crawl_parser.add_argument("--stream", help="stream the rows as json lines to - (stdout), a named pipe or a file")
+    reprocess_parser = commands.add_parser("reprocess", help="rebuild the csv from the raw html archive")
+    reprocess_parser.add_argument("--folder", help="output folder, defaults to the config folder")
+    reprocess_parser.add_argument("--workers", type=int, help="number of processes, defaults to the number of cores")
+    reprocess_parser.add_argument("--tables", help="comma separated tables to extract, defaults to tables_config.json")
+    commands.add_parser("import-time", help="measure the crawl imports against import_budget_ms")
+    backfill_parser = commands.add_parser("backfill", help="crawl match ids or event ids without editing config.json")
+    backfill_parser.add_argument("--matches", help="match ids and ranges, e.g. 427000-427100,428005")
+    backfill_parser.add_argument("--events", help="event ids, e.g. 2347,2380")
+    backfill_parser.add_argument("--workers", type=int, help="matches crawled at the same time, defaults to config.json")
+    backfill_parser.add_argument("--tables", help="comma separated tables to extract, defaults to tables_config.json")
+    backfill_parser.add_argument("--stream", help="stream the rows as json lines to - (stdout), a named pipe or a file")
+    refresh_parser = commands.add_parser("refresh", help="extract again the stored matches changed on vlr.gg")
+    refresh_parser.add_argument("--workers", type=int, help="matches checked at the same time, defaults to config.json")
+    refresh_parser.add_argument("--force", action="store_true", help="extract all the stored matches again")
+    refresh_parser.add_argument("--tables", help="comma separated tables to extract, defaults to tables_config.json")
+    retry_parser = commands.add_parser("retry", help="retry the matches saved in error_match")
+    retry_parser.add_argument("--workers", type=int, help="matches retried at the same time, defaults to config.json")
+    retry_parser.add_argument("--tables", help="comma separated tables to extract, defaults to tables_config.json")
+    export_parser = commands.add_parser("export", help="export the rows added since the last export")
+    export_parser.add_argument("--to", help="export folder, defaults to export_folder in config.json")
+    export_parser.add_argument("--tables", help="comma separated tables to export, defaults to all")
+    features_parser = commands.add_parser("features", help="add the new maps to the per map feature matrix")
+    features_parser.add_argument("--compact", action="store_true", help="merge the matrix chunks into one file")
+    report_parser = commands.add_parser("report", help="draft, side win and player tables and charts per tournament")
+    report_parser.add_argument("--to", help="report folder, defaults to report_folder in config.json")
+    report_parser.add_argument("--workers", type=int, help="number of processes, defaults to the number of cores")
+    commands.add_parser("compact-state", help="compact the run state store")
+    load_test_parser = commands.add_parser("load-test", help="crawl the archived pages from a local replay server")
+    load_test_parser.add_argument("--workers", type=int, default=4)
+    load_test_parser.add_argument("--rps", type=float, help="global requests per second limit")
+    load_test_parser.add_argument("--latency", type=float, default=0.05, help="mean response time in seconds")
+    load_test_parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    load_test_parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429 responses")
+    args = parser.parse_args()
 
+    if args.command == "reprocess":
+        reprocess(folder=args.folder, workers=args.workers, tables=args.tables)
+    elif args.command == "import-time":
+        import_time()
+    elif args.command == "backfill":
+        backfill(matches=args.matches, events=args.events, workers=args.workers, tables=args.tables,
+                 stream=args.stream)
+    elif args.command == "refresh":
+        refresh(workers=args.workers, force=args.force, tables=args.tables)
+    elif args.command == "retry":
+        retry(workers=args.workers, tables=args.tables)
+    elif args.command == "export":
+        export(export_folder=args.to, tables=args.tables)
+    elif args.command == "features":
+        features(compact=args.compact)
+    elif args.command == "report":
+        report(report_folder=args.to, workers=args.workers)
+    elif args.command == "compact-state":
+        compact_state()
+    elif args.command == "load-test":
+        load_test(workers=args.workers, requests_per_second=args.rps, latency=args.latency,
+                  error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    else:
+        main(tables=getattr(args, "tables", None), stream=getattr(args, "stream", None))
@@ -0,0 +1,29 @@
+from functions.archive import archive_page
+from functions.backfill import backfill
+from functions.fetching import set_politeness_delay
+from functions.replay_server import start_replay_server
+from functions.state import get_connection, match_registry_size
+
+THREAD_PAGE = b"""<html><head><title>Best agent for Lotus? | VLR.gg</title></head>
+<body><div class="post-header">Best agent for Lotus?</div></body></html>"""
+
+
+def test_backfill_skips_ids_that_are_not_matches(tmp_path):
+    archive_folder = str(tmp_path / "archive")
+    archive_page(archive_folder, "https://www.vlr.gg/500001/best-agent-for-lotus", THREAD_PAGE)
+    server = start_replay_server(archive_folder, latency=0)
+    state_path = str(tmp_path / "state.sqlite")
+    set_politeness_delay(False)
+    try:
+        # 500001 is a forum thread, 500002 is not found
+        result = backfill(match_ids=[500001, 500002], folder=str(tmp_path / "csv"), base_url=server.base_url,
+                          state_path=state_path)
+    finally:
+        set_politeness_delay(True)
+        server.shutdown()
+        server.server_close()
+
+    assert result["matches"] == 2
+    assert result["failed"] == []
+    assert match_registry_size(state_path) == 0
+    assert get_connection(state_path).execute("SELECT COUNT(*) FROM retry_queue").fetchone()[0] == 0